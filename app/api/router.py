@@ -1,21 +1,64 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
-from fastapi.responses import FileResponse, Response
-import httpx
-import os
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Query, Header
+from fastapi.responses import FileResponse, Response, JSONResponse
 from typing import Optional
-from app.util.validation import basic_file_validation
-from app.schemas.data_models import PreprocessingParameters, get_preprocessing_params
-from app.schemas.exceptions import PreprocessingError
-from app.core.preprocessor import preprocess
-import tempfile
+import os
+from app.util.validation import basic_file_validation, archive_file_validation
+from app.schemas.data_models import PreprocessingParameters, BatchResult, DeliveryInfo, DeliveryStatus, get_preprocessing_params
+from app.schemas.exceptions import (
+    PreprocessingError, StorageUploadError, CubeTooLargeError, ServiceOverloadedError, DatasetPathError, InvalidFileFormatError
+)
+from app.core.config import settings
+from app.core.preprocessor import preprocess, preprocess_path
+from app.core.batch import preprocess_archive, parse_manifest
+from app.core.delivery import delivery_queue
+from app.util.metrics import StageTimer
+from app.util.profiling import SamplingProfiler, ProfileStore, PROFILE_FORMATS, CURRENT_PROFILER, server_timing_header
+
+STAGE_STORAGE_DELIVERY = "storage_delivery"
 
 router = APIRouter()
+profile_store = ProfileStore(settings.PROFILE_DIR)
+
+def profiling_requested(profile: bool, x_profile: Optional[str]) -> bool:
+    """
+    Profiling has to be enabled for the whole service, and then
+    requested per request through the query parameter or the header
+    """
+    if not settings.PROFILING_ENABLED:
+        return False
+    return profile or (x_profile is not None and x_profile.lower() in ("1", "true", "yes"))
+
+async def deliver_features(df, filename: str, storage_endpoint: str) -> DeliveryInfo:
+    """
+    Hands the features over to the background delivery queue and waits
+    a short while for the upload, so fast storage still answers with a uid
+    """
+    delivery = delivery_queue.enqueue(df=df, filename=filename, storage_endpoint=storage_endpoint)
+    delivery = await delivery_queue.wait(delivery.delivery_id, settings.DELIVERY_WAIT)
+    if delivery.status == DeliveryStatus.FAILED:
+        raise StorageUploadError(detail=f"An error occured during saving the preprocessed data. {delivery.error}")
+    return delivery
+
+def delivery_response(delivery: DeliveryInfo) -> JSONResponse:
+    """The uid of the saved features, or the id of the delivery while it is still pending"""
+    if delivery.status != DeliveryStatus.DELIVERED:
+        return JSONResponse(status_code=202, content={
+            "delivery_id": delivery.delivery_id,
+            "status": delivery.status.value,
+            "message": "Image preprocessed, data is queued for saving"
+        })
+    return JSONResponse(content={
+        "uid": delivery.uid,
+        "message": "Image preprocessed and data saved successfully"
+    })
 
 @router.post("/preprocess")
 async def preprocess_data(
     params: PreprocessingParameters = Depends(get_preprocessing_params), 
     hdr_file: Optional[UploadFile] = File(None), 
-    cube_file: Optional[UploadFile] = File(None)
+    cube_file: Optional[UploadFile] = File(None),
+    profile: bool = Query(False),
+    x_profile: Optional[str] = Header(None)
 ):
     """
     The main function hosting the logic to the actual preprocessing endpoint.
@@ -31,6 +74,10 @@ async def preprocess_data(
         Header file of the data cube to be processed
     cubeFile: UploadFile
         The actual binary data of the data cube to be processed
+    profile: bool
+        Samples the request with a profiler when PROFILING_ENABLED is set, the
+        X-Profile header does the same. The response then carries a Server-Timing
+        header per stage and the id of the downloadable profile in X-Profile-Id
     """
 
     try:
@@ -44,40 +91,178 @@ async def preprocess_data(
             detail = f"Error: No storage endpoint provided"
         )
     
+    timer = StageTimer()
+    profiler = None
+    if profiling_requested(profile, x_profile):
+        profiler = SamplingProfiler(interval=settings.PROFILE_SAMPLE_INTERVAL)
+        profiler.start()
+        # The compute threads sample themselves through the profiler of the request
+        CURRENT_PROFILER.set(profiler)
+
     try: 
-        preprocessed_dataframe = await preprocess(hdr_file=hdr_file, cube_file=cube_file, params=params)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as temp_csv:
-            # can't really clean up this link through os.unlink so leaving
-            # it as is, probably don't have to do it either way since using `with``
-            csv_file_path = temp_csv.name
-            preprocessed_dataframe.to_csv(csv_file_path, index=False)
-
-            # Send the file to storage        
-            filename = hdr_file.filename.split(".")[0].lower()
-            with open(csv_file_path, "rb") as f:
-                files = {
-                    "csv": (filename+".csv", f, "text/csv")
-                }
-
-                async with httpx.AsyncClient() as client:
-                    print(f"Sending POST request to: {params.storage_endpoint} with file: {csv_file_path}")
-                    response = await client.post(params.storage_endpoint, files=files, timeout=120.0)
-                    body = response.json()
-                    if response.status_code == 200:
-                        print(f"File upload successful! Response body {body}")
-                        return {
-                            "uid": body["uid"],
-                            "message": "Image preprocessed and data saved successfully"
-                        }
-                    else: 
-                        raise HTTPException(
-                            status_code=500,
-                            detail=f"An error occured during saving the preprocessed data"
-                        )
-                       
+        preprocessed_dataframe = await preprocess(hdr_file=hdr_file, cube_file=cube_file, params=params, timer=timer)
+
+        # Storage is written to in the background, if it is slow or down
+        # the request returns the id of the pending delivery instead of the uid
+        timer.enter(STAGE_STORAGE_DELIVERY)
+        filename = hdr_file.filename.split(".")[0].lower()
+        delivery = await deliver_features(
+            df=preprocessed_dataframe,
+            filename=filename,
+            storage_endpoint=params.storage_endpoint
+        )
+        timer.stop()
+        response = delivery_response(delivery)
+
+    except (CubeTooLargeError, ServiceOverloadedError) as e:
+        raise e  # keeps the 413 and 503 status codes of the admission control
     except Exception as e:
         raise HTTPException(
             status_code=500,   
             detail = f"Error: {e}"
-        )
\ No newline at end of file
+        )
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+    if profiler is not None:
+        response.headers["Server-Timing"] = server_timing_header({**timer.durations, "total": profiler.duration})
+        response.headers["X-Profile-Id"] = profile_store.save(profiler, name=f"preprocess {hdr_file.filename}")
+        response.headers["X-Profile-Samples"] = str(profiler.sample_count)
+    return response
+
+@router.post("/preprocess/path")
+async def preprocess_dataset_path(
+    params: PreprocessingParameters = Depends(get_preprocessing_params),
+    hdr_path: Optional[str] = Form(None),
+    cube_path: Optional[str] = Form(None)
+):
+    """
+    Preprocesses a data cube that already is on the dataset volume of the
+    service instead of an uploaded one. The cube is memory mapped where it
+    is, which saves sending and copying multi-gigabyte files. Only enabled
+    when DATASET_ROOT is set
+
+    Parameters
+    ----------
+    params: PreprocessingParameters
+        Configuration for customizing the output
+    hdr_path: str
+        Path of the header file, relative to DATASET_ROOT
+    cube_path: str
+        Path of the .bin/.raw data cube file, relative to DATASET_ROOT
+    """
+    if params.storage_endpoint == "":
+        raise HTTPException(
+            status_code=400,
+            detail = f"Error: No storage endpoint provided"
+        )
+
+    try:
+        preprocessed_dataframe = await preprocess_path(hdr_path=hdr_path, cube_path=cube_path, params=params)
+        filename = os.path.basename(hdr_path).split(".")[0].lower()
+        delivery = await deliver_features(
+            df=preprocessed_dataframe,
+            filename=filename,
+            storage_endpoint=params.storage_endpoint
+        )
+    except (DatasetPathError, InvalidFileFormatError, CubeTooLargeError, ServiceOverloadedError) as e:
+        raise e  # keeps the status codes of the path validation and the admission control
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail = f"Error: {e}"
+        )
+    return delivery_response(delivery)
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = Query("speedscope")):
+    """
+    Downloads the profile of a profiled /preprocess request, either in
+    the speedscope format (open it on speedscope.app) or as collapsed
+    stacks for flamegraph.pl and similar tools
+
+    Parameters
+    ----------
+    profile_id: str
+        The id from the X-Profile-Id header of the profiled response
+    format: str
+        Either 'speedscope' or 'collapsed'
+    """
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Error: Unknown profile format '{format}', expected one of {list(PROFILE_FORMATS)}"
+        )
+    path = profile_store.find(profile_id, format)
+    if path is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Error: No profile with id '{profile_id}'"
+        )
+    _, media_type = PROFILE_FORMATS[format]
+    return FileResponse(path=path, media_type=media_type, filename=os.path.basename(path))
+
+@router.post("/preprocess/batch", response_model=BatchResult)
+async def preprocess_batch(
+    params: PreprocessingParameters = Depends(get_preprocessing_params),
+    archive_file: Optional[UploadFile] = File(None),
+    manifest: Optional[str] = Form(None)
+):
+    """
+    Preprocesses every ENVI header and data cube pair of a zip or tar
+    archive in parallel and combines the results into a single feature
+    table, with one row per cube (or per sample if multiple_samples is set).
+    The table is uploaded to the storage endpoint if one is given and
+    returned as .csv formatted text otherwise. Cubes that fail are
+    reported individually and do not fail the whole batch
+
+    Parameters
+    ----------
+    params: PreprocessingParameters
+        Configuration for customizing the output
+    archive_file: UploadFile
+        Zip or tar archive of .hdr and .raw/.bin files
+    manifest: str
+        Optional JSON list of {"hdr": ..., "cube": ...} entry pairs, by
+        default files are paired by their name without the extension
+    """
+    try:
+        archive_file_validation(archive_file=archive_file)
+        manifest_pairs = parse_manifest(manifest)
+    except PreprocessingError as e:
+        raise e  # re-raising the exception since its already formatted
+
+    try:
+        features, cubes = await preprocess_archive(
+            fileobj=archive_file.file,
+            filename=archive_file.filename,
+            params=params,
+            manifest=manifest_pairs
+        )
+    except PreprocessingError as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error: {e}"
+        )
+    finally:
+        await archive_file.close()
+
+    processed = sum(cube.status == "succeeded" for cube in cubes)
+    message = f"Preprocessed {processed} out of {len(cubes)} cubes"
+    if params.storage_endpoint == "":
+        return BatchResult(message=message, cubes=cubes, csv=features.to_csv(index=False))
+
+    try:
+        filename = archive_file.filename.split(".")[0].lower()
+        delivery = await deliver_features(df=features, filename=filename, storage_endpoint=params.storage_endpoint)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error: {e}"
+        )
+    if delivery.status != DeliveryStatus.DELIVERED:
+        return BatchResult(delivery_id=delivery.delivery_id, message=f"{message}, data is queued for saving", cubes=cubes)
+    return BatchResult(uid=delivery.uid, message=f"{message}, data saved successfully", cubes=cubes)
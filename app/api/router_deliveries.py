@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException
+from app.schemas.data_models import DeliveryInfo
+from app.core.delivery import delivery_queue
+
+router = APIRouter()
+
+@router.get("/deliveries")
+async def get_delivery_queue_status():
+    """
+    Returns the number of results waiting to be uploaded to the storage
+    service and the number of deliveries in each state
+    """
+    return {
+        "queue_depth": delivery_queue.queue_depth(),
+        "deliveries": delivery_queue.counts()
+    }
+
+@router.get("/deliveries/{delivery_id}", response_model=DeliveryInfo)
+async def get_delivery_status(delivery_id: str):
+    """
+    Returns the state of a single delivery, including the storage uid
+    once the upload succeeded
+    """
+    delivery = delivery_queue.get(delivery_id)
+    if delivery is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Error: No delivery with id '{delivery_id}'"
+        )
+    return delivery
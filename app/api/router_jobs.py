@@ -0,0 +1,88 @@
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
+from fastapi.responses import FileResponse
+from typing import Optional
+from app.util.validation import basic_file_validation
+from app.schemas.data_models import PreprocessingParameters, JobInfo, JobStatus, get_preprocessing_params
+from app.schemas.exceptions import PreprocessingError
+from app.core.jobs import job_manager
+
+router = APIRouter()
+
+def get_job_or_404(job_id: str) -> JobInfo:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Error: No job with id '{job_id}'"
+        )
+    return job
+
+@router.post("/jobs", response_model=JobInfo, status_code=202)
+async def submit_job(
+    params: PreprocessingParameters = Depends(get_preprocessing_params),
+    hdr_file: Optional[UploadFile] = File(None),
+    cube_file: Optional[UploadFile] = File(None)
+):
+    """
+    Queues a preprocessing job for the uploaded data cube and returns
+    right away with the id of the job. Unlike /preprocess, the storage
+    endpoint is optional; without one the result is kept by the service
+    and can be fetched from /jobs/{job_id}/result
+
+    Parameters
+    ----------
+    params: PreprocessingParameters
+        Configuration for customizing the output
+    hdrFile: UploadFile
+        Header file of the data cube to be processed
+    cubeFile: UploadFile
+        The actual binary data of the data cube to be processed
+    """
+    try:
+        basic_file_validation(hdr_file=hdr_file, cube_file=cube_file)
+    except PreprocessingError as e:
+        raise e  # re-raising the exception since its already formatted
+
+    try:
+        return job_manager.submit(hdr_file=hdr_file, cube_file=cube_file, params=params)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error: {e}"
+        )
+
+@router.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job_status(job_id: str):
+    """
+    Returns the status of a job and the pipeline stage it is in
+    """
+    return get_job_or_404(job_id)
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Returns the storage uid of a finished job, or the .csv formatted
+    features if the job was submitted without a storage endpoint
+    """
+    job = get_job_or_404(job_id)
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Error: The job failed. {job.error}"
+        )
+    if job.status != JobStatus.SUCCEEDED:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Error: The job is not finished yet, current status is '{job.status.value}'"
+        )
+
+    if job.uid is not None:
+        return {
+            "uid": job.uid,
+            "message": "Image preprocessed and data saved successfully"
+        }
+    return FileResponse(
+        path=job_manager.result_path(job_id),
+        media_type="text/csv",
+        filename=f"{job_id}.csv"
+    )
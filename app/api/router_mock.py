@@ -0,0 +1,95 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+import numpy as np
+from app.core.config import settings
+from app.core.preprocessor import preprocess_cube, STAGE_LOADING
+from app.schemas.data_models import (
+    PreprocessingParameters, SyntheticCubeSpec, DeliveryStatus,
+    get_preprocessing_params, get_synthetic_cube_spec
+)
+from app.schemas.exceptions import PreprocessingError
+from app.util.envi_reader import parse_envi_header, read_envi_cube
+from app.util.metrics import StageTimer, BYTES_PROCESSED
+from app.util.profiling import server_timing_header
+from app.util.synthetic_cube import generate_cube, encode_envi_cube, synthetic_cube_nbytes
+from app.api.router import deliver_features
+
+STAGE_GENERATION = "synthetic_generation"
+
+router = APIRouter()
+
+def preprocess_synthetic_cube(spec: SyntheticCubeSpec, params: PreprocessingParameters, timer: StageTimer):
+    """
+    Generates a synthetic cube, encodes it the way a camera would write it
+    and runs it through the same decoding and pipeline as an uploaded cube
+    """
+    timer.enter(STAGE_GENERATION)
+    wavelengths = np.linspace(params.min_wavelength, params.max_wavelength, spec.bands)
+    cube = generate_cube(spec, wavelengths)
+    hdr_bytes, cube_bytes = encode_envi_cube(cube, wavelengths, spec.interleave.value)
+    del cube
+
+    timer.enter(STAGE_LOADING)
+    BYTES_PROCESSED.inc(len(hdr_bytes), kind="header")
+    BYTES_PROCESSED.inc(len(cube_bytes), kind="cube")
+    header = parse_envi_header(hdr_bytes)
+    img_data = read_envi_cube(header, cube_bytes)
+    del cube_bytes
+
+    return preprocess_cube(img_data, header, params, timer=timer)
+
+@router.post("/preprocess")
+async def preprocess_data_mock(
+    params: PreprocessingParameters = Depends(get_preprocessing_params),
+    spec: SyntheticCubeSpec = Depends(get_synthetic_cube_spec)
+):
+    """
+    Mock endpoint: Runs the real pipeline on a synthetic data cube generated
+    on the server instead of an uploaded one, for load testing with realistic
+    cube sizes. The features are delivered to the storage endpoint like in
+    production if one is given, and returned as .csv formatted text otherwise.
+    The Server-Timing header holds the time spent in each stage
+
+    Parameters
+    ----------
+    params: PreprocessingParameters
+        Configuration for customizing the output
+    spec: SyntheticCubeSpec
+        Size, band count, number of objects, data type, interleave and
+        seed of the generated cube
+    """
+    if synthetic_cube_nbytes(spec) > settings.MOCK_MAX_CUBE_MB * 1024 * 1024:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Error: The synthetic cube would exceed the limit of {settings.MOCK_MAX_CUBE_MB} MB"
+        )
+
+    timer = StageTimer()
+    try:
+        features = await run_in_threadpool(preprocess_synthetic_cube, spec, params, timer)
+        if params.storage_endpoint == "":
+            response = Response(content=features.to_csv(index=False), media_type="text/csv")
+        else:
+            delivery = await deliver_features(df=features, filename="synthetic", storage_endpoint=params.storage_endpoint)
+            if delivery.status != DeliveryStatus.DELIVERED:
+                response = JSONResponse(status_code=202, content={
+                    "delivery_id": delivery.delivery_id,
+                    "status": delivery.status.value,
+                    "message": "Synthetic image preprocessed, data is queued for saving"
+                })
+            else:
+                response = JSONResponse(content={
+                    "uid": delivery.uid,
+                    "message": "Synthetic image preprocessed and data saved successfully"
+                })
+    except PreprocessingError as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error: {e}"
+        )
+
+    response.headers["Server-Timing"] = server_timing_header(timer.durations)
+    return response
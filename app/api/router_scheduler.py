@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from app.core.scheduler import scheduler
+
+router = APIRouter()
+
+@router.get("/scheduler")
+async def get_scheduler_state():
+    """
+    Returns the compute slots, the running requests and limit of every
+    cost class and the waiting requests in the order they will be
+    scheduled, with their estimated cost and aged priority
+    """
+    return scheduler.state()
@@ -0,0 +1,129 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Request, Header, Response
+from typing import Optional
+from app.schemas.data_models import PreprocessingParameters, UploadInfo, get_preprocessing_params
+from app.schemas.exceptions import PreprocessingError, InvalidFileFormatError
+from app.core.preprocessor import preprocess_stored
+from app.core.uploads import upload_manager, parse_content_range
+from app.api.router import deliver_features, delivery_response
+
+router = APIRouter()
+
+def get_upload_or_404(upload_id: str) -> UploadInfo:
+    upload = upload_manager.get(upload_id)
+    if upload is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Error: No upload with id '{upload_id}'"
+        )
+    return upload
+
+@router.post("/uploads", response_model=UploadInfo, status_code=201)
+async def create_upload(
+    params: PreprocessingParameters = Depends(get_preprocessing_params),
+    hdr_file: Optional[UploadFile] = File(None),
+    cube_filename: str = Form(...),
+    cube_size: int = Form(...),
+    checksum: Optional[str] = Form(None)
+):
+    """
+    Starts a resumable upload of a large data cube. The header is sent
+    right away, the cube follows in chunks PUT to /uploads/{upload_id}
+    and is preprocessed by POST /uploads/{upload_id}/finalize
+
+    Parameters
+    ----------
+    params: PreprocessingParameters
+        Configuration for customizing the output
+    hdr_file: UploadFile
+        Header file of the data cube to be processed
+    cube_filename: str
+        Name of the .bin/.raw data cube file
+    cube_size: int
+        Size of the data cube file in bytes
+    checksum: str
+        Optional hex encoded SHA-256 of the data cube file, verified when
+        the upload is finalized
+    """
+    if hdr_file is None or not getattr(hdr_file, "filename", None):
+        raise InvalidFileFormatError(detail="The header file is missing from the request data.")
+    if params.storage_endpoint == "":
+        raise HTTPException(
+            status_code=400,
+            detail = f"Error: No storage endpoint provided"
+        )
+
+    try:
+        return upload_manager.create(
+            hdr_filename=hdr_file.filename,
+            hdr_content=await hdr_file.read(),
+            cube_filename=cube_filename,
+            size=cube_size,
+            params=params,
+            checksum=checksum
+        )
+    finally:
+        await hdr_file.close()
+
+@router.get("/uploads/{upload_id}", response_model=UploadInfo)
+async def get_upload(upload_id: str):
+    """
+    Returns the byte ranges of the cube received so far, so an interrupted
+    upload can continue with the missing ones
+    """
+    return get_upload_or_404(upload_id)
+
+@router.put("/uploads/{upload_id}", response_model=UploadInfo)
+async def upload_chunk(upload_id: str, request: Request, content_range: Optional[str] = Header(None)):
+    """
+    Writes a chunk of the cube, the raw request body, at the offset given
+    by the Content-Range header, e.g. 'bytes 0-1048575/3000000000'. Chunks
+    can be sent in any order and again after a failure
+    """
+    upload = get_upload_or_404(upload_id)
+    start, end = parse_content_range(content_range, upload.size)
+    return await upload_manager.write(upload, start, end, request.stream())
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+async def abort_upload(upload_id: str):
+    """Removes an upload and everything received for it"""
+    get_upload_or_404(upload_id)
+    upload_manager.remove(upload_id)
+    return Response(status_code=204)
+
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """
+    Verifies that the whole cube was received and matches its checksum,
+    then preprocesses it in place and saves the features to the storage
+    endpoint given when the upload was created, like /preprocess. The
+    upload is removed once the features are handed over for delivery,
+    after a failure it is kept until it expires or is deleted
+    """
+    upload = get_upload_or_404(upload_id)
+    # Hashing a cube of several gigabytes would block the event loop
+    cube_digest = await asyncio.to_thread(upload_manager.verify, upload_id)
+
+    try:
+        preprocessed_dataframe = await preprocess_stored(
+            hdr_path=upload_manager.hdr_path(upload_id),
+            cube_path=upload_manager.cube_path(upload),
+            params=upload.params,
+            cube_digest=cube_digest
+        )
+        filename = upload.hdr_filename.split(".")[0].lower()
+        delivery = await deliver_features(
+            df=preprocessed_dataframe,
+            filename=filename,
+            storage_endpoint=upload.params.storage_endpoint
+        )
+    except PreprocessingError as e:
+        raise e  # the upload is kept, so finalize can be retried until it expires
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail = f"Error: {e}"
+        )
+
+    upload_manager.remove(upload_id)
+    return delivery_response(delivery)
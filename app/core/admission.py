@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional
+import numpy as np
+import spectral.io.envi as envi
+from app.core.config import settings
+from app.schemas.exceptions import CubeTooLargeError, ServiceOverloadedError, InvalidFileFormatError
+from app.util.metrics import MEMORY_BUDGET, ADMISSIONS, REQUEST_PEAK_RSS, MEMORY_ESTIMATE_RATIO
+
+# Memory a request needs besides its arrays: parsing, pandas, the response
+REQUEST_OVERHEAD_BYTES = 32 * 1024 * 1024
+# Segmentation keeps the RGB rendering, the model activations and the cut out samples
+SEGMENTATION_OVERHEAD_BYTES = 512 * 1024 * 1024
+RSS_SAMPLE_INTERVAL = 0.01
+CALIBRATION_MIN_OBSERVATIONS = 5
+CALIBRATION_SMOOTHING = 0.2
+CALIBRATION_LIMITS = (0.5, 4.0)
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionMode(Enum):
+    IN_MEMORY = "in_memory"  # The whole cube is loaded and resampled in memory
+    TILED = "tiled"  # The cube is memory mapped and resampled a block of rows at a time
+
+
+def cube_dimensions(header: dict) -> tuple[int, int, int, int]:
+    """Returns rows, cols, bands and the bytes per value of the cube described by an ENVI header"""
+    try:
+        params = envi.gen_params(header)
+    except KeyError as e:
+        raise InvalidFileFormatError(detail=f"The ENVI header is missing the required field {e}.")
+    except (ValueError, TypeError) as e:
+        raise InvalidFileFormatError(detail=f"The ENVI header contains an invalid value. Exception: {e}")
+    return params.nrows, params.ncols, params.nbands, np.dtype(params.dtype).itemsize
+
+
+def estimate_peak_memory(header: dict, target_bands: int, mode: ExecutionMode, multiple_samples: bool = False, tile_rows: int = 64) -> int:
+    """
+    Estimates the peak memory in bytes that preprocessing the cube described
+    by the header takes in the given mode, before anything is loaded
+    """
+    (rows, cols, bands, itemsize) = cube_dimensions(header)
+    float_size = np.dtype(np.float32).itemsize
+
+    if mode == ExecutionMode.TILED:
+        # One tile as read from the file and as float32, the resampled tile
+        # and the masked pixels taken from it, plus the intensity band
+        tile_pixels = min(tile_rows, rows) * cols
+        peak = tile_pixels * (bands * (itemsize + float_size) + 2 * target_bands * float_size) + rows * cols * float_size
+    else:
+        pixels = rows * cols
+        # Loading holds the cube as read and as float32, later the float32
+        # cube, the resampled cube and the masked pixels taken from it
+        loading = pixels * bands * (itemsize + float_size)
+        extraction = pixels * float_size * (bands + 2 * target_bands)
+        peak = max(loading, extraction)
+        if multiple_samples:
+            peak += pixels * target_bands * float_size + SEGMENTATION_OVERHEAD_BYTES
+
+    return peak + REQUEST_OVERHEAD_BYTES
+
+
+def read_rss() -> Optional[int]:
+    """Resident memory of this process in bytes, None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def detect_memory_limit() -> Optional[int]:
+    """Memory limit of the container from the cgroup v2 or v1 files, None if unlimited"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "unlimited" as a huge number
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+        return None
+    return None
+
+
+@dataclass
+class Reservation:
+    estimate: int  # Calibrated estimate, the amount reserved from the budget
+    raw_estimate: int
+    mode: ExecutionMode
+    start_rss: Optional[int] = None
+    peak_rss: Optional[int] = None
+    shared: bool = False  # Whether other requests ran at the same time, their memory would show up in the RSS
+    granted: bool = False
+    loop: Optional[asyncio.AbstractEventLoop] = field(default=None, repr=False)
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    @property
+    def observed_peak(self) -> Optional[int]:
+        if self.start_rss is None or self.peak_rss is None:
+            return None
+        return max(self.peak_rss - self.start_rss, 0)
+
+
+class MemoryBudget:
+    """
+    Admits requests against a global memory budget. Every request reserves
+    its estimated peak memory before its cube is loaded and releases it when
+    it is done. Requests that do not fit are downgraded to the tiled mode
+    if that fits, queue in arrival order otherwise and are rejected when the
+    wait times out or when they could never fit. Usable from any thread and
+    event loop, the job workers run their own loops
+
+    While requests are running, a background thread samples the RSS of the
+    process. The peak of requests that ran alone calibrates the estimates
+    """
+    def __init__(self, total: Optional[int], queue_timeout: float):
+        self.total = total
+        self.queue_timeout = queue_timeout
+        self.reserved = 0
+        self.calibration = 1.0
+        self.observations = 0
+        self._lock = threading.Lock()
+        self._waiting: deque[Reservation] = deque()
+        self._running: dict[int, Reservation] = {}
+        self._sampler: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.total is not None
+
+    def calibrated(self, estimate: int) -> int:
+        if self.observations < CALIBRATION_MIN_OBSERVATIONS:
+            return estimate
+        return int(estimate * self.calibration)
+
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def _fits(self, amount: int) -> bool:
+        return self.reserved + amount <= self.total
+
+    def _grant(self, reservation: Reservation):
+        self.reserved += reservation.estimate
+        reservation.granted = True
+        reservation.start_rss = read_rss()
+        reservation.peak_rss = reservation.start_rss
+        reservation.shared = bool(self._running)
+        for other in self._running.values():
+            other.shared = True
+        self._running[id(reservation)] = reservation
+        if self._sampler is None and reservation.start_rss is not None:
+            self._sampler = threading.Thread(target=self._sample_rss, name="rss-sampler", daemon=True)
+            self._sampler.start()
+
+    def _try_grant(self, reservation: Reservation) -> bool:
+        # Nobody jumps the queue, so large requests do not starve
+        if self._waiting or not self._fits(reservation.estimate):
+            return False
+        self._grant(reservation)
+        return True
+
+    async def admit(self, header: dict, target_bands: int, multiple_samples: bool, tiled_allowed: bool = True) -> Reservation:
+        """
+        Reserves the memory for a request and returns the reservation with
+        the execution mode to use. Raises CubeTooLargeError if the request
+        can never fit the budget and ServiceOverloadedError if it did not
+        fit within the queue timeout
+        """
+        in_memory_estimate = estimate_peak_memory(header, target_bands, ExecutionMode.IN_MEMORY, multiple_samples, settings.TILE_ROWS)
+        in_memory = Reservation(self.calibrated(in_memory_estimate), in_memory_estimate, ExecutionMode.IN_MEMORY)
+        if not self.enabled:
+            return in_memory
+
+        # The tiled mode cannot segment multiple samples, the model needs the whole image
+        tiled = None
+        if tiled_allowed and not multiple_samples:
+            tiled_estimate = estimate_peak_memory(header, target_bands, ExecutionMode.TILED, tile_rows=settings.TILE_ROWS)
+            tiled = Reservation(self.calibrated(tiled_estimate), tiled_estimate, ExecutionMode.TILED)
+
+        with self._lock:
+            if self._try_grant(in_memory):
+                ADMISSIONS.inc(decision="admitted")
+                return in_memory
+            if tiled is not None and self._try_grant(tiled):
+                ADMISSIONS.inc(decision="downgraded")
+                logger.info("Downgraded request to the tiled mode", extra={"estimate": in_memory.estimate, "reserved": self.reserved})
+                return tiled
+
+            # Queue for the in-memory mode if it can fit at all, the tiled one otherwise
+            if in_memory.estimate <= self.total:
+                reservation = in_memory
+            elif tiled is not None and tiled.estimate <= self.total:
+                reservation = tiled
+            else:
+                ADMISSIONS.inc(decision="rejected")
+                needed = (tiled or in_memory).estimate
+                raise CubeTooLargeError(
+                    detail=f"Processing the data cube needs about {needed / 1024 / 1024:.0f} MB of memory, "
+                           f"more than the {self.total / 1024 / 1024:.0f} MB this service may use."
+                )
+            reservation.loop = asyncio.get_running_loop()
+            reservation.future = reservation.loop.create_future()
+            self._waiting.append(reservation)
+
+        ADMISSIONS.inc(decision="queued")
+        try:
+            await asyncio.wait_for(asyncio.shield(reservation.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # Cancelled while waiting, give back what was granted in the meantime
+            self._leave_queue(reservation)
+            self.release(reservation)
+            raise
+        self._leave_queue(reservation)
+
+        if not reservation.granted:
+            ADMISSIONS.inc(decision="timed_out")
+            raise ServiceOverloadedError(
+                detail=f"Not enough memory became available within {self.queue_timeout:.0f} seconds, try again later."
+            )
+        return reservation
+
+    def _leave_queue(self, reservation: Reservation):
+        with self._lock:
+            if not reservation.granted and reservation in self._waiting:
+                self._waiting.remove(reservation)
+                # The next ones in the queue might fit now
+                self._wake_waiting()
+
+    def _wake_waiting(self):
+        while self._waiting and self._fits(self._waiting[0].estimate):
+            reservation = self._waiting.popleft()
+            self._grant(reservation)
+            reservation.loop.call_soon_threadsafe(_set_result, reservation.future)
+
+    def release(self, reservation: Reservation):
+        if not self.enabled or not reservation.granted:
+            return
+        with self._lock:
+            self.reserved -= reservation.estimate
+            reservation.granted = False
+            self._running.pop(id(reservation), None)
+            self._wake_waiting()
+        self._observe(reservation)
+
+    def _observe(self, reservation: Reservation):
+        observed = reservation.observed_peak
+        if observed is None:
+            return
+        REQUEST_PEAK_RSS.observe(observed, mode=reservation.mode.value)
+        ratio = observed / reservation.raw_estimate
+        MEMORY_ESTIMATE_RATIO.observe(ratio, mode=reservation.mode.value)
+        if reservation.shared:
+            return
+
+        with self._lock:
+            if self.observations == 0:
+                self.calibration = ratio
+            else:
+                self.calibration += CALIBRATION_SMOOTHING * (ratio - self.calibration)
+            self.calibration = min(max(self.calibration, CALIBRATION_LIMITS[0]), CALIBRATION_LIMITS[1])
+            self.observations += 1
+
+    def _sample_rss(self):
+        while True:
+            with self._lock:
+                if not self._running:
+                    self._sampler = None
+                    return
+                rss = read_rss()
+                for reservation in self._running.values():
+                    if rss is not None and (reservation.peak_rss is None or rss > reservation.peak_rss):
+                        reservation.peak_rss = rss
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+def _set_result(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+def configured_budget() -> Optional[int]:
+    """The memory budget in bytes, from the settings or the container limit, None if unlimited"""
+    if settings.MEMORY_BUDGET_MB > 0:
+        return settings.MEMORY_BUDGET_MB * 1024 * 1024
+    limit = detect_memory_limit()
+    if limit is None:
+        return None
+    return int(limit * settings.MEMORY_BUDGET_FRACTION)
+
+
+memory_budget = MemoryBudget(total=configured_budget(), queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT)
+MEMORY_BUDGET.set_function(lambda: memory_budget.total or 0, state="total")
+MEMORY_BUDGET.set_function(lambda: memory_budget.reserved, state="reserved")
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import json
+import os
+import tarfile
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Iterator, Optional
+from app.core.config import settings
+from app.core.preprocessor import preprocess_cube
+from app.schemas.data_models import PreprocessingParameters, BatchCubeResult
+from app.schemas.exceptions import PreprocessingError, InvalidFileFormatError
+from app.util.envi_reader import parse_envi_header, read_envi_cube
+from app.util.log import configure_logging
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+CUBE_EXTENSIONS = (".raw", ".bin")
+CUBE_NAME_COLUMN = "cube_name"
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_batch_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # The logging listener thread does not survive the fork, so every
+        # worker process sets up its own
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.BATCH_WORKERS or os.cpu_count(),
+            initializer=configure_logging,
+            initargs=(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_QUEUE_SIZE)
+        )
+    return _executor
+
+def shutdown_batch_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def parse_manifest(manifest: Optional[str]) -> Optional[list[dict]]:
+    """
+    Parses a JSON manifest of the form [{"hdr": "a.hdr", "cube": "a.raw"}, ...]
+    pairing archive entries whose names do not match. An optional "name"
+    key overrides the name the cube is reported under
+    """
+    if not manifest:
+        return None
+    try:
+        pairs = json.loads(manifest)
+    except json.JSONDecodeError:
+        raise PreprocessingError(detail="Invalid JSON for manifest")
+    if not isinstance(pairs, list) or not all(isinstance(p, dict) and "hdr" in p and "cube" in p for p in pairs):
+        raise PreprocessingError(detail="The manifest must be a list of objects with 'hdr' and 'cube' keys")
+    return pairs
+
+
+def iter_archive_entries(fileobj: BinaryIO, filename: str) -> Iterator[tuple[str, bytes]]:
+    """
+    Yields (entry name, contents) for every regular file in a zip or tar
+    archive, reading the entries one at a time straight from the archive
+    """
+    lower_name = filename.lower()
+    if lower_name.endswith(ZIP_EXTENSIONS):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, archive.read(info)
+    elif lower_name.endswith(TAR_EXTENSIONS):
+        # Stream mode, the archive is read front to back exactly once
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise InvalidFileFormatError(detail="Invalid archive file extension. Only zip and tar archives are supported.")
+
+
+def iter_cube_pairs(
+    entries: Iterable[tuple[str, bytes]],
+    manifest: Optional[list[dict]] = None
+) -> Iterator[tuple[str, Optional[bytes], Optional[bytes]]]:
+    """
+    Groups archive entries into (name, header bytes, cube bytes) pairs,
+    yielding each pair as soon as both of its files have been read.
+    Without a manifest, a .hdr and a .raw/.bin entry are paired by their
+    path without the extension. Incomplete pairs are yielded at the end
+    with the missing part set to None
+    """
+    pending: dict[str, dict] = {}
+    roles: dict[str, tuple[str, str]] = {}
+    if manifest is not None:
+        for pair in manifest:
+            name = pair.get("name") or os.path.splitext(pair["hdr"])[0]
+            roles[pair["hdr"]] = (name, "hdr")
+            roles[pair["cube"]] = (name, "cube")
+            pending[name] = {}
+
+    for entry_name, content in entries:
+        if manifest is not None:
+            if entry_name not in roles:
+                continue
+            name, role = roles[entry_name]
+        else:
+            stem, extension = os.path.splitext(entry_name)
+            # Skip metadata files like the ones macOS adds to archives
+            if os.path.basename(entry_name).startswith("._"):
+                continue
+            if extension.lower() == ".hdr":
+                role = "hdr"
+            elif extension.lower() in CUBE_EXTENSIONS:
+                role = "cube"
+            else:
+                continue
+            name = stem
+
+        parts = pending.setdefault(name, {})
+        parts[role] = content
+        if "hdr" in parts and "cube" in parts:
+            del pending[name]
+            yield name, parts["hdr"], parts["cube"]
+
+    for name, parts in pending.items():
+        yield name, parts.get("hdr"), parts.get("cube")
+
+
+def process_cube_pair(
+    name: str,
+    hdr_bytes: bytes,
+    cube_bytes: bytes,
+    params: PreprocessingParameters
+) -> tuple[Optional["pd.DataFrame"], Optional[str]]:
+    """
+    Preprocesses a single cube of a batch entirely in memory. Runs in a
+    worker process, so errors are returned instead of raised
+    """
+    try:
+        header = parse_envi_header(hdr_bytes)
+        img_data = read_envi_cube(header, cube_bytes)
+        logger.debug("Loaded batch cube", extra={"cube_name": name, "cube_shape": list(img_data.shape)})
+
+        df = preprocess_cube(img_data, header, params)
+        df.insert(0, CUBE_NAME_COLUMN, name)
+        return df, None
+    except PreprocessingError as e:
+        return None, e.detail
+    except Exception as e:
+        return None, f"Unexpected error occurred during processing. Exception: {e}"
+
+
+async def preprocess_archive(
+    fileobj: BinaryIO,
+    filename: str,
+    params: PreprocessingParameters,
+    manifest: Optional[list[dict]] = None,
+    executor: Optional[Executor] = None
+) -> tuple["pd.DataFrame", list[BatchCubeResult]]:
+    """
+    Preprocesses every cube of an archive in parallel and returns the
+    combined feature table, with the name of the source cube in the first
+    column, together with the outcome for each cube in archive order
+    """
+    loop = asyncio.get_running_loop()
+    executor = executor or get_batch_executor()
+    max_in_flight = 2 * (getattr(executor, "_max_workers", None) or os.cpu_count())
+
+    names: list[str] = []
+    futures: list[asyncio.Future] = []
+    for name, hdr_bytes, cube_bytes in iter_cube_pairs(iter_archive_entries(fileobj, filename), manifest):
+        names.append(name)
+        if hdr_bytes is None or cube_bytes is None:
+            missing = "header" if hdr_bytes is None else "data cube"
+            future = loop.create_future()
+            future.set_result((None, f"The archive is missing the {missing} file for '{name}'"))
+            futures.append(future)
+            continue
+
+        # Bound the number of cubes held in memory while the workers catch up
+        while sum(not f.done() for f in futures) >= max_in_flight:
+            await asyncio.wait([f for f in futures if not f.done()], return_when=asyncio.FIRST_COMPLETED)
+        futures.append(loop.run_in_executor(executor, process_cube_pair, name, hdr_bytes, cube_bytes, params))
+
+    if not futures:
+        raise InvalidFileFormatError(detail="The archive does not contain any ENVI header and data cube pairs.")
+
+    results = []
+    frames = []
+    for name, (df, error) in zip(names, await asyncio.gather(*futures)):
+        if error is None:
+            frames.append(df)
+            results.append(BatchCubeResult(name=name, status="succeeded", rows=len(df)))
+        else:
+            results.append(BatchCubeResult(name=name, status="failed", error=error))
+
+    import pandas as pd
+    combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=[CUBE_NAME_COLUMN])
+    return combined, results
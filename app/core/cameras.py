@@ -0,0 +1,126 @@
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from numpy import ndarray
+from pydantic import BaseModel, Field, ValidationError, model_validator
+from app.core.config import settings
+from app.core.resampling import resize_wavelengths, resampling_operator
+from app.schemas.exceptions import CameraProfileError
+from app.util.cube_slicer import DEFAULT_RGB_BANDS
+
+DEFAULT_PROFILES_FILE = Path(__file__).resolve().parent / "camera_profiles.json"
+WAVELENGTH_TOLERANCE = 1.0  # Nanometers the header wavelengths may differ from the profile
+
+logger = logging.getLogger(__name__)
+
+
+class CameraProfile(BaseModel):
+    """
+    Definition of a camera, either with the wavelength of every band or
+    with the range its bands are evenly spread over
+    """
+    description: str = ""
+    wavelengths: list[float] = []
+    min_wavelength: Optional[float] = None
+    max_wavelength: Optional[float] = None
+    bands: Optional[int] = Field(None, ge=1)
+    rgb_bands: tuple[int, int, int] = DEFAULT_RGB_BANDS
+    background_threshold: float = 0.1
+
+    @model_validator(mode="after")
+    def check_wavelengths(self):
+        if not self.wavelengths:
+            if self.min_wavelength is None or self.max_wavelength is None or self.bands is None:
+                raise ValueError("Either wavelengths or min_wavelength, max_wavelength and bands are required")
+            self.wavelengths = np.linspace(self.min_wavelength, self.max_wavelength, self.bands).tolist()
+        self.bands = len(self.wavelengths)
+        if max(self.rgb_bands) >= self.bands:
+            raise ValueError(f"rgb_bands {self.rgb_bands} are out of range for {self.bands} bands")
+        return self
+
+
+class CameraPlan:
+    """
+    Everything a request from the camera needs that does not depend on
+    the cube itself, computed once instead of for every request. The
+    resampling operators are compiled per target band count and kind
+    """
+    def __init__(self, name: str, profile: CameraProfile):
+        self.name = name
+        self.profile = profile
+        self.wavelengths: ndarray = np.array(profile.wavelengths)
+        self._resampling: dict[tuple[int, str], tuple[ndarray, ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def resampling(self, target_bands: int, kind: str) -> tuple[ndarray, ndarray]:
+        """Returns the target wavelengths and the resampling operator to them"""
+        key = (target_bands, kind)
+        with self._lock:
+            if key not in self._resampling:
+                target_wavelengths = resize_wavelengths(self.wavelengths, target_bands)
+                operator = resampling_operator(self.wavelengths, target_wavelengths, kind).astype(np.float32)
+                operator.flags.writeable = False
+                self._resampling[key] = (target_wavelengths, operator)
+            return self._resampling[key]
+
+    def validate(self, metadata: dict):
+        """Raises a CameraProfileError if the header does not describe a cube of this camera"""
+        bands = int(metadata.get("bands", 0))
+        if bands != self.profile.bands:
+            raise CameraProfileError(detail=f"The cube has {bands} bands, the {self.name} camera has {self.profile.bands}.")
+        if metadata.get("wavelength"):
+            try:
+                wavelengths = np.array([float(w) for w in metadata["wavelength"]])
+            except ValueError:
+                raise CameraProfileError(detail="Wavelengths in the header file are not valid numbers.")
+            if len(wavelengths) != bands or not np.allclose(wavelengths, self.wavelengths, rtol=0, atol=WAVELENGTH_TOLERANCE):
+                raise CameraProfileError(detail=f"The wavelengths in the header file do not match the {self.name} camera.")
+
+
+class CameraRegistry:
+    """
+    The camera profiles of the service, read from CAMERA_PROFILES_FILE on
+    startup or on first use. Requests name their camera with the `camera`
+    parameter
+    """
+    def __init__(self, profiles_file: str = ""):
+        self.profiles_file = profiles_file
+        self._plans: Optional[dict[str, CameraPlan]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, CameraPlan]:
+        with self._lock:
+            if self._plans is None:
+                path = self.profiles_file or DEFAULT_PROFILES_FILE
+                try:
+                    with open(path) as f:
+                        profiles = {name: CameraProfile(**profile) for name, profile in json.load(f).items()}
+                except (OSError, ValueError, ValidationError) as e:
+                    raise RuntimeError(f"Could not load the camera profiles from {path}: {e}")
+                self._plans = {name.upper(): CameraPlan(name.upper(), profile) for name, profile in profiles.items()}
+                logger.info("Loaded camera profiles", extra={"cameras": list(self._plans)})
+        return self._plans
+
+    def names(self) -> list[str]:
+        return list(self.load())
+
+    def get(self, name: str) -> CameraPlan:
+        plan = self.load().get(name.upper())
+        if plan is None:
+            raise CameraProfileError(detail=f"Unknown camera '{name}', expected one of {self.names()}.")
+        return plan
+
+    def preload(self, name: str, target_bands: int, kind: str):
+        """
+        Loads the profiles, so a broken profile file fails the startup, and
+        compiles the default resampling of the camera on a background thread.
+        It needs scipy, which is kept off the startup path
+        """
+        camera = self.get(name)
+        threading.Thread(target=camera.resampling, args=(target_bands, kind), name="camera-preload", daemon=True).start()
+
+
+camera_registry = CameraRegistry(settings.CAMERA_PROFILES_FILE)
@@ -0,0 +1,85 @@
+import asyncio
+import concurrent.futures
+import copy
+import hashlib
+import logging
+import threading
+from typing import Awaitable, Callable, TypeVar
+from app.schemas.data_models import PreprocessingParameters
+from app.util.metrics import record_cache_access
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(hdr_digest: str, cube_digest: str, params: PreprocessingParameters) -> str:
+    """
+    Identifies the computation of a request by the contents of its files
+    and the parameters that change the features. Where the features are
+    delivered to does not change them
+    """
+    key = hashlib.blake2b(digest_size=16)
+    key.update(hdr_digest.encode())
+    key.update(cube_digest.encode())
+    key.update(params.model_dump_json(exclude={"storage_endpoint"}).encode())
+    return key.hexdigest()
+
+
+class RequestCoalescer:
+    """
+    Deduplicates identical requests in flight. The first request with a key
+    computes the result, requests with the same key arriving meanwhile wait
+    for it instead of computing it again, and get a copy of the result or
+    the same error. Usable from any thread and event loop, the job workers
+    run their own loops
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, concurrent.futures.Future] = {}
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[T]], on_attach: Callable[[], None] = lambda: None) -> T:
+        while True:
+            with self._lock:
+                future = self._in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = concurrent.futures.Future()
+                    self._in_flight[key] = future
+            record_cache_access("in_flight_requests", hit=not leader)
+
+            if leader:
+                return await self._lead(key, future, compute)
+
+            on_attach()
+            logger.info("Attached to an identical request in flight", extra={"request_key": key})
+            try:
+                # Shielded, cancelling this request must not cancel the shared future
+                return copy.deepcopy(await asyncio.shield(asyncio.wrap_future(future)))
+            except asyncio.CancelledError:
+                # Either this request was cancelled, or the first one was and
+                # this one computes by itself or attaches to the next one
+                if not future.cancelled():
+                    raise
+
+    async def _lead(self, key: str, future: concurrent.futures.Future, compute: Callable[[], Awaitable[T]]) -> T:
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+coalescer = RequestCoalescer()
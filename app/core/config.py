@@ -1,3 +1,4 @@
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from enum import Enum
 from dataclasses import dataclass
@@ -10,9 +11,81 @@ class PreprocessorVersion(Enum):
 class Settings(BaseSettings):
     APP_NAME: str = "Data Preprocessor Microservice"
     API_STR: str = "/preprocessor/api"
-    CAMERA_TYPE: str = "VIS"
+    CAMERA_TYPE: str = "VIS"  # Camera of the deployment, its resampling is compiled on startup, empty for none
+    CAMERA_PROFILES_FILE: str = ""  # JSON file of the camera profiles, the bundled app/core/camera_profiles.json by default
     PREPROCESSOR_VERSION: PreprocessorVersion = PreprocessorVersion.PROD 
 
+    # Logging, records are written as JSON lines or as readable text
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_QUEUE_SIZE: int = 10000  # Records beyond this are dropped instead of blocking
+
+    # Memory admission control, 0 uses MEMORY_BUDGET_FRACTION of the container
+    # memory limit, without a limit requests are not limited at all
+    MEMORY_BUDGET_MB: int = 0
+    MEMORY_BUDGET_FRACTION: float = 0.75
+    ADMISSION_QUEUE_TIMEOUT: float = 30.0  # Seconds a request waits for memory before it is rejected
+    TILE_ROWS: int = 64  # Rows of the cube processed at a time in the tiled mode
+
+    # Scheduling of the compute, shortest job first with aging. The cost of
+    # a request is the size of its cube in millions of values
+    COMPUTE_WORKERS: int = 0  # Requests computed at the same time, 0 uses one per core
+    SCHEDULER_LARGE_COST: float = 64.0  # Single sample requests above this cost are in the large class
+    SCHEDULER_AGING_RATE: float = 4.0  # Cost taken off the priority per second waited
+    SCHEDULER_CLASS_LIMITS: dict[str, int] = {"small": 0, "large": 1, "multi_sample": 1}  # 0 is only limited by COMPUTE_WORKERS
+
+    # The segmentation model is loaded in the background after startup instead
+    # of by the first multi sample request
+    PRELOAD_MODEL: bool = True
+
+    # Cubes on a mounted volume can be preprocessed in place by their path
+    # below this directory instead of being uploaded, empty disables it
+    DATASET_ROOT: str = ""
+
+    # Resumable chunked uploads, written straight into a preallocated cube file
+    UPLOAD_DIR: str = "uploads"
+    UPLOAD_MAX_MB: int = 16384
+    UPLOAD_EXPIRY: float = 86400.0  # Seconds after the last chunk an unfinished upload is removed
+
+    # Identical requests in flight, by file contents and parameters, share one computation
+    COALESCE_REQUESTS: bool = True
+
+    # Pre-fork serving with `python -m app.server`
+    SERVER_WORKERS: int = 0  # Worker processes, 0 uses one per core
+    WORKER_MAX_REQUESTS: int = 1000  # A worker is replaced after about this many requests, 0 never
+    WORKER_HEARTBEAT_TIMEOUT: float = 60.0  # Workers whose event loop stalls this long are replaced
+
+    # Asynchronous job processing
+    JOB_DIR: str = "jobs"  # Holds the SQLite job store and the uploaded files of each job
+    JOB_WORKERS: int = 2
+
+    # Background delivery of the results to the storage service
+    SPOOL_DIR: str = "spool"  # Results waiting to be delivered are kept here across restarts
+    DELIVERY_WORKERS: int = 4
+    DELIVERY_MAX_ATTEMPTS: int = 5
+    DELIVERY_RETRY_BACKOFF: float = 2.0  # Seconds before the first retry, doubled on every attempt
+    DELIVERY_WAIT: float = 10.0  # How long a request waits for its delivery before responding without a uid
+
+    # On-demand profiling of single requests, requested with the `profile`
+    # query parameter or an `X-Profile: true` header
+    PROFILING_ENABLED: bool = False
+    PROFILE_DIR: str = "profiles"
+    PROFILE_SAMPLE_INTERVAL: float = 0.005
+
+    # Synthetic cubes of the MOCK version are rejected above this size
+    MOCK_MAX_CUBE_MB: int = 4096
+
+    # Batch processing of archives, 0 uses one worker process per core
+    BATCH_WORKERS: int = 0
+
+    @field_validator("PREPROCESSOR_VERSION", mode="before")
+    @classmethod
+    def parse_preprocessor_version(cls, value):
+        # Environment variables are strings, accept both MOCK and 2
+        if isinstance(value, str):
+            return PreprocessorVersion(int(value)) if value.isdigit() else PreprocessorVersion[value.upper()]
+        return value
+
     # For loading from .env file
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
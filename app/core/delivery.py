@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+from typing import TYPE_CHECKING, Optional
+from app.core.config import settings
+from app.schemas.data_models import DeliveryInfo, DeliveryStatus
+from app.schemas.exceptions import PreprocessingError
+from app.util.storage import iter_csv_chunks, iter_file_chunks, upload_csv_chunks
+from app.util.metrics import time_stage, QUEUE_DEPTH
+
+if TYPE_CHECKING:
+    import httpx
+    from pandas import DataFrame
+
+STAGE_CSV_SERIALIZATION = "csv_serialization"
+DELIVERY_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+TERMINAL_STATUSES = (DeliveryStatus.DELIVERED, DeliveryStatus.FAILED)
+DRAIN_POLL_INTERVAL = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryQueue:
+    """
+    Delivers preprocessed feature tables to the storage service in the
+    background. Every table is spooled to a .csv file next to a .json
+    status file before it is queued, so pending deliveries survive a
+    restart. A fixed number of worker tasks on the event loop do the
+    uploads, retrying failed ones with an exponential backoff
+    """
+    def __init__(self, spool_dir: str, workers: int, max_attempts: int, retry_backoff: float):
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._deliveries: dict[str, DeliveryInfo] = {}
+        self._finished: dict[str, asyncio.Event] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, client: Optional["httpx.AsyncClient"] = None, resume: bool = True):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._client = client
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        if not resume:
+            return
+
+        # Pick up the deliveries that were still pending before a restart
+        for entry in sorted(os.listdir(self.spool_dir)):
+            if not entry.endswith(".json"):
+                continue
+            with open(os.path.join(self.spool_dir, entry)) as f:
+                delivery = DeliveryInfo.model_validate_json(f.read())
+            self._deliveries[delivery.delivery_id] = delivery
+            if delivery.status not in TERMINAL_STATUSES:
+                self._update(delivery, status=DeliveryStatus.PENDING)
+                self._queue.put_nowait(delivery.delivery_id)
+
+    async def stop(self, drain: bool = False):
+        # Draining waits for the retries as well, they are bounded by DELIVERY_MAX_ATTEMPTS
+        while drain and any(delivery.status not in TERMINAL_STATUSES for delivery in self._deliveries.values()):
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _csv_path(self, delivery_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{delivery_id}.csv")
+
+    def _info_path(self, delivery_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{delivery_id}.json")
+
+    def _update(self, delivery: DeliveryInfo, **fields):
+        for key, value in fields.items():
+            setattr(delivery, key, value)
+        delivery.updated_at = time.time()
+
+        # Write and rename so a crash never leaves a half written status file
+        temp_path = self._info_path(delivery.delivery_id) + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(delivery.model_dump_json())
+        os.replace(temp_path, self._info_path(delivery.delivery_id))
+
+    def enqueue(self, df: "DataFrame", filename: str, storage_endpoint: str) -> DeliveryInfo:
+        """
+        Spools the features to disk and queues them for delivery. Safe to
+        call from worker threads as well as from the event loop
+        """
+        if self._queue is None:
+            raise RuntimeError("The delivery queue has not been started.")
+
+        delivery_id = uuid.uuid4().hex
+        temp_path = self._csv_path(delivery_id) + ".tmp"
+        with time_stage(STAGE_CSV_SERIALIZATION), open(temp_path, "wb") as f:
+            for chunk in iter_csv_chunks(df):
+                f.write(chunk)
+        os.replace(temp_path, self._csv_path(delivery_id))
+
+        now = time.time()
+        delivery = DeliveryInfo(
+            delivery_id=delivery_id,
+            status=DeliveryStatus.PENDING,
+            filename=filename,
+            storage_endpoint=storage_endpoint,
+            created_at=now,
+            updated_at=now
+        )
+        self._update(delivery)
+        self._deliveries[delivery_id] = delivery
+        if self._in_loop_thread():
+            self._queue.put_nowait(delivery_id)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, delivery_id)
+        return delivery
+
+    def _in_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def get(self, delivery_id: str) -> Optional[DeliveryInfo]:
+        if not DELIVERY_ID_PATTERN.fullmatch(delivery_id):
+            return None
+        delivery = self._deliveries.get(delivery_id)
+        if delivery is None and os.path.exists(self._info_path(delivery_id)):
+            # Queued by another worker process of the pre-fork server
+            with open(self._info_path(delivery_id)) as f:
+                delivery = DeliveryInfo.model_validate_json(f.read())
+        return delivery
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def counts(self) -> dict[str, int]:
+        counts = {status.value: 0 for status in DeliveryStatus}
+        for delivery in self._deliveries.values():
+            counts[delivery.status.value] += 1
+        return counts
+
+    async def wait(self, delivery_id: str, timeout: float) -> DeliveryInfo:
+        """
+        Waits up to timeout seconds for a delivery to be delivered or to
+        fail for good, and returns its latest state either way
+        """
+        delivery = self._deliveries[delivery_id]
+        if delivery.status not in TERMINAL_STATUSES and timeout > 0:
+            finished = self._finished.setdefault(delivery_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._finished.pop(delivery_id, None)
+        return delivery
+
+    async def _worker(self):
+        while True:
+            delivery_id = await self._queue.get()
+            try:
+                await self._deliver(self._deliveries[delivery_id])
+            finally:
+                self._queue.task_done()
+
+    def _get_client(self) -> "httpx.AsyncClient":
+        # Created by the first delivery, so httpx is not imported at startup
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient()
+        return self._client
+
+    async def _deliver(self, delivery: DeliveryInfo):
+        self._update(delivery, status=DeliveryStatus.DELIVERING, attempts=delivery.attempts + 1)
+        try:
+            uid = await upload_csv_chunks(
+                chunks=iter_file_chunks(self._csv_path(delivery.delivery_id)),
+                filename=delivery.filename,
+                storage_endpoint=delivery.storage_endpoint,
+                client=self._get_client()
+            )
+        except Exception as e:
+            error = e.detail if isinstance(e, PreprocessingError) else f"Error: {e}"
+            if delivery.attempts >= self.max_attempts:
+                logger.error("Delivery failed for good", extra={
+                    "delivery_id": delivery.delivery_id, "attempts": delivery.attempts, "error": error
+                })
+                self._update(delivery, status=DeliveryStatus.FAILED, error=error)
+            else:
+                delay = self.retry_backoff * 2 ** (delivery.attempts - 1)
+                logger.warning("Delivery failed, retrying", extra={
+                    "delivery_id": delivery.delivery_id, "attempts": delivery.attempts, "retry_in": delay, "error": error
+                })
+                self._update(delivery, status=DeliveryStatus.PENDING, error=error)
+                self._loop.call_later(delay, self._queue.put_nowait, delivery.delivery_id)
+                return
+        else:
+            self._update(delivery, status=DeliveryStatus.DELIVERED, uid=uid, error=None)
+            os.unlink(self._csv_path(delivery.delivery_id))
+
+        if delivery.delivery_id in self._finished:
+            self._finished[delivery.delivery_id].set()
+
+
+delivery_queue = DeliveryQueue(
+    spool_dir=settings.SPOOL_DIR,
+    workers=settings.DELIVERY_WORKERS,
+    max_attempts=settings.DELIVERY_MAX_ATTEMPTS,
+    retry_backoff=settings.DELIVERY_RETRY_BACKOFF
+)
+QUEUE_DEPTH.set_function(delivery_queue.queue_depth, queue="delivery")
@@ -1,8 +1,9 @@
+import logging
 import numpy as np
 from typing import Optional
 from numpy import ndarray
-from scipy.spatial import ConvexHull
-from scipy.interpolate import interp1d
+
+logger = logging.getLogger(__name__)
 
 
 def calculate_average_spectrum(img_data: ndarray, mask: Optional[ndarray]):
@@ -18,12 +19,16 @@ def calculate_average_spectrum(img_data: ndarray, mask: Optional[ndarray]):
     return avg_spectra
 
 def calculate_continuum_removal(spectrum, wavelengths_arr):
+    # Deferred so importing the service does not load scipy
+    from scipy.spatial import ConvexHull
+    from scipy.interpolate import interp1d
+
     if not isinstance(spectrum, np.ndarray): spectrum = np.array(spectrum)
     if not isinstance(wavelengths_arr, np.ndarray): wavelengths_arr = np.array(wavelengths_arr)
 
     # Handle empty spectrum
     if spectrum.size == 0:
-        print("Warning: The given spectrum is empty, continuum removal values will be invalid")
+        logger.warning("The given spectrum is empty, continuum removal values will be invalid")
         return np.ones_like(spectrum)
 
     # Handle NaNs and Infs by interpolating/replacing them
@@ -35,7 +40,7 @@ def calculate_continuum_removal(spectrum, wavelengths_arr):
     
     # If all values are non-finite, give up (no interpolation possible)
     if np.all(non_finite_mask):
-        print("Warning: All given spectrum values are non-finite, continuum removal values will be invalid")
+        logger.warning("All given spectrum values are non-finite, continuum removal values will be invalid")
         return np.ones_like(spectrum) 
 
     # If there are some non-finite values, interpolate them
@@ -49,14 +54,14 @@ def calculate_continuum_removal(spectrum, wavelengths_arr):
                 x_coords_all[non_finite_mask], x_coords_finite, processed_spectrum[~non_finite_mask]
             )
         else: # If less than 2 finite points, cannot interpolate meaningfully
-            print("Warning: Too many NaN values to interpolate, continuum removal values will be invalid")
+            logger.warning("Too many NaN values to interpolate, continuum removal values will be invalid")
             return np.ones_like(spectrum)
 
     # Now `processed_spectrum` should be finite and ready for continuum removal
     spectrum = processed_spectrum
 
     if not np.all(np.isfinite(spectrum)) or spectrum.size == 0:
-        print("Warning: ")
+        logger.warning("The spectrum contains non-finite values after interpolation, continuum removal values will be invalid")
         return np.ones_like(spectrum)
 
     if len(spectrum) != len(wavelengths_arr):
@@ -64,7 +69,7 @@ def calculate_continuum_removal(spectrum, wavelengths_arr):
         spectrum, wavelengths_arr = spectrum[:min_len], wavelengths_arr[:min_len]
 
     if len(spectrum) < 3:
-        print("Warning: Spectrum length below 3, continuum removal values will be invalid")
+        logger.warning("Spectrum length below 3, continuum removal values will be invalid")
         return np.ones_like(spectrum)
 
     try:
@@ -84,7 +89,7 @@ def calculate_continuum_removal(spectrum, wavelengths_arr):
         processed_points = np.vstack([unique_wl_keys, unique_val_values]).T
 
         if len(processed_points) < 2: # Need at least 2 points for a line
-            print("Warning: Not enough points to form a line in continuum removal, continuum removal values will be invalid")
+            logger.warning("Not enough points to form a line in continuum removal, continuum removal values will be invalid")
             return np.ones_like(spectrum)
 
         # Check for truly flat or linear spectrum (on the processed_points)
@@ -94,10 +99,10 @@ def calculate_continuum_removal(spectrum, wavelengths_arr):
             if np.any(non_zero_dx_mask):
                 slopes = dy[non_zero_dx_mask] / dx[non_zero_dx_mask]
                 if len(slopes) > 0 and np.allclose(slopes, slopes[0], atol=1e-9):
-                    print("Warning: The spectrum is linear, continuum removal values will be invalid")
+                    logger.warning("The spectrum is linear, continuum removal values will be invalid")
                     return np.ones_like(spectrum)
             elif np.all(dy == 0):
-                print("Warning: The spectrum flat, continuum removal values will be invalid")
+                logger.warning("The spectrum flat, continuum removal values will be invalid")
                 return np.ones_like(spectrum)
 
         # Continuum Removal Rubber Band Algorithm
@@ -162,7 +167,7 @@ def calculate_continuum_removal(spectrum, wavelengths_arr):
 
         # Ensure at least 2 points for interpolation
         if len(hull_wl) < 2:
-            print("Warning: Not enough points for interpolation, continuum removal values will be invalid")
+            logger.warning("Not enough points for interpolation, continuum removal values will be invalid")
             return np.ones_like(spectrum)
 
         # --- Interpolation and Division ---
@@ -184,15 +189,15 @@ def calculate_continuum_removal(spectrum, wavelengths_arr):
             if np.any(~nan_mask):
                 final_cr_original_order[nan_mask] = np.interp(x_coords[nan_mask], x_coords[~nan_mask], final_cr_original_order[~nan_mask])
             else:
-                print("Warning: The final continuum removal values contain NaN values, continuum removal values will be invalid")
+                logger.warning("The final continuum removal values contain NaN values, continuum removal values will be invalid")
                 return np.ones_like(spectrum)
         
         if np.isnan(final_cr_original_order).any():
-            print("Warning: The final continuum removal values contain NaN values, continuum removal values will be invalid")
+            logger.warning("The final continuum removal values contain NaN values, continuum removal values will be invalid")
             return np.ones_like(spectrum)
         else:
             return final_cr_original_order
 
     except Exception as e:
-        print(f"ERROR: Unhandled exception during continuum removal: {e}")
+        logger.exception("Unhandled exception during continuum removal")
         raise e
\ No newline at end of file
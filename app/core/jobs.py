@@ -0,0 +1,226 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Optional
+from fastapi import UploadFile
+from app.core.config import settings
+from app.core.preprocessor import preprocess
+from app.schemas.data_models import PreprocessingParameters, JobInfo, JobStatus
+from app.schemas.exceptions import PreprocessingError
+from app.util.storage import upload_features
+from app.util.metrics import QUEUE_DEPTH
+from app.util.log import REQUEST_ID
+
+STAGE_UPLOAD = "upload"
+RESULT_FILENAME = "result.csv"
+
+_JOB_COLUMNS = [
+    "job_id", "status", "stage", "completed_samples", "total_samples",
+    "uid", "error", "created_at", "updated_at"
+]
+
+
+class JobStore:
+    """
+    Persistent SQLite backed store of the preprocessing jobs. A new
+    connection is opened for every operation so the store can be shared
+    between the request handlers and the worker threads
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    completed_samples INTEGER NOT NULL DEFAULT 0,
+                    total_samples INTEGER NOT NULL DEFAULT 0,
+                    uid TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    params TEXT NOT NULL,
+                    hdr_filename TEXT NOT NULL,
+                    cube_filename TEXT NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=30.0))
+
+    def create(self, job_id: str, params: PreprocessingParameters, hdr_filename: str, cube_filename: str) -> JobInfo:
+        now = time.time()
+        with self._lock, self._connect() as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, created_at, updated_at, params, hdr_filename, cube_filename) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, JobStatus.QUEUED.value, now, now, params.model_dump_json(), hdr_filename, cube_filename)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return JobInfo(**dict(zip(_JOB_COLUMNS, row)))
+
+    def get_inputs(self, job_id: str) -> tuple[PreprocessingParameters, str, str]:
+        """Returns the parameters and original file names the job was submitted with"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT params, hdr_filename, cube_filename FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        return PreprocessingParameters.model_validate_json(row[0]), row[1], row[2]
+
+    def update(self, job_id: str, **fields):
+        if not fields:
+            return
+        for key in fields:
+            if key not in _JOB_COLUMNS or key in ("job_id", "created_at"):
+                raise ValueError(f"Unknown or read-only job field '{key}'")
+        if isinstance(fields.get("status"), JobStatus):
+            fields["status"] = fields["status"].value
+        fields["updated_at"] = time.time()
+
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._connect() as conn, conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def count(self, status: JobStatus) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status.value,)).fetchone()[0]
+
+    def list_unfinished(self) -> list[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class JobManager:
+    """
+    Runs submitted preprocessing jobs on a pool of in-process worker
+    threads. The uploaded files are kept in a directory per job until
+    the job finishes, so queued jobs are picked up again after a restart
+    """
+    def __init__(self, job_dir: str, workers: int):
+        self.job_dir = job_dir
+        self.workers = workers
+        self.store: Optional[JobStore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self, resume: bool = True):
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.store = JobStore(os.path.join(self.job_dir, "jobs.sqlite3"))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="preprocess-job")
+
+        if not resume:
+            return
+
+        # Jobs that were queued or interrupted by a shutdown start over
+        for job_id in self.store.list_unfinished():
+            self.store.update(job_id, status=JobStatus.QUEUED, stage=None)
+            self._executor.submit(self._run, job_id)
+
+    def stop(self, drain: bool = False):
+        # Without draining, the queued jobs are picked up again on the next start
+        if self._executor is not None:
+            self._executor.shutdown(wait=drain, cancel_futures=not drain)
+            self._executor = None
+
+    def _job_path(self, job_id: str, *parts: str) -> str:
+        return os.path.join(self.job_dir, job_id, *parts)
+
+    def submit(self, hdr_file: UploadFile, cube_file: UploadFile, params: PreprocessingParameters) -> JobInfo:
+        if self._executor is None:
+            raise RuntimeError("The job manager has not been started.")
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._job_path(job_id))
+
+        # Store the uploads under fixed names, the original names are kept in the job store
+        hdr_path, cube_path = self._input_paths(job_id, cube_file.filename)
+        with open(hdr_path, "wb") as f:
+            shutil.copyfileobj(hdr_file.file, f)
+        with open(cube_path, "wb") as f:
+            shutil.copyfileobj(cube_file.file, f)
+
+        job = self.store.create(job_id, params, hdr_file.filename, cube_file.filename)
+        self._executor.submit(self._run, job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        return self.store.get(job_id)
+
+    def queue_depth(self) -> int:
+        return self.store.count(JobStatus.QUEUED) if self.store is not None else 0
+
+    def result_path(self, job_id: str) -> str:
+        return self._job_path(job_id, RESULT_FILENAME)
+
+    def _input_paths(self, job_id: str, cube_filename: str) -> tuple[str, str]:
+        cube_suffix = cube_filename.split(".")[-1].lower()
+        return self._job_path(job_id, "input.hdr"), self._job_path(job_id, f"input.{cube_suffix}")
+
+    def _run(self, job_id: str):
+        # Everything logged while running the job is tagged with its id
+        REQUEST_ID.set(job_id)
+        try:
+            asyncio.run(self._execute(job_id))
+        except PreprocessingError as e:
+            self.store.update(job_id, status=JobStatus.FAILED, error=e.detail)
+        except Exception as e:
+            self.store.update(job_id, status=JobStatus.FAILED, error=f"Error: {e}")
+        finally:
+            # The inputs are not needed anymore once the job is done
+            for path in self._input_paths(job_id, self.store.get_inputs(job_id)[2]):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    async def _execute(self, job_id: str):
+        params, hdr_filename, cube_filename = self.store.get_inputs(job_id)
+        self.store.update(job_id, status=JobStatus.RUNNING)
+
+        def on_stage(stage: str, completed_samples: int, total_samples: int):
+            self.store.update(job_id, stage=stage, completed_samples=completed_samples, total_samples=total_samples)
+
+        hdr_path, cube_path = self._input_paths(job_id, cube_filename)
+        hdr_file = UploadFile(filename=hdr_filename, file=open(hdr_path, "rb"))
+        cube_file = UploadFile(filename=cube_filename, file=open(cube_path, "rb"))
+
+        # preprocess closes both of the files once it is done
+        preprocessed_dataframe = await preprocess(
+            hdr_file=hdr_file, cube_file=cube_file, params=params, stage_callback=on_stage
+        )
+
+        uid = None
+        if params.storage_endpoint != "":
+            self.store.update(job_id, stage=STAGE_UPLOAD)
+            filename = hdr_filename.split(".")[0].lower()
+            uid = await upload_features(preprocessed_dataframe, filename, params.storage_endpoint)
+        else:
+            preprocessed_dataframe.to_csv(self.result_path(job_id), index=False)
+
+        self.store.update(job_id, status=JobStatus.SUCCEEDED, stage=None, uid=uid)
+
+
+job_manager = JobManager(job_dir=settings.JOB_DIR, workers=settings.JOB_WORKERS)
+QUEUE_DEPTH.set_function(job_manager.queue_depth, queue="jobs")
@@ -1,38 +1,518 @@
+import hashlib
+import logging
 import numpy as np
 import tempfile
-import shutil
 import spectral.io.envi as envi
 import os
+from typing import BinaryIO, Callable, Optional
 from numpy import ndarray
-from scipy.signal import savgol_filter
 from fastapi import UploadFile, File
 from spectral.io.envi import EnviDataFileNotFoundError
 from app.schemas.data_models import PreprocessingParameters, ExtractionMethods
-from app.schemas.exceptions import InvalidFileFormatError, DataProcessingError, BackgroundRemovalError, MissingMetadataError
+from app.schemas.exceptions import (
+    InvalidFileFormatError, DataProcessingError, BackgroundRemovalError, MissingMetadataError,
+    CubeTooLargeError, ServiceOverloadedError
+)
 from app.util.background_removal import calculate_simple_background_mask
 from app.core.extraction import calculate_average_spectrum, calculate_continuum_removal
-from app.core.resampling import resample_img_data, resize_wavelengths
+from app.core.resampling import resample_img_data, resize_wavelengths, apply_resampling_operator
+from app.core.cameras import camera_registry, CameraPlan
 from app.util.csv_utils import create_feature_row
-from app.util.validation import basic_file_validation
+from app.util.validation import basic_file_validation, dataset_file_validation
+from app.util.decompression import compression_of, open_decompressed
+from app.util.envi_reader import EnviStreamReader, parse_envi_header
 from spectral.io.envi import SpectralLibrary
 from spectral import SpyFile
 from app.util.cube_slicer import get_kiwis
+from app.util.metrics import StageTimer, BYTES_PROCESSED, CUBE_DIMENSION
+from app.core.admission import memory_budget, ExecutionMode
+from app.core.scheduler import scheduler
+from app.core.coalescing import coalescer, request_key
+from app.core.config import settings
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages reported through the stage_callback of preprocess
+STAGE_UPLOAD_SPOOL = "upload_spool"
+STAGE_COALESCED = "coalesced"  # Waiting for an identical request in flight
+STAGE_SCHEDULING = "scheduling"
+STAGE_ADMISSION = "admission"
+STAGE_LOADING = "loading"
+STAGE_SEGMENTATION = "segmentation"
+STAGE_RESAMPLING = "resampling"
+STAGE_BACKGROUND_REMOVAL = "background_removal"
+STAGE_EXTRACTION = "extraction"
+STAGE_SERIALIZATION = "serialization"
+
+def preprocess_cube(
+    img_data: ndarray,
+    metadata: dict,
+    params: PreprocessingParameters = PreprocessingParameters(),
+    stage_callback: Optional[Callable[[str, int, int], None]] = None,
+    timer: Optional[StageTimer] = None
+):
+    """
+    Runs the pipeline on an already loaded float32 data cube with shape
+    (rows, cols, bands) and its parsed ENVI header metadata, returning
+    the extracted features as a DataFrame. The time spent in each stage
+    is recorded in the given timer
+    """
+    return _run_timed(_run_pipeline, img_data, metadata, params, stage_callback, timer)
+
+def preprocess_cube_tiled(
+    cube: ndarray,
+    metadata: dict,
+    params: PreprocessingParameters = PreprocessingParameters(),
+    stage_callback: Optional[Callable[[str, int, int], None]] = None,
+    timer: Optional[StageTimer] = None,
+    tile_rows: int = 64
+):
+    """
+    Same as preprocess_cube for a single sample, but never holds more than
+    tile_rows rows of the cube in memory. The cube can be a memory mapped
+    file of any data type, tiles are converted to float32 as they are read
+    and the resampled cube is spilled to a temporary file
+    """
+    if params.multiple_samples:
+        raise DataProcessingError(detail="Multiple samples can not be segmented in the tiled mode.")
+
+    def run_pipeline(cube, metadata, params, report_stage):
+        return _run_tiled_pipeline(cube, metadata, params, report_stage, tile_rows)
+
+    return _run_timed(run_pipeline, cube, metadata, params, stage_callback, timer)
+
+def _run_timed(
+    run_pipeline: Callable,
+    cube: ndarray,
+    metadata: dict,
+    params: PreprocessingParameters,
+    stage_callback: Optional[Callable[[str, int, int], None]],
+    timer: Optional[StageTimer]
+):
+    timer = timer or StageTimer()
+
+    def report_stage(stage: str, completed_samples: int = 0, total_samples: int = 0):
+        timer.enter(stage)
+        if stage_callback is not None:
+            stage_callback(stage, completed_samples, total_samples)
+
+    try:
+        features = run_pipeline(cube, metadata, params, report_stage)
+    finally:
+        timer.stop()
+
+    logger.info("Preprocessed data cube", extra={
+        "cube_shape": list(cube.shape),
+        "samples": len(features),
+        "stage_durations": {stage: round(seconds, 4) for stage, seconds in timer.durations.items()}
+    })
+    return features
+
+def _original_wavelengths(metadata: dict, bands: int, params: PreprocessingParameters) -> ndarray:
+    """Wavelengths of the bands from the header, or spread between min/max_wavelength if there are none"""
+    if "wavelength" in metadata and metadata["wavelength"]:
+        try:
+            # Ensure the wavelengths are loaded in as float values
+            original_wavelengths = np.array([float(w) for w in metadata["wavelength"]])
+            if len(original_wavelengths) != bands:
+                raise MissingMetadataError(detail="Wavelength array lenght in the header file does not match the number of bands.")
+        except ValueError:
+            raise MissingMetadataError(detail="Wavelengths in the header file are not valid numbers.")
+    else: 
+        # If no wavelengths are provided in the header file, assume
+        # default spectrum based on the min/max_wavelength parameters
+        original_wavelengths = np.linspace(params.min_wavelength, params.max_wavelength, bands) 
+        logger.warning("No wavelengths found in HDR. Using min_wavelength and max_wavelength from parameters to generate a default spectrum")
+    return original_wavelengths
+
+def _camera_plan(metadata: dict, params: PreprocessingParameters) -> Optional[CameraPlan]:
+    """The plan of the camera the request names, after checking the cube is from it"""
+    if params.camera is None:
+        return None
+    camera = camera_registry.get(params.camera)
+    camera.validate(metadata)
+    return camera
+
+def _resampling(
+    metadata: dict,
+    bands: int,
+    params: PreprocessingParameters,
+    camera: Optional[CameraPlan]
+) -> tuple[ndarray, Callable[[ndarray], ndarray]]:
+    """The target wavelengths and a function resampling a cube to them"""
+    if camera is not None:
+        # Compiled once per camera, nothing is derived from the header
+        target_wavelengths, operator = camera.resampling(params.target_bands, params.resampling_kind)
+        return target_wavelengths, lambda img_data: apply_resampling_operator(img_data, operator)
+
+    original_wavelengths = _original_wavelengths(metadata, bands, params)
+    target_wavelengths = resize_wavelengths(original_wavelengths=original_wavelengths, target_bands=params.target_bands)
+
+    def resample(img_data: ndarray) -> ndarray:
+        return resample_img_data(
+            img_data=img_data,
+            original_wavelengths=original_wavelengths,
+            target_wavelengths=target_wavelengths,
+            kind=params.resampling_kind
+        )
+    return target_wavelengths, resample
+
+def _background_mask(img_data: ndarray, camera: Optional[CameraPlan]) -> ndarray:
+    if camera is None:
+        return calculate_simple_background_mask(img_data)
+    return calculate_simple_background_mask(img_data, camera.profile.background_threshold)
+
+def _run_tiled_pipeline(
+    cube: ndarray,
+    metadata: dict,
+    params: PreprocessingParameters,
+    report_stage: Callable[..., None],
+    tile_rows: int
+):
+    (rows, cols, bands) = cube.shape
+    for axis, size in zip(("rows", "cols", "bands"), cube.shape):
+        CUBE_DIMENSION.observe(size, axis=axis)
+
+    camera = _camera_plan(metadata, params)
+    target_wavelengths, resample = _resampling(metadata, bands, params, camera)
+
+    with tempfile.TemporaryFile() as spill_file:
+        report_stage(STAGE_RESAMPLING, 0, 1)
+        resampled = np.memmap(spill_file, dtype=np.float32, mode="w+", shape=(rows, cols, params.target_bands))
+        for start in range(0, rows, tile_rows):
+            tile = np.asarray(cube[start:start + tile_rows], dtype=np.float32)
+            resampled[start:start + tile_rows] = resample(tile)
+
+        # The mask only needs a single band, read across the whole file
+        report_stage(STAGE_BACKGROUND_REMOVAL, 0, 1)
+        mask = _background_mask(resampled, camera)
+        if params.remove_background and np.sum(mask) == 0:
+            raise BackgroundRemovalError(detail="Background removal resulted in an empty image (all pixels removed). Adjust threshold or disable.")
+
+        report_stage(STAGE_EXTRACTION, 0, 1)
+        spectrum_sum = np.zeros(params.target_bands, dtype=np.float64)
+        for start in range(0, rows, tile_rows):
+            tile_mask = mask[start:start + tile_rows]
+            spectrum_sum += np.asarray(resampled[start:start + tile_rows])[tile_mask].sum(axis=0, dtype=np.float64)
+        del resampled
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_spectrum = (spectrum_sum / np.sum(mask)).astype(np.float32)
+    extracted_features = _extract_features(avg_spectrum, target_wavelengths, params)
+
+    report_stage(STAGE_SERIALIZATION, 1, 1)
+    return create_feature_row([extracted_features], params)
+
+def _run_pipeline(
+    img_data: ndarray,
+    metadata: dict,
+    params: PreprocessingParameters,
+    report_stage: Callable[..., None]
+):
+    for axis, size in zip(("rows", "cols", "bands"), img_data.shape):
+        CUBE_DIMENSION.observe(size, axis=axis)
+
+    camera = _camera_plan(metadata, params)
+    target_wavelengths, resample = _resampling(metadata, img_data.shape[2], params, camera)
+
+    images = [img_data]
+    if params.multiple_samples:
+        report_stage(STAGE_SEGMENTATION)
+        images = get_kiwis(img_data) if camera is None else get_kiwis(img_data, camera.profile.rgb_bands)
+
+    extracted_features_array = []
+    for sample_idx, image in enumerate(images):
+        # ===============
+        # File Resampling
+        # ===============
+
+        report_stage(STAGE_RESAMPLING, sample_idx, len(images))
+
+        # Resample the data to fit target dimensions
+        image = resample(image)
+
+        # Check if the resampling was successful
+        if image.shape[2] != params.target_bands:
+            raise DataProcessingError(detail="Resampling failed to produce the target number of bands")
+
+        # ==================
+        # Background Removal
+        # ==================
+
+        report_stage(STAGE_BACKGROUND_REMOVAL, sample_idx, len(images))
+
+        # Get the mask to remove background
+        (rows, cols, bands) = image.shape
+        mask = np.ones((rows, cols), dtype=bool)
+        if not params.multiple_samples:
+            mask = _background_mask(image, camera)
+            if params.remove_background and np.sum(mask) == 0:
+                raise BackgroundRemovalError(detail="Background removal resulted in an empty image (all pixels removed). Adjust threshold or disable.")
+
+        # ================
+        # Extract Features
+        # ================
+
+        report_stage(STAGE_EXTRACTION, sample_idx, len(images))
+
+        # Average Spectrum (calculating it anyways because its used in other methods)
+        avg_spectrum = calculate_average_spectrum(img_data=image, mask=mask)
+        extracted_features = _extract_features(avg_spectrum, target_wavelengths, params)
+
+        # ===================================================
+        # Create and return DataFrame from extracted features
+        # ===================================================
+
+        # Sanity check
+        if not extracted_features:
+            raise DataProcessingError(detail="No extraction methods were selected or produced valid features.")
+
+        extracted_features_array.append(extracted_features)
+
+    report_stage(STAGE_SERIALIZATION, len(images), len(images))
+    return create_feature_row(extracted_features_array, params)
+
+def _extract_features(avg_spectrum: ndarray, target_wavelengths: ndarray, params: PreprocessingParameters) -> dict:
+    # scipy.signal alone takes longer to import than the rest of the service
+    from scipy.signal import savgol_filter
+
+    """Calculates the selected features from the average spectrum of a sample"""
+    extracted_features = dict()
+
+    # Average Spectrum (calculating it anyways because its used in other methods)
+    if ExtractionMethods.AVG_SPECTRUM in params.extraction_methods:
+        extracted_features[ExtractionMethods.AVG_SPECTRUM] = avg_spectrum
+
+
+    # 1st Derivative of Average Spectrum
+    if ExtractionMethods.FIRST_DERIV_AVG_SPECTRUM in params.extraction_methods:
+        if params.target_bands > params.sg_window_deriv and params.sg_window_deriv > params.sg_polyorder_deriv:
+            extracted_features[ExtractionMethods.FIRST_DERIV_AVG_SPECTRUM] = savgol_filter(avg_spectrum, params.sg_window_deriv, params.sg_polyorder_deriv, deriv=1) if params.target_bands > params.sg_window_deriv else np.zeros_like(avg_spectrum)
+        else:
+            raise DataProcessingError(detail="Savitzky-Golay filter parameters are invalid. Expected values: target_bands > sg_window_deriv < sg_polyorder_deriv")
+
+    # Continuum Removed from Average Spectrum (also calculating anyways because its used in other methods)
+    cr_avg_spectrum = calculate_continuum_removal(avg_spectrum, target_wavelengths)
+    if ExtractionMethods.CONTINUUM_REMOVED_AVG_SPECTRUM in params.extraction_methods:
+        extracted_features[ExtractionMethods.CONTINUUM_REMOVED_AVG_SPECTRUM] = cr_avg_spectrum
+
+    # Standard Normal Variate of Average Spectrum
+    if ExtractionMethods.SNV_AVG_SPECTRUM in params.extraction_methods:
+        if np.std(avg_spectrum) > (1e-9):
+            extracted_features[ExtractionMethods.SNV_AVG_SPECTRUM] = (avg_spectrum - np.mean(avg_spectrum)) / np.std(avg_spectrum)
+        else:
+            logger.warning("Standard deviation near zero, values might be unreliable")
+            extracted_features[ExtractionMethods.SNV_AVG_SPECTRUM] = avg_spectrum - np.mean(avg_spectrum)
+
+    # 1st Derivative of Continuum Removed Spectrum
+    if ExtractionMethods.FIRST_DERIV_CONTINUUM_REMOVED_AVG_SPECTRUM in params.extraction_methods:
+        if params.target_bands > params.sg_window_deriv and params.sg_window_deriv > params.sg_polyorder_deriv:
+            extracted_features[ExtractionMethods.FIRST_DERIV_CONTINUUM_REMOVED_AVG_SPECTRUM] = savgol_filter(cr_avg_spectrum, params.sg_window_deriv, params.sg_polyorder_deriv, deriv=1) if params.target_bands > params.sg_window_deriv else np.zeros_like(cr_avg_spectrum)
+        else:
+            raise DataProcessingError(detail="Savitzky-Golay filter parameters are invalid. Expected values: target_bands > sg_window_deriv < sg_polyorder_deriv")
+
+    return extracted_features
+
+def _spool(source, destination, digest):
+    """Copies an upload to a file, hashing it on the way"""
+    while chunk := source.read(SPOOL_CHUNK_SIZE):
+        digest.update(chunk)
+        destination.write(chunk)
+
+def _read_cube(img: SpyFile) -> ndarray:
+    """
+    Reads the cube straight from its memory mapped file into a float32
+    array with shape (rows, cols, bands), without the intermediate copies
+    of SpyFile.load
+    """
+    img_data = np.array(img.open_memmap(interleave="bip"), dtype=np.float32)
+    if img.scale_factor != 1:
+        img_data /= img.scale_factor
+    return img_data
+
+def _load_and_run(
+    img: SpyFile,
+    mode: ExecutionMode,
+    params: PreprocessingParameters,
+    stage_callback: Optional[Callable[[str, int, int], None]],
+    timer: StageTimer
+):
+    if mode == ExecutionMode.TILED:
+        cube = img.open_memmap(interleave="bip")
+        return preprocess_cube_tiled(cube, img.metadata, params, stage_callback, timer, settings.TILE_ROWS)
+
+    img_data = _read_cube(img)
+    logger.debug("Loaded data cube", extra={
+        "cube_shape": [img.nrows, img.ncols, img.nbands],
+        "cube_megabytes": round(img_data.nbytes / 1024 / 1024, 2)
+    })
+    return preprocess_cube(img_data, img.metadata, params, stage_callback, timer)
+
+def _decompress_and_run(
+    metadata: dict,
+    fileobj: BinaryIO,
+    compression: str,
+    mode: ExecutionMode,
+    params: PreprocessingParameters,
+    stage_callback: Optional[Callable[[str, int, int], None]],
+    timer: StageTimer
+):
+    with open_decompressed(fileobj, compression) as stream:
+        cube = EnviStreamReader(metadata, stream)
+        if mode == ExecutionMode.TILED:
+            # The tiles are decompressed as the pipeline reads them
+            if not cube.row_wise:
+                raise CubeTooLargeError(detail="Compressed BSQ data cubes this large can not be processed, upload it uncompressed.")
+            return preprocess_cube_tiled(cube, metadata, params, stage_callback, timer, settings.TILE_ROWS)
+
+        img_data = cube.read()
+        scale_factor = float(metadata.get("reflectance scale factor", 1))
+        if scale_factor != 1:
+            img_data /= scale_factor
+        return preprocess_cube(img_data, metadata, params, stage_callback, timer)
+
+async def _preprocess_compressed(
+    hdr_file: UploadFile,
+    cube_file: UploadFile,
+    compression: str,
+    params: PreprocessingParameters,
+    report_stage: Callable[..., None],
+    stage_callback: Optional[Callable[[str, int, int], None]],
+    timer: StageTimer
+):
+    """
+    Runs the pipeline on a compressed upload, which is decompressed while
+    the pipeline reads it instead of being written to a file first
+    """
+    hdr_content = hdr_file.file.read()
+    metadata = parse_envi_header(hdr_content)
+
+    # The compressed upload is a fraction of the size of the cube, hashing
+    # it is cheap and identifies the request for coalescing
+    cube_digest = hashlib.blake2b(digest_size=16)
+    cube_size = 0
+    while chunk := cube_file.file.read(SPOOL_CHUNK_SIZE):
+        cube_digest.update(chunk)
+        cube_size += len(chunk)
+    cube_file.file.seek(0)
+    BYTES_PROCESSED.inc(len(hdr_content), kind="header")
+    BYTES_PROCESSED.inc(cube_size, kind="cube")
+    key = request_key(hashlib.blake2b(hdr_content, digest_size=16).hexdigest(), cube_digest.hexdigest(), params)
+
+    async def compute():
+        report_stage(STAGE_SCHEDULING)
+        ticket = await scheduler.acquire(metadata, params.target_bands, params.multiple_samples)
+        try:
+            report_stage(STAGE_ADMISSION)
+            reservation = await memory_budget.admit(metadata, params.target_bands, params.multiple_samples)
+            try:
+                report_stage(STAGE_LOADING)
+                return await scheduler.run(
+                    ticket, _decompress_and_run, metadata, cube_file.file, compression, reservation.mode, params, stage_callback, timer
+                )
+            finally:
+                memory_budget.release(reservation)
+        finally:
+            scheduler.release(ticket)
+
+    return await _run_coalesced(key, compute, report_stage)
+
+async def _preprocess_files(
+    hdr_path: str,
+    cube_path: str,
+    key: str,
+    params: PreprocessingParameters,
+    report_stage: Callable[..., None],
+    stage_callback: Optional[Callable[[str, int, int], None]],
+    timer: StageTimer
+):
+    """Runs the pipeline on a header and data cube file, identified by key for coalescing"""
+    async def compute():
+        report_stage(STAGE_LOADING)
+
+        # Open the image using spectral and extract reflectance
+        # envi.open will throw an exception if the header file is
+        # in non-ENVI format
+        img: SpyFile | SpectralLibrary = envi.open(hdr_path, cube_path)
+
+        # Wait for a compute slot, cheap requests are scheduled first
+        report_stage(STAGE_SCHEDULING)
+        ticket = await scheduler.acquire(img.metadata, params.target_bands, params.multiple_samples)
+        try:
+            # Reserve the memory the request will need before loading the
+            # data, large cubes may have to wait or run in the tiled mode
+            report_stage(STAGE_ADMISSION)
+            reservation = await memory_budget.admit(img.metadata, params.target_bands, params.multiple_samples)
+            try:
+                report_stage(STAGE_LOADING)
+                return await scheduler.run(ticket, _load_and_run, img, reservation.mode, params, stage_callback, timer)
+            finally:
+                memory_budget.release(reservation)
+        finally:
+            scheduler.release(ticket)
+
+    return await _run_coalesced(key, compute, report_stage)
+
+async def _run_coalesced(key: str, compute: Callable, report_stage: Callable[..., None]):
+    """Runs compute, or waits for an identical request in flight, and converts its errors"""
+    try:
+        if not settings.COALESCE_REQUESTS:
+            return await compute()
+
+        # Retried requests for a cube still being processed wait for its result
+        return await coalescer.run(key, compute, on_attach=lambda: report_stage(STAGE_COALESCED))
+    
+    except EnviDataFileNotFoundError as e:
+        raise InvalidFileFormatError(detail=f"Error caused by non-ENVI header file. Exception: {e}")
+    except BackgroundRemovalError as e:
+        raise e
+    except MissingMetadataError as e:
+        raise e
+    except (CubeTooLargeError, ServiceOverloadedError, InvalidFileFormatError) as e:
+        raise e
+    except Exception as e:
+        raise DataProcessingError(detail=f"Unexpected error occurred during processing. Exception: {e}")
 
 async def preprocess(
     hdr_file: UploadFile = File(...),
     cube_file: UploadFile = File(...), 
-    params: PreprocessingParameters = PreprocessingParameters()
+    params: PreprocessingParameters = PreprocessingParameters(),
+    stage_callback: Optional[Callable[[str, int, int], None]] = None,
+    timer: Optional[StageTimer] = None
 ):
+    """
+    Runs the full preprocessing pipeline on an uploaded data cube and
+    returns the extracted features as a DataFrame. If given, stage_callback
+    is called with (stage, completed_samples, total_samples) every time
+    the pipeline enters a new stage, and the time spent in each stage
+    is recorded in the given timer
+    """
     temp_hdr_path = None
     temp_cube_path = None
+    timer = timer or StageTimer()
+
+    def report_stage(stage: str, completed_samples: int = 0, total_samples: int = 0):
+        timer.enter(stage)
+        if stage_callback is not None:
+            stage_callback(stage, completed_samples, total_samples)
 
     try:
         # Sanity check
         basic_file_validation(hdr_file=hdr_file, cube_file=cube_file)
 
+        # Compressed cubes are streamed into the pipeline without touching the disk
+        compression = compression_of(cube_file.filename)
+        if compression is not None:
+            return await _preprocess_compressed(hdr_file, cube_file, compression, params, report_stage, stage_callback, timer)
+
+        report_stage(STAGE_UPLOAD_SPOOL)
+
         # Create a temporary .hdr file in storage
+        hdr_digest = hashlib.blake2b(digest_size=16)
         with tempfile.NamedTemporaryFile(delete=False, suffix=".hdr") as temp_hdr:
-            shutil.copyfileobj(hdr_file.file, temp_hdr)
+            _spool(hdr_file.file, temp_hdr, hdr_digest)
             temp_hdr_path = temp_hdr.name
 
         # Ensure both the .hdr and .bin/.raw files have the same file name
@@ -41,132 +521,18 @@ async def preprocess(
         temp_cube_path = f"{base_name}.{cube_suffix}"
 
         # Create a temporary .bin/.raw file in storage
+        cube_digest = hashlib.blake2b(digest_size=16)
         with open(temp_cube_path, "wb") as temp_cube:
-            shutil.copyfileobj(cube_file.file, temp_cube)
+            _spool(cube_file.file, temp_cube, cube_digest)
+        BYTES_PROCESSED.inc(os.path.getsize(temp_hdr_path), kind="header")
+        BYTES_PROCESSED.inc(os.path.getsize(temp_cube_path), kind="cube")
 
-        try:
-            # Open the image using spectral and extract reflectance
-            # envi.open will throw an exception if the header file is
-            # in non-ENVI format
-            img: SpyFile | SpectralLibrary = envi.open(temp_hdr_path, temp_cube_path)
-            img_data: ndarray = img.load().astype(np.float32)
-            print(f"The parsed image has {img.nrows} rows, {img.ncols} columns, and {img.nbands} bands")
-            print(f"The image takes up approximately {np.round(4 * img.nrows * img.ncols * img.nbands / 1024 / 1024 * 1000) / 100} MB of memory")
-
-            images = [img_data]
-            if params.multiple_samples:
-                images = get_kiwis(img_data)
-
-            extracted_features_array = []
-            for image in images:
-                # ===============
-                # File Resampling
-                # ===============
-
-                # Get the original wavelength values for later resampling
-                original_wavelengths = None
-                if hasattr(img, "metadata") and "wavelength" in img.metadata and img.metadata["wavelength"]: 
-                    try:
-                        # Ensure the wavelengths are loaded in as float values
-                        original_wavelengths = np.array([float(w) for w in img.metadata["wavelength"]])
-                        if len(original_wavelengths) != img.nbands:
-                            raise MissingMetadataError(detail="Wavelength array lenght in the header file does not match the number of bands.")
-                    except ValueError:
-                        raise MissingMetadataError(detail="Wavelengths in the header file are not valid numbers.")
-                else: 
-                    # If no wavelengths are provided in the header file, assume
-                    # default spectrum based on the min/max_wavelength parameters
-                    original_wavelengths = np.linspace(params.min_wavelength, params.max_wavelength, img.nbands) 
-                    print("Warning: No wavelengths found in HDR. Using min_wavelength and max_wavelength from parameters to generate a default spectrum")
-
-                # Get the target wavelengths from original
-                target_wavelengths = resize_wavelengths(original_wavelengths=original_wavelengths, target_bands=params.target_bands)
-
-                # Resample the data to fit target dimensions
-                image = resample_img_data(
-                    img_data=image,
-                    original_wavelengths=original_wavelengths,
-                    target_wavelengths=target_wavelengths,
-                    kind=params.resampling_kind
-                )
-
-                # Check if the resampling was successful
-                if image.shape[2] != params.target_bands:
-                    raise DataProcessingError(detail="Resampling failed to produce the target number of bands")
-                
-                # ==================
-                # Background Removal
-                # ==================
-
-                # Get the mask to remove background
-                (rows, cols, bands) = image.shape
-                mask = np.ones((rows, cols), dtype=bool)
-                if not params.multiple_samples:
-                    mask = calculate_simple_background_mask(image)
-                    if params.remove_background and np.sum(mask) == 0:
-                        raise BackgroundRemovalError(detail="Background removal resulted in an empty image (all pixels removed). Adjust threshold or disable.")
-
-                # ================
-                # Extract Features
-                # ================
-
-                extracted_features = dict()
-                
-                # Average Spectrum (calculating it anyways because its used in other methods)
-                avg_spectrum = calculate_average_spectrum(img_data=image, mask=mask)
-                if ExtractionMethods.AVG_SPECTRUM in params.extraction_methods:
-                    extracted_features[ExtractionMethods.AVG_SPECTRUM] = avg_spectrum
-
-
-                # 1st Derivative of Average Spectrum
-                if ExtractionMethods.FIRST_DERIV_AVG_SPECTRUM in params.extraction_methods:
-                    if params.target_bands > params.sg_window_deriv and params.sg_window_deriv > params.sg_polyorder_deriv:
-                        extracted_features[ExtractionMethods.FIRST_DERIV_AVG_SPECTRUM] = savgol_filter(avg_spectrum, params.sg_window_deriv, params.sg_polyorder_deriv, deriv=1) if params.target_bands > params.sg_window_deriv else np.zeros_like(avg_spectrum)
-                    else:
-                        raise DataProcessingError(detail="Savitzky-Golay filter parameters are invalid. Expected values: target_bands > sg_window_deriv < sg_polyorder_deriv")
-            
-                # Continuum Removed from Average Spectrum (also calculating anyways because its used in other methods)
-                cr_avg_spectrum = calculate_continuum_removal(avg_spectrum, target_wavelengths)
-                if ExtractionMethods.CONTINUUM_REMOVED_AVG_SPECTRUM in params.extraction_methods:
-                    extracted_features[ExtractionMethods.CONTINUUM_REMOVED_AVG_SPECTRUM] = cr_avg_spectrum
-
-                # Standard Normal Variate of Average Spectrum
-                if ExtractionMethods.SNV_AVG_SPECTRUM in params.extraction_methods:
-                    if np.std(avg_spectrum) > (1e-9):
-                        extracted_features[ExtractionMethods.SNV_AVG_SPECTRUM] = (avg_spectrum - np.mean(avg_spectrum)) / np.std(avg_spectrum)
-                    else:
-                        print("Warning: Standard deviation near zero, values might be unreliable")
-                        extracted_features[ExtractionMethods.SNV_AVG_SPECTRUM] = avg_spectrum - np.mean(avg_spectrum)
-
-                # 1st Derivative of Continuum Removed Spectrum
-                if ExtractionMethods.FIRST_DERIV_CONTINUUM_REMOVED_AVG_SPECTRUM in params.extraction_methods:
-                    if params.target_bands > params.sg_window_deriv and params.sg_window_deriv > params.sg_polyorder_deriv:
-                        extracted_features[ExtractionMethods.FIRST_DERIV_CONTINUUM_REMOVED_AVG_SPECTRUM] = savgol_filter(cr_avg_spectrum, params.sg_window_deriv, params.sg_polyorder_deriv, deriv=1) if params.target_bands > params.sg_window_deriv else np.zeros_like(cr_avg_spectrum)
-                    else:
-                        raise DataProcessingError(detail="Savitzky-Golay filter parameters are invalid. Expected values: target_bands > sg_window_deriv < sg_polyorder_deriv")
-
-                # ===================================================
-                # Create and return DataFrame from extracted features
-                # ===================================================
-
-                # Sanity check
-                if not extracted_features:
-                    raise DataProcessingError(detail="No extraction methods were selected or produced valid features.")
-
-                extracted_features_array.append(extracted_features)
-
-            return create_feature_row(extracted_features_array, params)
-        
-        except EnviDataFileNotFoundError as e:
-            raise InvalidFileFormatError(detail=f"Error caused by non-ENVI header file. Exception: {e}")
-        except BackgroundRemovalError as e:
-            raise e
-        except MissingMetadataError as e:
-            raise e
-        except Exception as e:
-            raise DataProcessingError(detail=f"Unexpected error occurred during processing. Exception: {e}")
+        key = request_key(hdr_digest.hexdigest(), cube_digest.hexdigest(), params)
+        return await _preprocess_files(temp_hdr_path, temp_cube_path, key, params, report_stage, stage_callback, timer)
 
     finally:
+        timer.stop()
+
         # Clean up temporary files
         if temp_hdr_path and os.path.exists(temp_hdr_path):
             os.unlink(temp_hdr_path)
@@ -178,4 +544,58 @@ async def preprocess(
             await hdr_file.close()
         if hasattr(cube_file, "file") and cube_file.file:
             await cube_file.close()
-    
\ No newline at end of file
+    
+
+def _file_identity(path: str) -> str:
+    """Changes whenever the file is replaced or written to, without reading it"""
+    stat = os.stat(path)
+    return f"{path}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+async def preprocess_path(
+    hdr_path: str,
+    cube_path: str,
+    params: PreprocessingParameters = PreprocessingParameters(),
+    stage_callback: Optional[Callable[[str, int, int], None]] = None,
+    timer: Optional[StageTimer] = None
+):
+    """
+    Same as preprocess for a data cube that already is on the dataset
+    volume. The paths are relative to DATASET_ROOT and may not lead
+    outside of it, the cube is memory mapped in place instead of being
+    copied to a temporary file
+    """
+    hdr_path, cube_path = dataset_file_validation(hdr_path, cube_path, settings.DATASET_ROOT)
+    return await preprocess_stored(hdr_path, cube_path, params, stage_callback=stage_callback, timer=timer)
+
+async def preprocess_stored(
+    hdr_path: str,
+    cube_path: str,
+    params: PreprocessingParameters = PreprocessingParameters(),
+    cube_digest: Optional[str] = None,
+    stage_callback: Optional[Callable[[str, int, int], None]] = None,
+    timer: Optional[StageTimer] = None
+):
+    """
+    Same as preprocess for a header and data cube file that are already
+    on the disk of the service, processed where they are. The cube_digest,
+    if its contents were hashed anyway, identifies the cube for coalescing
+    """
+    timer = timer or StageTimer()
+
+    def report_stage(stage: str, completed_samples: int = 0, total_samples: int = 0):
+        timer.enter(stage)
+        if stage_callback is not None:
+            stage_callback(stage, completed_samples, total_samples)
+
+    try:
+        BYTES_PROCESSED.inc(os.path.getsize(hdr_path), kind="header")
+        BYTES_PROCESSED.inc(os.path.getsize(cube_path), kind="cube")
+
+        # Hashing the contents would read the whole cube, without a digest
+        # it is identified by its path and modification instead
+        with open(hdr_path, "rb") as hdr_file:
+            hdr_digest = hashlib.blake2b(hdr_file.read(), digest_size=16).hexdigest()
+        key = request_key(hdr_digest, cube_digest or _file_identity(cube_path), params)
+        return await _preprocess_files(hdr_path, cube_path, key, params, report_stage, stage_callback, timer)
+    finally:
+        timer.stop()
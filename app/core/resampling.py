@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.interpolate import interp1d
+from app.util.metrics import RESAMPLED_PIXELS
 
 def resize_wavelengths(original_wavelengths: np.ndarray, target_bands: int):
     min_wv = np.min(original_wavelengths)
@@ -28,6 +28,9 @@ def resample_img_data(
         np.ndarray: The resampled 3D reflectance data with shape
                     (height, width, target_num_bands).
     """
+    # scipy takes most of a second to import, it is only loaded once needed
+    from scipy.interpolate import interp1d
+
     height, width, bands = img_data.shape
     target_bands = len(target_wavelengths)
 
@@ -59,4 +62,43 @@ def resample_img_data(
 
             resampled_img_data[r, c, :] = resampled_pixel_spectrum
 
-    return resampled_img_data
\ No newline at end of file
+    RESAMPLED_PIXELS.inc(height * width)
+    return resampled_img_data
+
+def resampling_operator(
+    original_wavelengths: np.ndarray,
+    target_wavelengths: np.ndarray,
+    kind: str = 'linear'
+) -> np.ndarray:
+    """
+    Precomputes the resampling from the original to the target wavelengths
+    as a (original_bands, target_bands) matrix. Every interpolation kind of
+    interp1d is linear in the values it interpolates, so interpolating the
+    identity gives the weight of every original band in every target band,
+    with the same extrapolation as resample_img_data
+    """
+    from scipy.interpolate import interp1d
+
+    bands = len(original_wavelengths)
+    interpolate = interp1d(
+        original_wavelengths,
+        np.eye(bands),
+        kind=kind,
+        axis=0,
+        bounds_error=False,
+        fill_value="extrapolate"
+    )
+    return np.ascontiguousarray(interpolate(target_wavelengths).T)
+
+
+def apply_resampling_operator(img_data: np.ndarray, operator: np.ndarray) -> np.ndarray:
+    """Resamples a (height, width, bands) cube with a precomputed operator in a single matrix product"""
+    height, width, bands = img_data.shape
+    if bands != operator.shape[0]:
+        raise ValueError(
+            f"Number of bands in img_data ({bands}) "
+            f"does not match the resampling operator ({operator.shape[0]})."
+        )
+    resampled_img_data = img_data.reshape(-1, bands) @ operator.astype(img_data.dtype, copy=False)
+    RESAMPLED_PIXELS.inc(height * width)
+    return resampled_img_data.reshape(height, width, operator.shape[1])
@@ -0,0 +1,210 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Optional
+from app.core.admission import cube_dimensions
+from app.core.config import settings
+from app.util.metrics import QUEUE_DEPTH, SCHEDULER_WAIT, SCHEDULED_REQUESTS
+from app.util.profiling import CURRENT_PROFILER
+
+# Segmenting a tray scan and extracting every sample costs a multiple of a single sample
+MULTI_SAMPLE_COST_FACTOR = 4.0
+
+logger = logging.getLogger(__name__)
+
+
+class CostClass(Enum):
+    SMALL = "small"
+    LARGE = "large"
+    MULTI_SAMPLE = "multi_sample"
+
+
+def estimate_cost(header: dict, target_bands: int, multiple_samples: bool) -> float:
+    """
+    Estimates the compute cost of a request from its ENVI header, in
+    millions of values read and resampled
+    """
+    (rows, cols, bands, _) = cube_dimensions(header)
+    cost = rows * cols * (bands + target_bands) / 1e6
+    if multiple_samples:
+        cost *= MULTI_SAMPLE_COST_FACTOR
+    return cost
+
+
+def cost_class(cost: float, multiple_samples: bool, large_cost: float) -> CostClass:
+    if multiple_samples:
+        return CostClass.MULTI_SAMPLE
+    return CostClass.LARGE if cost > large_cost else CostClass.SMALL
+
+
+@dataclass
+class Ticket:
+    cost: float
+    cost_class: CostClass
+    sequence: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    loop: Optional[asyncio.AbstractEventLoop] = field(default=None, repr=False)
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    @property
+    def granted(self) -> bool:
+        return self.started_at is not None
+
+
+class RequestScheduler:
+    """
+    Decides which request gets to compute next. Requests wait until one of
+    `concurrency` slots is free and their cost class is below its limit,
+    the cheapest waiting request goes first. Every second of waiting lowers
+    the priority cost of a request by `aging_rate`, so large requests still
+    get their turn under a steady stream of small ones. Usable from any
+    thread and event loop, the job workers run their own loops
+
+    The compute itself runs on a pool of `concurrency` threads, so the
+    event loop keeps serving requests while cubes are processed
+    """
+    def __init__(self, concurrency: int, class_limits: dict[str, int], aging_rate: float, large_cost: float):
+        self.concurrency = concurrency
+        self.class_limits = {cls: class_limits.get(cls.value, 0) for cls in CostClass}
+        self.aging_rate = aging_rate
+        self.large_cost = large_cost
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._waiting: list[Ticket] = []
+        self._running: dict[CostClass, int] = {cls: 0 for cls in CostClass}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def priority(self, ticket: Ticket, now: float) -> float:
+        return ticket.cost - self.aging_rate * (now - ticket.enqueued_at)
+
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def _has_capacity(self, cls: CostClass) -> bool:
+        limit = self.class_limits[cls]
+        return self.running() < self.concurrency and (limit <= 0 or self._running[cls] < limit)
+
+    def _dispatch(self):
+        # Grants free slots to the waiting tickets with the lowest aged cost,
+        # skipping classes that are at their limit
+        now = time.monotonic()
+        while self._waiting and self.running() < self.concurrency:
+            candidates = [ticket for ticket in self._waiting if self._has_capacity(ticket.cost_class)]
+            if not candidates:
+                return
+            ticket = min(candidates, key=lambda t: (self.priority(t, now), t.sequence))
+            self._waiting.remove(ticket)
+            self._running[ticket.cost_class] += 1
+            ticket.started_at = now
+            SCHEDULER_WAIT.observe(now - ticket.enqueued_at, cost_class=ticket.cost_class.value)
+            ticket.loop.call_soon_threadsafe(_set_result, ticket.future)
+
+    async def acquire(self, header: dict, target_bands: int, multiple_samples: bool) -> Ticket:
+        """Waits until the request described by the header is scheduled to compute"""
+        cost = estimate_cost(header, target_bands, multiple_samples)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            ticket = Ticket(cost, cost_class(cost, multiple_samples, self.large_cost), next(self._sequence))
+            ticket.loop = loop
+            ticket.future = loop.create_future()
+            self._waiting.append(ticket)
+            self._dispatch()
+        SCHEDULED_REQUESTS.inc(cost_class=ticket.cost_class.value)
+
+        try:
+            await asyncio.shield(ticket.future)
+        except BaseException:
+            # Cancelled while waiting, give back the slot if it was granted in the meantime
+            with self._lock:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+            self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            if not ticket.granted:
+                return
+            self._running[ticket.cost_class] -= 1
+            ticket.started_at = None
+            self._dispatch()
+
+    async def run(self, ticket: Ticket, function: Callable, *args):
+        """
+        Runs the compute of a scheduled request on the compute threads, with
+        the context of the request so its logs keep their request id
+        """
+        if not ticket.granted:
+            raise RuntimeError("The request has not been scheduled")
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="compute")
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, _compute, function, args)
+
+    def state(self) -> dict:
+        """Running requests per class and the waiting ones in the order they would be scheduled"""
+        with self._lock:
+            now = time.monotonic()
+            waiting = sorted(self._waiting, key=lambda t: (self.priority(t, now), t.sequence))
+            return {
+                "concurrency": self.concurrency,
+                "aging_rate": self.aging_rate,
+                "classes": {
+                    cls.value: {"running": self._running[cls], "limit": self.class_limits[cls]}
+                    for cls in CostClass
+                },
+                "waiting": [
+                    {
+                        "cost_class": ticket.cost_class.value,
+                        "cost": round(ticket.cost, 3),
+                        "priority": round(self.priority(ticket, now), 3),
+                        "waited_seconds": round(now - ticket.enqueued_at, 3)
+                    }
+                    for ticket in waiting
+                ]
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _compute(function: Callable, args: tuple):
+    # A profiled request is followed onto the compute thread
+    profiler = CURRENT_PROFILER.get()
+    if profiler is None:
+        return function(*args)
+    profiler.follow()
+    try:
+        return function(*args)
+    finally:
+        profiler.unfollow()
+
+
+def _set_result(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+scheduler = RequestScheduler(
+    concurrency=settings.COMPUTE_WORKERS or os.cpu_count() or 1,
+    class_limits=settings.SCHEDULER_CLASS_LIMITS,
+    aging_rate=settings.SCHEDULER_AGING_RATE,
+    large_cost=settings.SCHEDULER_LARGE_COST
+)
+QUEUE_DEPTH.set_function(scheduler.waiting, queue="scheduler")
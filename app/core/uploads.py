@@ -0,0 +1,224 @@
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import AsyncIterable, Iterator, Optional
+from app.core.config import settings
+from app.schemas.data_models import PreprocessingParameters, UploadInfo
+from app.schemas.exceptions import ChunkedUploadError, InvalidFileFormatError
+
+UPLOAD_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+CHECKSUM_PATTERN = re.compile(r"[0-9a-f]{64}")
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+CHECKSUM_CHUNK_SIZE = 4 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def parse_content_range(header: Optional[str], size: int) -> tuple[int, int]:
+    """Returns the [start, end) byte range of a 'bytes first-last/size' Content-Range header"""
+    match = CONTENT_RANGE_PATTERN.fullmatch((header or "").strip())
+    if match is None:
+        raise ChunkedUploadError(detail="Expected a Content-Range header like 'bytes 0-1048575/3000000000'.", status_code=400)
+    first, last, total = match.groups()
+    start, end = int(first), int(last) + 1
+    if total != "*" and int(total) != size:
+        raise ChunkedUploadError(detail=f"The Content-Range size {total} does not match the upload size {size}.", status_code=416)
+    if start >= end or end > size:
+        raise ChunkedUploadError(detail=f"The range {first}-{last} is outside of the upload of {size} bytes.", status_code=416)
+    return start, end
+
+
+def merge_range(ranges: list[list[int]], start: int, end: int) -> list[list[int]]:
+    """Adds the [start, end) range to sorted, non-overlapping ranges, merging the ones it touches"""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+class UploadManager:
+    """
+    Resumable uploads of large data cubes. The cube file is preallocated
+    when the upload is created and every chunk is written at its offset
+    straight from the request body, so a dropped connection only loses
+    the chunk in flight. The state of an upload is kept in a .json file
+    next to it and updated under a file lock, the chunks of one upload
+    may arrive at any worker process of the pre-fork server
+    """
+    def __init__(self, upload_dir: str, max_bytes: int, expiry: float):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+
+    def _path(self, upload_id: str, *parts: str) -> str:
+        return os.path.join(self.upload_dir, upload_id, *parts)
+
+    def hdr_path(self, upload_id: str) -> str:
+        return self._path(upload_id, "input.hdr")
+
+    def cube_path(self, info: UploadInfo) -> str:
+        cube_suffix = info.cube_filename.split(".")[-1].lower()
+        return self._path(info.upload_id, f"input.{cube_suffix}")
+
+    def _info_path(self, upload_id: str) -> str:
+        return self._path(upload_id, "upload.json")
+
+    def _read(self, upload_id: str) -> Optional[UploadInfo]:
+        try:
+            with open(self._info_path(upload_id)) as f:
+                return UploadInfo.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _save(self, info: UploadInfo):
+        info.updated_at = time.time()
+        # Write and rename so a crash never leaves a half written status file
+        temp_path = self._info_path(info.upload_id) + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(info.model_dump_json())
+        os.replace(temp_path, self._info_path(info.upload_id))
+
+    @contextmanager
+    def _locked(self, upload_id: str) -> Iterator[Optional[UploadInfo]]:
+        try:
+            lock = open(self._path(upload_id, "upload.lock"), "a")
+        except FileNotFoundError:
+            yield None
+            return
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield self._read(upload_id)
+
+    def create(
+        self,
+        hdr_filename: str,
+        hdr_content: bytes,
+        cube_filename: str,
+        size: int,
+        params: PreprocessingParameters,
+        checksum: Optional[str] = None
+    ) -> UploadInfo:
+        if not hdr_filename.lower().endswith(".hdr"):
+            raise InvalidFileFormatError(detail="Invalid header file extension. Only '.hdr' extensions are supported.")
+        if not cube_filename.lower().endswith((".raw", ".bin")):
+            raise InvalidFileFormatError(detail="Invalid data cube file extension. Only '.raw' and '.bin' extensions are supported")
+        if size <= 0 or size > self.max_bytes:
+            raise ChunkedUploadError(detail=f"The cube size has to be between 1 and {self.max_bytes} bytes.", status_code=413)
+        if checksum is not None:
+            checksum = checksum.lower().removeprefix("sha256:")
+            if not CHECKSUM_PATTERN.fullmatch(checksum):
+                raise ChunkedUploadError(detail="The checksum has to be a hex encoded SHA-256 digest.", status_code=400)
+
+        self.remove_expired()
+        now = time.time()
+        info = UploadInfo(
+            upload_id=uuid.uuid4().hex,
+            hdr_filename=hdr_filename,
+            cube_filename=cube_filename,
+            size=size,
+            checksum=checksum,
+            params=params,
+            created_at=now,
+            updated_at=now
+        )
+        os.makedirs(self._path(info.upload_id))
+        with open(self.hdr_path(info.upload_id), "wb") as f:
+            f.write(hdr_content)
+
+        # Reserve the space up front, a full disk fails here and not at the last chunk
+        fd = os.open(self.cube_path(info), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+        except OSError as e:
+            self.remove(info.upload_id)
+            raise ChunkedUploadError(detail=f"Could not allocate {size} bytes for the upload. {e}", status_code=507)
+        finally:
+            os.close(fd)
+
+        self._save(info)
+        logger.info("Created upload", extra={"upload_id": info.upload_id, "size": size})
+        return info
+
+    def get(self, upload_id: str) -> Optional[UploadInfo]:
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            return None
+        return self._read(upload_id)
+
+    async def write(self, info: UploadInfo, start: int, end: int, chunks: AsyncIterable[bytes]) -> UploadInfo:
+        """
+        Writes the body of a request at its offset in the cube file. The
+        range only counts as received once all of its bytes were written
+        """
+        offset = start
+        fd = os.open(self.cube_path(info), os.O_WRONLY)
+        try:
+            async for chunk in chunks:
+                if offset + len(chunk) > end:
+                    raise ChunkedUploadError(detail=f"The request body is longer than its range of {end - start} bytes.", status_code=400)
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        finally:
+            os.close(fd)
+        if offset != end:
+            raise ChunkedUploadError(detail=f"Received {offset - start} of the {end - start} bytes of the range.", status_code=400)
+
+        with self._locked(info.upload_id) as info:
+            if info is None:
+                raise ChunkedUploadError(detail="The upload was removed while the chunk was written.", status_code=404)
+            info.received_ranges = merge_range(info.received_ranges, start, end)
+            info.received_bytes = sum(range_end - range_start for range_start, range_end in info.received_ranges)
+            self._save(info)
+        return info
+
+    def verify(self, upload_id: str) -> Optional[str]:
+        """
+        Checks that every byte of the cube was received and that it matches
+        the checksum of the upload, if one was given, and returns the digest
+        """
+        info = self._read(upload_id)
+        if info is None or info.received_ranges != [[0, info.size]]:
+            received = info.received_bytes if info is not None else 0
+            size = info.size if info is not None else 0
+            raise ChunkedUploadError(detail=f"The upload is incomplete, received {received} of {size} bytes.")
+        if info.checksum is None:
+            return None
+
+        digest = hashlib.sha256()
+        with open(self.cube_path(info), "rb") as f:
+            while chunk := f.read(CHECKSUM_CHUNK_SIZE):
+                digest.update(chunk)
+        if digest.hexdigest() != info.checksum:
+            raise ChunkedUploadError(detail=f"The checksum of the cube is {digest.hexdigest()}, expected {info.checksum}.", status_code=400)
+        return digest.hexdigest()
+
+    def remove(self, upload_id: str):
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
+
+    def remove_expired(self):
+        if not os.path.isdir(self.upload_dir):
+            return
+        now = time.time()
+        for upload_id in os.listdir(self.upload_dir):
+            info = self.get(upload_id)
+            if info is not None and now - info.updated_at > self.expiry:
+                logger.info("Removing expired upload", extra={"upload_id": upload_id})
+                self.remove(upload_id)
+
+
+upload_manager = UploadManager(
+    upload_dir=settings.UPLOAD_DIR,
+    max_bytes=settings.UPLOAD_MAX_MB * 1024 * 1024,
+    expiry=settings.UPLOAD_EXPIRY
+)
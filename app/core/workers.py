@@ -0,0 +1,143 @@
+import logging
+import mmap
+import os
+import time
+from typing import Callable, Optional
+import numpy as np
+
+# One row per worker slot, every worker only writes its own row
+WORKER_FIELDS = np.dtype([
+    ("pid", np.int64),
+    ("restarts", np.int64),
+    ("started_at", np.float64),
+    ("heartbeat", np.float64),
+    ("requests", np.int64),
+    ("in_flight", np.int64),
+])
+HEARTBEAT_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerTable:
+    """
+    Health of the pre-forked worker processes, in an anonymous shared
+    memory mapping created by the parent before forking. Every process
+    sees the rows of all workers, so any of them can report on the others
+    """
+    def __init__(self, slots: int):
+        self._mmap = mmap.mmap(-1, WORKER_FIELDS.itemsize * slots)
+        self.rows = np.ndarray(slots, dtype=WORKER_FIELDS, buffer=self._mmap)
+        self.rows[:] = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def reset(self, slot: int, pid: int):
+        row = self.rows[slot]
+        if row["pid"] != 0:
+            row["restarts"] += 1
+        row["pid"] = pid
+        row["started_at"] = row["heartbeat"] = time.time()
+        row["requests"] = row["in_flight"] = 0
+
+
+def read_memory(pid: int) -> dict[str, Optional[float]]:
+    """
+    Resident and private memory of a process in MB. Pages still shared
+    copy-on-write with the parent count towards the resident but not
+    the private memory
+    """
+    memory = {"rss_mb": None, "private_mb": None}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            values = {line.split(":")[0]: int(line.split()[1]) for line in f if line.endswith("kB\n")}
+    except (OSError, ValueError, IndexError):
+        return memory
+    memory["rss_mb"] = round(values.get("Rss", 0) / 1024, 1)
+    memory["private_mb"] = round((values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)) / 1024, 1)
+    return memory
+
+
+class WorkerState:
+    """
+    The worker slot of this process. Without a table the service runs as
+    a single process, which then is its own and only worker
+    """
+    def __init__(self):
+        self.table: Optional[WorkerTable] = None
+        self.slot = 0
+        self.max_requests = 0
+        self.resumes_work = True
+        self._requests = 0
+        self._in_flight = 0
+        self._started_at = time.time()
+        self._on_recycle: Optional[Callable[[], None]] = None
+
+    def attach(self, table: WorkerTable, slot: int, max_requests: int, resumes_work: bool, on_recycle: Callable[[], None]):
+        """Called in a forked worker, before its server starts"""
+        self.table = table
+        self.slot = slot
+        self.max_requests = max_requests
+        self.resumes_work = resumes_work
+        self._on_recycle = on_recycle
+        self._started_at = time.time()
+
+    @property
+    def recycling(self) -> bool:
+        return self.max_requests > 0 and self._requests >= self.max_requests
+
+    def request_started(self):
+        self._in_flight += 1
+        if self.table is not None:
+            self.table.rows[self.slot]["in_flight"] = self._in_flight
+
+    def request_finished(self):
+        self._in_flight -= 1
+        self._requests += 1
+        if self.table is not None:
+            self.table.rows[self.slot]["in_flight"] = self._in_flight
+            self.table.rows[self.slot]["requests"] = self._requests
+        if self.recycling and self._on_recycle is not None:
+            logger.info("Recycling worker", extra={"slot": self.slot, "requests": self._requests})
+            self._on_recycle()
+            self._on_recycle = None
+
+    def heartbeat(self):
+        if self.table is not None:
+            self.table.rows[self.slot]["heartbeat"] = time.time()
+
+    def health(self, heartbeat_timeout: float) -> list[dict]:
+        now = time.time()
+        if self.table is None:
+            return [{
+                "slot": 0,
+                "pid": os.getpid(),
+                "healthy": True,
+                "restarts": 0,
+                "uptime_seconds": round(now - self._started_at, 1),
+                "heartbeat_age_seconds": 0.0,
+                "requests": self._requests,
+                "in_flight": self._in_flight,
+                **read_memory(os.getpid())
+            }]
+
+        workers = []
+        for slot, row in enumerate(self.table.rows.copy()):
+            pid = int(row["pid"])
+            heartbeat_age = now - float(row["heartbeat"])
+            workers.append({
+                "slot": slot,
+                "pid": pid,
+                "healthy": pid != 0 and heartbeat_age <= heartbeat_timeout,
+                "restarts": int(row["restarts"]),
+                "uptime_seconds": round(now - float(row["started_at"]), 1) if pid != 0 else 0.0,
+                "heartbeat_age_seconds": round(heartbeat_age, 1) if pid != 0 else None,
+                "requests": int(row["requests"]),
+                "in_flight": int(row["in_flight"]),
+                **(read_memory(pid) if pid != 0 else {"rss_mb": None, "private_mb": None})
+            })
+        return workers
+
+
+worker_state = WorkerState()
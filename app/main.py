@@ -1,22 +1,123 @@
-from fastapi import FastAPI
+import time
+IMPORT_START = time.perf_counter()
+
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from app.core.config import settings, PreprocessorVersion
-from app.api import router, router_stub
+from app.core.jobs import job_manager
+from app.core.batch import shutdown_batch_executor
+from app.core.delivery import delivery_queue
+from app.core.scheduler import scheduler
+from app.core.workers import worker_state, HEARTBEAT_INTERVAL
+from app.core.cameras import camera_registry
+from app.schemas.data_models import PreprocessingParameters
+from app.util.cube_slicer import preload_model
+from app.api import router, router_stub, router_mock, router_jobs, router_deliveries, router_scheduler, router_uploads
+from app.util.metrics import REGISTRY, REQUESTS, REQUEST_DURATION, STARTUP_DURATION, PROMETHEUS_CONTENT_TYPE
+from app.util.log import configure_logging, REQUEST_ID
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_QUEUE_SIZE)
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    lifespan_start = time.perf_counter()
+    # The job workers are only needed by the production endpoints, the
+    # delivery workers also by the mock endpoints
+    production = settings.PREPROCESSOR_VERSION == PreprocessorVersion.PROD
+    delivering = production or settings.PREPROCESSOR_VERSION == PreprocessorVersion.MOCK
+    # Of several pre-forked workers only the first one picks up the work
+    # left over from before a restart
+    if production:
+        job_manager.start(resume=worker_state.resumes_work)
+    if delivering:
+        await delivery_queue.start(resume=worker_state.resumes_work)
+    if production and settings.PRELOAD_MODEL:
+        preload_model()
+    if production and settings.CAMERA_TYPE:
+        defaults = PreprocessingParameters()
+        camera_registry.preload(settings.CAMERA_TYPE, defaults.target_bands, defaults.resampling_kind)
+
+    STARTUP_DURATION.set(time.perf_counter() - lifespan_start, phase="lifespan")
+    logger.info("Service started", extra={
+        "import_seconds": round(STARTUP_DURATION.get(phase="import"), 3),
+        "lifespan_seconds": round(STARTUP_DURATION.get(phase="lifespan"), 3)
+    })
+    heartbeat = asyncio.create_task(send_heartbeats())
+    yield
+    heartbeat.cancel()
+
+    # A recycled worker finishes its jobs and deliveries, nobody else would
+    if delivering:
+        await delivery_queue.stop(drain=worker_state.recycling)
+    job_manager.stop(drain=worker_state.recycling)
+    scheduler.shutdown()
+    shutdown_batch_executor()
+
+async def send_heartbeats():
+    # Stops when the event loop is blocked, so the pre-fork parent replaces hung workers
+    while True:
+        worker_state.heartbeat()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
 
 app = FastAPI(
     title=settings.APP_NAME,
-    openapi_url=f"{settings.API_STR}/openapi.json"
+    openapi_url=f"{settings.API_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 # Conditional Router Inclusion
 if settings.PREPROCESSOR_VERSION == PreprocessorVersion.STUB:
-    print("INFO: Loading Stub Data Preprocessor Endpoints")
+    logger.info("Loading Stub Data Preprocessor Endpoints")
     app.include_router(router_stub.router, prefix=settings.API_STR, tags=["Stub Preprocessor"])
 elif settings.PREPROCESSOR_VERSION == PreprocessorVersion.MOCK:
-    print("INFO: Loading Mock Data Preprocessor Endpoints")
-    # app.include_router(router_mock.router, prefix=settings.API_STR, tags=["Mock Preprocessor"])
+    logger.info("Loading Mock Data Preprocessor Endpoints")
+    app.include_router(router_mock.router, prefix=settings.API_STR, tags=["Mock Preprocessor"])
+    app.include_router(router_deliveries.router, prefix=settings.API_STR, tags=["Storage Deliveries"])
 else:
-    print("INFO: Loading Data Preprocessor Endpoints")
+    logger.info("Loading Data Preprocessor Endpoints")
     app.include_router(router.router, prefix=settings.API_STR, tags=["Production Preprocessor"])
+    app.include_router(router_jobs.router, prefix=settings.API_STR, tags=["Preprocessing Jobs"])
+    app.include_router(router_uploads.router, prefix=settings.API_STR, tags=["Chunked Uploads"])
+    app.include_router(router_scheduler.router, prefix=settings.API_STR, tags=["Scheduler"])
+    app.include_router(router_deliveries.router, prefix=settings.API_STR, tags=["Storage Deliveries"])
+
+# Heavy dependencies are imported by the code paths that need them, see
+# `just startup` for a report of where the import time goes
+STARTUP_DURATION.set(time.perf_counter() - IMPORT_START, phase="import")
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Callers can pass their own request id to correlate the logs
+    request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    REQUEST_ID.set(request_id)
+
+    start = time.perf_counter()
+    worker_state.request_started()
+    try:
+        response = await call_next(request)
+    finally:
+        worker_state.request_finished()
+    response.headers[REQUEST_ID_HEADER] = request_id
+
+    # Only the API endpoints are tracked, labelled by their route template
+    route = request.scope.get("route")
+    if route is not None and request.url.path.startswith(settings.API_STR):
+        endpoint = route.path.removeprefix(settings.API_STR)
+        duration = time.perf_counter() - start
+        REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+        REQUEST_DURATION.observe(duration, endpoint=endpoint)
+        logger.info("Handled request", extra={
+            "endpoint": endpoint,
+            "status": response.status_code,
+            "duration": round(duration, 4)
+        })
+    return response
 
 @app.get("/", tags=["Root"])
 async def read_root():
@@ -31,3 +132,12 @@ async def health_check():
         "status": "ok", 
         "version": settings.PREPROCESSOR_VERSION.name
     }
+
+@app.get("/health/workers", tags=["Health"])
+async def worker_health():
+    """Health, requests and memory of every worker process of the pre-fork server, or of this single process"""
+    return {"workers": worker_state.health(settings.WORKER_HEARTBEAT_TIMEOUT)}
+
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from fastapi import Form, HTTPException
 from typing import List, Optional
 from enum import Enum
@@ -30,8 +30,121 @@ class PreprocessingParameters(BaseModel):
     max_wavelength: int = 900
     sg_window_deriv: int = 11
     sg_polyorder_deriv: int = 2 
+    camera: Optional[str] = None  # Camera profile the cube is from, replaces the wavelengths of the header
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class JobInfo(BaseModel):
+    job_id: str
+    status: JobStatus
+    stage: Optional[str] = None
+    completed_samples: int = 0
+    total_samples: int = 0
+    uid: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+class DeliveryStatus(Enum):
+    PENDING = "pending"
+    DELIVERING = "delivering"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+class DeliveryInfo(BaseModel):
+    delivery_id: str
+    status: DeliveryStatus
+    filename: str
+    storage_endpoint: str
+    attempts: int = 0
+    uid: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+class UploadInfo(BaseModel):
+    upload_id: str
+    hdr_filename: str
+    cube_filename: str
+    size: int
+    received_bytes: int = 0
+    received_ranges: List[List[int]] = []  # Merged [start, end) byte ranges of the cube written so far
+    checksum: Optional[str] = None  # Expected SHA-256 of the cube, hex encoded
+    params: PreprocessingParameters
+    created_at: float
+    updated_at: float
+
+class BatchCubeResult(BaseModel):
+    name: str
+    status: str
+    rows: int = 0
+    error: Optional[str] = None
+
+class BatchResult(BaseModel):
+    uid: Optional[str] = None
+    delivery_id: Optional[str] = None  # Set while the upload to storage is still pending
+    message: str
+    cubes: List[BatchCubeResult]
+    csv: Optional[str] = None  # Only returned when no storage endpoint was given
+
+class CubeInterleave(Enum):
+    BSQ = "bsq"
+    BIL = "bil"
+    BIP = "bip"
+
+class CubeDataType(Enum):
+    # Values are the numpy type names, see ENVI_DATA_TYPES for the header codes
+    UINT8 = "uint8"
+    INT16 = "int16"
+    UINT16 = "uint16"
+    FLOAT32 = "float32"
+    FLOAT64 = "float64"
+
+# ENVI "data type" header codes of the supported cube data types
+ENVI_DATA_TYPES = {
+    CubeDataType.UINT8: 1,
+    CubeDataType.INT16: 2,
+    CubeDataType.UINT16: 12,
+    CubeDataType.FLOAT32: 4,
+    CubeDataType.FLOAT64: 5,
+}
+
+class SyntheticCubeSpec(BaseModel):
+    rows: int = Field(512, ge=1)
+    cols: int = Field(512, ge=1)
+    bands: int = Field(224, ge=3)
+    objects: int = Field(4, ge=0)  # Fruit-like objects placed on the background
+    dtype: CubeDataType = CubeDataType.UINT16
+    interleave: CubeInterleave = CubeInterleave.BIL
+    seed: Optional[int] = None  # Same seed, same cube
 
 # Helper function to pass fields from PreprocessingParameters as single inputs in a multipart/form-data request
+async def get_synthetic_cube_spec(
+    rows: int = Form(SyntheticCubeSpec.model_fields['rows'].default),
+    cols: int = Form(SyntheticCubeSpec.model_fields['cols'].default),
+    bands: int = Form(SyntheticCubeSpec.model_fields['bands'].default),
+    objects: int = Form(SyntheticCubeSpec.model_fields['objects'].default),
+    dtype: str = Form(SyntheticCubeSpec.model_fields['dtype'].default.value),
+    interleave: str = Form(SyntheticCubeSpec.model_fields['interleave'].default.value),
+    seed: Optional[int] = Form(None)
+) -> SyntheticCubeSpec:
+    try:
+        return SyntheticCubeSpec(
+            rows=rows,
+            cols=cols,
+            bands=bands,
+            objects=objects,
+            dtype=CubeDataType(dtype),
+            interleave=CubeInterleave(interleave.lower()),
+            seed=seed
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid synthetic cube parameters: {e}")
+
 async def get_preprocessing_params(
     # Each field from the Pydantic model now becomes a Form() parameter
     # with its default and type hints directly from the Pydantic model..
@@ -46,7 +159,8 @@ async def get_preprocessing_params(
     max_wavelength: int = Form(PreprocessingParameters.model_fields['max_wavelength'].default),
     sg_window_deriv: int = Form(PreprocessingParameters.model_fields['sg_window_deriv'].default),
     sg_polyorder_deriv: int = Form(PreprocessingParameters.model_fields['sg_polyorder_deriv'].default),
-    storage_endpoint: str = Form(PreprocessingParameters.model_fields['storage_endpoint'].default)
+    storage_endpoint: str = Form(PreprocessingParameters.model_fields['storage_endpoint'].default),
+    camera: Optional[str] = Form(None)
 ) -> PreprocessingParameters:
     # Manually parse the extraction_methods if it's a JSON string
     parsed_extraction_methods = None
@@ -71,7 +185,8 @@ async def get_preprocessing_params(
         "max_wavelength": max_wavelength,
         "sg_window_deriv": sg_window_deriv,
         "sg_polyorder_deriv": sg_polyorder_deriv,
-        "storage_endpoint": storage_endpoint
+        "storage_endpoint": storage_endpoint,
+        "camera": camera or None
     }
     if parsed_extraction_methods is not None:
         params_data["extraction_methods"] = parsed_extraction_methods
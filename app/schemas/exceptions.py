@@ -27,4 +27,40 @@ class BackgroundRemovalError(PreprocessingError):
     """Raises if background removal fails unexpectedly"""
     def __init__(self, detail: str = "Internal error occurred during background removal.",
                  status_code: int = status.HTTP_500_INTERNAL_SERVER_ERROR):
-        super().__init__(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=detail)
\ No newline at end of file
+        super().__init__(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=detail)
+
+class StorageUploadError(PreprocessingError):
+    """Raise when the preprocessed data could not be saved to the storage service"""
+    def __init__(self, detail: str = "An error occured during saving the preprocessed data",
+                 status_code: int = status.HTTP_500_INTERNAL_SERVER_ERROR):
+        super().__init__(status_code=status_code, detail=detail)
+
+class CubeTooLargeError(PreprocessingError):
+    """Raise when a data cube needs more memory than the service may ever use"""
+    def __init__(self, detail: str = "The data cube is too large to be processed by this service.",
+                 status_code: int = 413):
+        super().__init__(status_code=status_code, detail=detail)
+
+class ServiceOverloadedError(PreprocessingError):
+    """Raise when a request could not be admitted in time because the service is busy"""
+    def __init__(self, detail: str = "The service is busy, try again later.",
+                 status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE):
+        super().__init__(status_code=status_code, detail=detail)
+
+class DatasetPathError(PreprocessingError):
+    """Raise when a data cube path does not name a file below the dataset root"""
+    def __init__(self, detail: str = "The path is not below the dataset root of this service.",
+                 status_code: int = status.HTTP_403_FORBIDDEN):
+        super().__init__(status_code=status_code, detail=detail)
+
+class ChunkedUploadError(PreprocessingError):
+    """Raise when a chunk does not fit its upload, or an upload is incomplete or corrupt when it is finalized"""
+    def __init__(self, detail: str = "The upload is incomplete.",
+                 status_code: int = status.HTTP_409_CONFLICT):
+        super().__init__(status_code=status_code, detail=detail)
+
+class CameraProfileError(PreprocessingError):
+    """Raise when a request names an unknown camera, or its cube does not match the camera profile"""
+    def __init__(self, detail: str = "The data cube does not match the camera profile.",
+                 status_code: int = status.HTTP_400_BAD_REQUEST):
+        super().__init__(status_code=status_code, detail=detail)
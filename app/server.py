@@ -0,0 +1,208 @@
+"""
+Pre-fork server: loads the service and the segmentation model once in a
+parent process and forks worker processes that share those memory pages
+copy-on-write, instead of every worker loading its own copy. Workers are
+replaced after WORKER_MAX_REQUESTS requests and when their heartbeat
+stops, the health of every worker is reported on /health/workers
+
+Usage:
+    python -m app.server --host 0.0.0.0 --port 8001 --workers 4
+"""
+import argparse
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Optional
+
+POLL_INTERVAL = 0.5
+MAX_REQUESTS_JITTER = 0.1  # Spreads the restarts, so workers are not all replaced at once
+SHUTDOWN_TIMEOUT = 30.0
+
+logger = logging.getLogger("app.server")
+
+
+def preload():
+    """
+    Imports everything the requests need and loads the model, so the
+    workers inherit them instead of each loading their own
+    """
+    import app.main  # noqa: F401
+    import httpx  # noqa: F401
+    import pandas  # noqa: F401
+    import scipy.interpolate  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import scipy.spatial  # noqa: F401
+    from app.core.config import settings, PreprocessorVersion
+    from app.core.cameras import camera_registry
+    from app.schemas.data_models import PreprocessingParameters
+    from app.util.cube_slicer import get_model
+
+    if settings.PREPROCESSOR_VERSION == PreprocessorVersion.PROD:
+        get_model()
+        if settings.CAMERA_TYPE:
+            defaults = PreprocessingParameters()
+            camera_registry.get(settings.CAMERA_TYPE).resampling(defaults.target_bands, defaults.resampling_kind)
+
+    # Objects that exist now are never collected, so the garbage collector
+    # does not write to their pages in the workers and unshare them
+    gc.collect()
+    gc.freeze()
+
+
+def _ignore_signal(signum, frame):
+    pass
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Forks the workers, replaces the ones that exit or hang and stops them on SIGTERM"""
+    def __init__(self, sock: socket.socket, workers: int, max_requests: int, heartbeat_timeout: float):
+        from app.core.workers import WorkerTable
+        self.sock = sock
+        self.workers = workers
+        self.max_requests = max_requests
+        self.heartbeat_timeout = heartbeat_timeout
+        self.table = WorkerTable(workers)
+        self.children: dict[int, int] = {}  # pid -> slot
+        self.stopping = False
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for slot in range(self.workers):
+            self.spawn(slot, first=True)
+
+        while not self.stopping:
+            time.sleep(POLL_INTERVAL)
+            self.reap()
+            self.check_heartbeats()
+
+        self.shutdown()
+        return 0
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def spawn(self, slot: int, first: bool = False):
+        from app.util.log import configure_logging, shutdown_logging
+        from app.core.config import settings
+
+        # The logging thread does not survive a fork, it is restarted on both sides
+        shutdown_logging()
+        pid = os.fork()
+        configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_QUEUE_SIZE)
+        if pid == 0:
+            code = 1
+            try:
+                code = self.serve(slot, resumes_work=first and slot == 0)
+            except Exception:
+                logger.exception("Worker failed", extra={"slot": slot})
+            finally:
+                shutdown_logging()
+                os._exit(code)
+
+        self.table.reset(slot, pid)
+        self.children[pid] = slot
+        logger.info("Started worker", extra={"slot": slot, "worker_pid": pid})
+
+    def serve(self, slot: int, resumes_work: bool) -> int:
+        """Runs in the forked worker until it is recycled or stopped"""
+        import uvicorn
+        from app.main import app
+        from app.core.admission import memory_budget
+        from app.core.config import settings
+        from app.core.scheduler import scheduler
+        from app.core.workers import worker_state
+
+        # uvicorn handles the signals while serving and raises them again
+        # afterwards, they must not end the worker before it cleaned up
+        signal.signal(signal.SIGTERM, _ignore_signal)
+        signal.signal(signal.SIGINT, _ignore_signal)
+
+        # The cores and the memory budget are shared by all workers
+        if settings.COMPUTE_WORKERS == 0:
+            scheduler.concurrency = max(1, (os.cpu_count() or 1) // self.workers)
+        if memory_budget.total is not None:
+            memory_budget.total //= self.workers
+
+        config = uvicorn.Config(app, log_config=None, access_log=False, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
+        server = uvicorn.Server(config)
+        max_requests = self.max_requests
+        if max_requests > 0:
+            max_requests += random.randint(0, int(max_requests * MAX_REQUESTS_JITTER))
+
+        def recycle():
+            server.should_exit = True
+
+        worker_state.attach(self.table, slot, max_requests, resumes_work, recycle)
+        server.run(sockets=[self.sock])
+        return 0
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            logger.info("Worker exited", extra={"slot": slot, "worker_pid": pid, "exit_code": os.waitstatus_to_exitcode(status)})
+            if not self.stopping:
+                self.spawn(slot)
+
+    def check_heartbeats(self):
+        now = time.time()
+        for pid, slot in list(self.children.items()):
+            age = now - self.table.rows[slot]["heartbeat"]
+            if age > self.heartbeat_timeout:
+                logger.error("Worker stopped responding, killing it", extra={"slot": slot, "worker_pid": pid, "heartbeat_age": round(age, 1)})
+                os.kill(pid, signal.SIGKILL)
+
+    def shutdown(self):
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 5
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            os.kill(pid, signal.SIGKILL)
+        logger.info("Stopped all workers")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-fork server of the preprocessing service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, SERVER_WORKERS by default")
+    args = parser.parse_args(argv)
+
+    preload()
+    from app.core.config import settings
+    workers = args.workers or settings.SERVER_WORKERS or os.cpu_count() or 1
+
+    sock = bind_socket(args.host, args.port)
+    logger.info("Serving with pre-forked workers", extra={"host": args.host, "port": args.port, "workers": workers})
+    supervisor = Supervisor(sock, workers, settings.WORKER_MAX_REQUESTS, settings.WORKER_HEARTBEAT_TIMEOUT)
+    return supervisor.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,6 @@
 import io
 import csv
 import numpy as np
-import pandas as pd
 from app.schemas.data_models import PreprocessingParameters
 
 def read_csv(csv_bytes: bytes, encoding: str):
@@ -84,6 +83,8 @@ def create_feature_row(features_dict_array: list[dict], params: PreprocessingPar
 
         data.append(np.array(feature_values_list, dtype=np.float32))
 
+    # pandas is only loaded by the first request instead of at startup
+    import pandas as pd
     df = pd.DataFrame(data, columns=column_names)
 
     return df
\ No newline at end of file
@@ -1,16 +1,36 @@
-# keep this as first import because otherwise YOLO breaks for some reason
-from ultralytics import YOLO
+import logging
+import threading
 import spectral
 import numpy as np
 from numpy import ndarray
 import tempfile
 from pathlib import Path
+from app.util.metrics import time_stage, DETECTED_SAMPLES
 
 base_path = Path(__file__).resolve().parent
+logger = logging.getLogger(__name__)
 
 YOLO_SIDE_LENGTH = 512
-print("loading yolo model")
-model = YOLO(base_path / "model/best_small.pt")
+DEFAULT_RGB_BANDS = (29, 19, 9)  # Bands the segmentation model sees as red, green and blue
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    """
+    Loads the YOLO model on first use. Importing ultralytics pulls in torch
+    and takes seconds, so it is kept off the startup path of the service
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            from ultralytics import YOLO
+            logger.info("Loading YOLO model")
+            _model = YOLO(base_path / "model/best_small.pt")
+    return _model
+
+def preload_model():
+    """Loads the model on a background thread, so the first segmentation request does not wait for it"""
+    threading.Thread(target=get_model, name="model-preload", daemon=True).start()
 
 def extract_shape(original_data: ndarray, box: list[int], mask: ndarray):
     (rows, cols, bands) = original_data.shape
@@ -36,28 +56,30 @@ def extract_shape(original_data: ndarray, box: list[int], mask: ndarray):
 
     return shape_cube
 
-def get_kiwis(original_data: ndarray):
-    if original_data.shape[2] <= 29:
-        raise ValueError("Input data must have at least 29 bands to extract RGB channels.")
+def get_kiwis(original_data: ndarray, rgb_bands: tuple[int, int, int] = DEFAULT_RGB_BANDS):
+    if original_data.shape[2] <= max(rgb_bands):
+        raise ValueError(f"Input data must have at least {max(rgb_bands)} bands to extract RGB channels.")
     
-    print("running model")
+    logger.debug("Running segmentation model", extra={"cube_shape": list(original_data.shape)})
     # converting to image and running YOLO model
     results = []
-    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=True) as tmp_file:
-        spectral.save_rgb(tmp_file.name, original_data, [29, 19, 9])
-        results = model(tmp_file.name)
+    with time_stage("segmentation_inference"), tempfile.NamedTemporaryFile(suffix=".jpg", delete=True) as tmp_file:
+        spectral.save_rgb(tmp_file.name, original_data, list(rgb_bands))
+        results = get_model()(tmp_file.name)
     r = results[0]
 
     kiwi_slices = []
 
-    print("getting kiwis")
-    for i, box in enumerate(r.boxes.xyxy):
-        kiwi_slices.append(
-            extract_shape(
-                original_data,
-                map(int, box.tolist()),
-                r.masks[i].data[0].cpu().numpy()
+    with time_stage("shape_extraction"):
+        for i, box in enumerate(r.boxes.xyxy):
+            kiwi_slices.append(
+                extract_shape(
+                    original_data,
+                    map(int, box.tolist()),
+                    r.masks[i].data[0].cpu().numpy()
+                )
             )
-        )
-    
+
+    DETECTED_SAMPLES.observe(len(kiwi_slices))
+    logger.debug("Extracted samples", extra={"samples": len(kiwi_slices)})
     return kiwi_slices
\ No newline at end of file
@@ -0,0 +1,47 @@
+import gzip
+from typing import BinaryIO, Optional
+from fastapi import status
+from app.schemas.exceptions import InvalidFileFormatError
+
+# Compressed cubes keep their .raw/.bin name with one of these appended
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+
+
+def compression_of(filename: str) -> Optional[str]:
+    """Returns the compression of a file by its extension, None if it is not compressed"""
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return compression
+    return None
+
+
+def strip_compression(filename: str) -> str:
+    """Returns the name of the file without its compression extension"""
+    for extension in COMPRESSION_EXTENSIONS:
+        if filename.lower().endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+def open_decompressed(fileobj: BinaryIO, compression: str) -> BinaryIO:
+    """
+    Wraps a file object in a stream that decompresses it while it is read.
+    zstd needs Python 3.14 or the optional zstandard package
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if compression == "zstd":
+        try:
+            from compression import zstd
+            return zstd.ZstdFile(fileobj, mode="rb")
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise InvalidFileFormatError(
+                detail="zstd compressed data cubes are not supported by this service, install the zstandard package or use gzip.",
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True, closefd=False)
+    raise InvalidFileFormatError(detail=f"Unsupported compression '{compression}'.", status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
@@ -0,0 +1,176 @@
+from typing import BinaryIO
+import numpy as np
+import spectral.io.envi as envi
+from numpy import ndarray
+from app.schemas.exceptions import InvalidFileFormatError
+
+# Axis order of each ENVI interleave, transposed to (rows, cols, bands)
+INTERLEAVE_SHAPES = {
+    "bsq": lambda rows, cols, bands: (bands, rows, cols),
+    "bil": lambda rows, cols, bands: (rows, bands, cols),
+    "bip": lambda rows, cols, bands: (rows, cols, bands),
+}
+INTERLEAVE_TRANSPOSE = {
+    "bsq": (1, 2, 0),
+    "bil": (0, 2, 1),
+    "bip": (0, 1, 2),
+}
+
+
+def parse_envi_header(header_bytes: bytes) -> dict:
+    """
+    Parses the contents of an ENVI .hdr file the same way
+    spectral.io.envi.read_envi_header does, without the header
+    having to exist on disk. All keys are lowercase
+    """
+    try:
+        lines = header_bytes.decode("utf-8").splitlines()
+    except UnicodeDecodeError:
+        raise InvalidFileFormatError(detail="The header file does not appear to be an ENVI header (appears to be a binary file).")
+
+    if not lines or not lines[0].strip().startswith("ENVI"):
+        raise InvalidFileFormatError(detail="The header file does not appear to be an ENVI header (missing 'ENVI' at beginning of first line).")
+
+    header = {}
+    lines = lines[1:]
+    try:
+        while lines:
+            line = lines.pop(0)
+            if line.find("=") == -1 or line.startswith(";"):
+                continue
+
+            (key, _, val) = line.partition("=")
+            key = key.strip().lower()
+            val = val.strip()
+            if val and val[0] == "{":
+                # Values in braces can span multiple lines
+                while val[-1] != "}":
+                    line = lines.pop(0)
+                    if line.startswith(";"):
+                        continue
+                    val += "\n" + line.strip()
+                if key == "description":
+                    header[key] = val.strip("{}").strip()
+                else:
+                    header[key] = [v.strip() for v in val[1:-1].split(",")]
+            else:
+                header[key] = val
+    except IndexError:
+        raise InvalidFileFormatError(detail="The ENVI header file has an unterminated '{' value.")
+
+    return header
+
+
+def _cube_params(header: dict) -> tuple:
+    try:
+        params = envi.gen_params(header)
+    except KeyError as e:
+        raise InvalidFileFormatError(detail=f"The ENVI header is missing the required field {e}.")
+    except (ValueError, TypeError) as e:
+        raise InvalidFileFormatError(detail=f"The ENVI header contains an invalid value. Exception: {e}")
+
+    interleave = header.get("interleave", "bsq").lower()
+    if interleave not in INTERLEAVE_SHAPES:
+        raise InvalidFileFormatError(detail=f"Unsupported ENVI interleave '{interleave}'.")
+    return params, interleave
+
+
+def read_envi_cube(header: dict, cube_bytes) -> ndarray:
+    """
+    Decodes the raw bytes of an ENVI data cube described by a parsed
+    header into a float32 array with shape (rows, cols, bands)
+
+    Parameters
+    ----------
+    header: dict
+        Parsed ENVI header, see parse_envi_header
+    cube_bytes: bytes-like
+        Contents of the .raw/.bin file, anything supporting the buffer protocol
+    """
+    params, interleave = _cube_params(header)
+    count = params.nrows * params.ncols * params.nbands
+    dtype = np.dtype(params.dtype)
+    if len(cube_bytes) - params.offset < count * dtype.itemsize:
+        raise InvalidFileFormatError(
+            detail=f"The data cube file is too small for the dimensions given in the header "
+                   f"({params.nrows} x {params.ncols} x {params.nbands} of type {dtype})."
+        )
+
+    data = np.frombuffer(cube_bytes, dtype=dtype, count=count, offset=params.offset)
+    data = data.reshape(INTERLEAVE_SHAPES[interleave](params.nrows, params.ncols, params.nbands))
+    return data.transpose(INTERLEAVE_TRANSPOSE[interleave]).astype(np.float32)
+
+
+class EnviStreamReader:
+    """
+    Decodes an ENVI data cube front to back from a stream that can not
+    seek, like a decompressor, into float32 arrays with shape
+    (rows, cols, bands). Only a single line of the raw cube is buffered,
+    so the stream never has to be written out or held in memory whole.
+    BIL and BIP cubes can also be read a few rows at a time by slicing
+    the reader in order, like the tiled pipeline does with a memory map
+    """
+    def __init__(self, header: dict, stream: BinaryIO):
+        params, self.interleave = _cube_params(header)
+        self.shape = (params.nrows, params.ncols, params.nbands)
+        self._dtype = np.dtype(params.dtype)
+        self._stream = stream
+        self._next_row = 0
+        self._skip(params.offset)
+
+    @property
+    def row_wise(self) -> bool:
+        return self.interleave != "bsq"
+
+    def _read_exactly(self, buffer: ndarray):
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        try:
+            while filled < len(view):
+                read = self._stream.readinto(view[filled:])
+                if not read:
+                    raise InvalidFileFormatError(
+                        detail=f"The data cube file is too small for the dimensions given in the header "
+                               f"({self.shape[0]} x {self.shape[1]} x {self.shape[2]} of type {self._dtype})."
+                    )
+                filled += read
+        except InvalidFileFormatError:
+            raise
+        except Exception as e:
+            raise InvalidFileFormatError(detail=f"The data cube file could not be decompressed. Exception: {e}")
+
+    def _skip(self, count: int):
+        if count > 0:
+            self._read_exactly(np.empty(count, dtype=np.uint8))
+
+    def _read_rows(self, out: ndarray):
+        (rows, cols, bands) = self.shape
+        line = np.empty(INTERLEAVE_SHAPES[self.interleave](1, cols, bands)[1:], dtype=self._dtype)
+        for row in range(len(out)):
+            self._read_exactly(line)
+            out[row] = line.T if self.interleave == "bil" else line
+        self._next_row += len(out)
+
+    def read(self) -> ndarray:
+        """Reads the whole (rest of the) cube"""
+        (rows, cols, bands) = self.shape
+        if self.row_wise:
+            return self[self._next_row:rows]
+
+        if self._next_row:
+            raise ValueError("BSQ cubes can only be read as a whole.")
+        cube = np.empty(self.shape, dtype=np.float32)
+        plane = np.empty((rows, cols), dtype=self._dtype)
+        for band in range(bands):
+            self._read_exactly(plane)
+            cube[:, :, band] = plane
+        self._next_row = rows
+        return cube
+
+    def __getitem__(self, rows: slice) -> ndarray:
+        start, stop, step = rows.indices(self.shape[0])
+        if not self.row_wise or step != 1 or start != self._next_row:
+            raise ValueError("The rows of a streamed cube can only be read in order.")
+        out = np.empty((max(stop - start, 0), *self.shape[1:]), dtype=np.float32)
+        self._read_rows(out)
+        return out
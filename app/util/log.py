@@ -0,0 +1,119 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Optional
+from app.util.metrics import LOG_RECORDS_DROPPED
+
+APP_LOGGER = "app"
+LOG_FORMATS = ("json", "text")
+
+# Id of the request currently handled, set by the request middleware and
+# by the job workers, and added to every record logged while handling it
+REQUEST_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has, anything else was passed as a field with `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+
+
+def record_fields(record: logging.LogRecord) -> dict:
+    """Returns the structured fields passed to a log call with `extra`"""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, fields included"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update(record_fields(record))
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formats records as readable lines with the fields as key=value pairs"""
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        line = f"{timestamp} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if getattr(record, "request_id", None):
+            line += f" request_id={record.request_id}"
+        for key, value in record_fields(record).items():
+            line += f" {key}={value}"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records over to the listener thread without ever waiting. The
+    request id is captured here, in the logging thread, while formatting
+    and writing happen on the listener thread. Records are dropped and
+    counted when the queue is full instead of stalling the caller
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.request_id = REQUEST_ID.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def configure_logging(level: str = "INFO", log_format: str = "json", queue_size: int = 10000):
+    """
+    Routes the records of all app.* loggers through a bounded queue to a
+    single listener thread writing to stdout. Calling it again replaces
+    the previous configuration, which also makes it usable as the
+    initializer of worker processes
+    """
+    global _listener, _handler
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format '{log_format}', expected one of {LOG_FORMATS}")
+    shutdown_logging()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    _handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    _listener = logging.handlers.QueueListener(_handler.queue, stream_handler)
+    _listener.start()
+
+    logger = logging.getLogger(APP_LOGGER)
+    logger.setLevel(level.upper())
+    logger.addHandler(_handler)
+    logger.propagate = False
+
+@atexit.register
+def shutdown_logging():
+    """Writes out the queued records and stops the listener thread"""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger(APP_LOGGER).removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
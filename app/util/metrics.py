@@ -0,0 +1,294 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+class Metric:
+    """
+    Base of the minimal Prometheus style metrics below. Values are kept
+    per combination of label values and are safe to update from any thread
+    """
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric '{self.name}' expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> list[tuple[str, dict, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}"
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only be increased.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """Reads the value from the given function every time the metrics are collected"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def get(self, **labels) -> float:
+        key = self._key(labels)
+        if key in self._functions:
+            return float(self._functions[key]())
+        return self._values.get(key, 0.0)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = float(function())
+            except Exception:
+                values[key] = math.nan
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_TIME_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def get_count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels), ([0] * len(self.buckets), 0.0))
+        return counts[-1]
+
+    def get_sum(self, **labels) -> float:
+        return self._values.get(self._key(labels), (None, 0.0))[1]
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"A metric named '{metric.name}' is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "preprocessor_stage_duration_seconds",
+    "Time spent in each stage of the preprocessing pipeline",
+    labelnames=("stage",)
+))
+BYTES_PROCESSED = REGISTRY.register(Counter(
+    "preprocessor_bytes_processed_total",
+    "Bytes of uploaded header and data cube files that were processed",
+    labelnames=("kind",)
+))
+CUBE_DIMENSION = REGISTRY.register(Histogram(
+    "preprocessor_cube_dimension",
+    "Rows, columns and bands of the processed data cubes",
+    labelnames=("axis",),
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+))
+RESAMPLED_PIXELS = REGISTRY.register(Counter(
+    "preprocessor_resampled_pixels_total",
+    "Pixel spectra resampled to the target wavelengths"
+))
+DETECTED_SAMPLES = REGISTRY.register(Histogram(
+    "preprocessor_detected_samples",
+    "Samples detected by the segmentation model per data cube",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64)
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "preprocessor_queue_depth",
+    "Items waiting in the background queues of the service",
+    labelnames=("queue",)
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "preprocessor_cache_requests_total",
+    "Lookups in the caches of the service, see the result label for the hit ratio",
+    labelnames=("cache", "result")
+))
+REQUESTS = REGISTRY.register(Counter(
+    "preprocessor_requests_total",
+    "Preprocessing requests handled per endpoint and response status",
+    labelnames=("endpoint", "status")
+))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "preprocessor_request_duration_seconds",
+    "Total time spent handling preprocessing requests",
+    labelnames=("endpoint",)
+))
+MEMORY_BUDGET = REGISTRY.register(Gauge(
+    "preprocessor_memory_budget_bytes",
+    "Total memory budget of the admission control and the part reserved by running requests",
+    labelnames=("state",)
+))
+ADMISSIONS = REGISTRY.register(Counter(
+    "preprocessor_admissions_total",
+    "Admission control decisions: admitted, downgraded to tiled mode, queued, timed out or rejected",
+    labelnames=("decision",)
+))
+REQUEST_PEAK_RSS = REGISTRY.register(Histogram(
+    "preprocessor_request_peak_rss_bytes",
+    "Increase of the resident memory of the process while a request was running",
+    labelnames=("mode",),
+    buckets=tuple(2 ** power * 1024 * 1024 for power in range(4, 16))
+))
+MEMORY_ESTIMATE_RATIO = REGISTRY.register(Histogram(
+    "preprocessor_memory_estimate_ratio",
+    "Observed peak memory of a request divided by its uncalibrated estimate",
+    labelnames=("mode",),
+    buckets=(0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0, 3.0, 4.0)
+))
+SCHEDULED_REQUESTS = REGISTRY.register(Counter(
+    "preprocessor_scheduled_requests_total",
+    "Requests submitted to the compute scheduler per cost class",
+    labelnames=("cost_class",)
+))
+SCHEDULER_WAIT = REGISTRY.register(Histogram(
+    "preprocessor_scheduler_wait_seconds",
+    "Time requests waited for a compute slot per cost class",
+    labelnames=("cost_class",)
+))
+STARTUP_DURATION = REGISTRY.register(Gauge(
+    "preprocessor_startup_duration_seconds",
+    "Time it took to import the service and to run its startup",
+    labelnames=("phase",)
+))
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    "preprocessor_log_records_dropped_total",
+    "Log records dropped because the logging queue was full"
+))
+
+
+def record_cache_access(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+@contextmanager
+def time_stage(stage: str):
+    """Observes the duration of the wrapped block as the given pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+
+
+class StageTimer:
+    """
+    Measures consecutive pipeline stages of a single request. Entering a
+    stage ends the previous one, every finished stage is observed in the
+    stage duration histogram and added up in `durations`
+    """
+    def __init__(self):
+        self.durations: dict[str, float] = {}
+        self._stage: Optional[str] = None
+        self._start = 0.0
+
+    def enter(self, stage: str):
+        self.stop()
+        self._stage = stage
+        self._start = time.perf_counter()
+
+    def stop(self):
+        if self._stage is None:
+            return
+        elapsed = time.perf_counter() - self._start
+        self.durations[self._stage] = self.durations.get(self._stage, 0.0) + elapsed
+        STAGE_DURATION.observe(elapsed, stage=self._stage)
+        self._stage = None
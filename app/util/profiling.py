@@ -0,0 +1,160 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+PROFILE_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+PROFILE_FORMATS = {
+    "speedscope": ("speedscope.json", "application/json"),
+    "collapsed": ("collapsed.txt", "text/plain"),
+}
+
+# (function name, file name, first line of the function)
+Frame = tuple[str, str, int]
+
+# Profiler of the current request, work handed off to other threads follows it
+CURRENT_PROFILER: ContextVar[Optional["SamplingProfiler"]] = ContextVar("current_profiler", default=None)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a single thread. A background thread takes a
+    snapshot of the target thread's Python stack every `interval` seconds,
+    so time spent in numpy, scipy or ultralytics shows up under the Python
+    function that called into them. The overhead only depends on the
+    interval, not on how many functions the profiled code calls
+    """
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.samples: Counter[tuple[Frame, ...]] = Counter()
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start = 0.0
+        self._followed: list[int] = []
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration = time.perf_counter() - self._start
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def follow(self):
+        """Samples the calling thread instead of the target until unfollow is called"""
+        self._followed.append(threading.get_ident())
+
+    def unfollow(self):
+        self._followed.remove(threading.get_ident())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            followed = self._followed
+            frame = sys._current_frames().get(followed[-1] if followed else self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    @property
+    def sample_count(self) -> int:
+        return sum(self.samples.values())
+
+    def to_collapsed(self) -> str:
+        """
+        Returns the samples in the collapsed stack format used by
+        flamegraph.pl and most flame graph viewers, root frame first
+        """
+        lines = [
+            ";".join(f"{name} ({filename}:{line})" for name, filename, line in stack) + f" {count}"
+            for stack, count in self.samples.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self, name: str = "preprocess") -> dict:
+        """Returns the samples as a sampled profile in the speedscope file format"""
+        frame_indices: dict[Frame, int] = {}
+        frames = []
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_indices:
+                    frame_indices[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_indices[frame])
+            samples.append(indices)
+            weights.append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": samples,
+                "weights": weights
+            }],
+            "name": name,
+            "exporter": "preprocessor-service"
+        }
+
+
+def server_timing_header(durations: dict[str, float]) -> str:
+    """Formats stage durations in seconds as a Server-Timing header value"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+
+class ProfileStore:
+    """
+    Keeps the profiles of profiled requests on disk, in every supported
+    format, so they can be downloaded after the request finished
+    """
+    def __init__(self, profile_dir: str):
+        self.profile_dir = profile_dir
+
+    def save(self, profiler: SamplingProfiler, name: str) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profile_id = uuid.uuid4().hex
+        with open(self.path(profile_id, "speedscope"), "w") as f:
+            json.dump(profiler.to_speedscope(name), f)
+        with open(self.path(profile_id, "collapsed"), "w") as f:
+            f.write(profiler.to_collapsed())
+        return profile_id
+
+    def path(self, profile_id: str, profile_format: str) -> str:
+        suffix, _ = PROFILE_FORMATS[profile_format]
+        return os.path.join(self.profile_dir, f"{profile_id}.{suffix}")
+
+    def find(self, profile_id: str, profile_format: str) -> Optional[str]:
+        if not PROFILE_ID_PATTERN.fullmatch(profile_id) or profile_format not in PROFILE_FORMATS:
+            return None
+        path = self.path(profile_id, profile_format)
+        return path if os.path.exists(path) else None
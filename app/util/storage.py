@@ -0,0 +1,130 @@
+import logging
+import uuid
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, Optional
+from app.schemas.exceptions import StorageUploadError
+from app.util.metrics import time_stage
+
+if TYPE_CHECKING:
+    import httpx
+    from pandas import DataFrame
+
+STAGE_STORAGE_POST = "storage_post"
+CSV_CHUNK_ROWS = 64
+STORAGE_TIMEOUT = 120.0
+
+logger = logging.getLogger(__name__)
+
+
+def iter_csv_chunks(df: "DataFrame", chunk_rows: int = CSV_CHUNK_ROWS) -> Iterable[bytes]:
+    """
+    Serializes a DataFrame into .csv formatted bytes, a few rows
+    at a time, so the full text never has to exist in memory or on disk
+
+    Parameters
+    ----------
+    df: DataFrame
+        The preprocessed features to serialize
+    chunk_rows: int
+        Number of rows serialized per yielded chunk
+    """
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows must be a positive integer.")
+
+    # Header first, then the rows in blocks
+    yield df.iloc[:0].to_csv(index=False).encode("utf-8")
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode("utf-8")
+
+
+async def stream_multipart(
+    field: str,
+    filename: str,
+    content_type: str,
+    chunks: Iterable[bytes],
+    boundary: str
+) -> AsyncIterator[bytes]:
+    """
+    Wraps the given chunks into a single-part multipart/form-data body,
+    yielding it piece by piece as the chunks are produced
+    """
+    yield (
+        f"--{boundary}\r\n"
+        f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode("utf-8")
+    for chunk in chunks:
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+
+def iter_file_chunks(path: str, chunk_size: int = 1024 * 1024) -> Iterable[bytes]:
+    """
+    Reads a file in fixed size chunks
+    """
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def upload_csv_chunks(
+    chunks: Iterable[bytes],
+    filename: str,
+    storage_endpoint: str,
+    client: Optional["httpx.AsyncClient"] = None
+) -> str:
+    """
+    Streams .csv formatted chunks to the storage service as a single
+    .csv file upload and returns the uid the storage assigned to it
+
+    Parameters
+    ----------
+    chunks: Iterable[bytes]
+        The .csv file contents, header first
+    filename: str
+        Name of the uploaded file, without extension
+    storage_endpoint: str
+        URL of the storage service upload endpoint
+    client: httpx.AsyncClient
+        Optional client to reuse, a new one is created otherwise
+    """
+    boundary = uuid.uuid4().hex
+    body = stream_multipart(
+        field="csv",
+        filename=f"{filename}.csv",
+        content_type="text/csv",
+        chunks=chunks,
+        boundary=boundary
+    )
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+    logger.debug("Uploading features to storage", extra={"storage_endpoint": storage_endpoint, "csv_file": f"{filename}.csv"})
+    with time_stage(STAGE_STORAGE_POST):
+        if client is None:
+            import httpx
+            async with httpx.AsyncClient() as own_client:
+                response = await own_client.post(storage_endpoint, content=body, headers=headers, timeout=STORAGE_TIMEOUT)
+        else:
+            response = await client.post(storage_endpoint, content=body, headers=headers, timeout=STORAGE_TIMEOUT)
+
+    if response.status_code != 200:
+        raise StorageUploadError(detail=f"Storage service responded with status code {response.status_code}")
+
+    body = response.json()
+    if "uid" not in body:
+        raise StorageUploadError(detail="Storage service response is missing the 'uid' field")
+
+    logger.info("Uploaded features to storage", extra={"storage_endpoint": storage_endpoint, "uid": body["uid"]})
+    return body["uid"]
+
+
+async def upload_features(
+    df: "DataFrame",
+    filename: str,
+    storage_endpoint: str,
+    client: Optional["httpx.AsyncClient"] = None
+) -> str:
+    """
+    Streams the preprocessed features to the storage service as a .csv
+    file upload and returns the uid the storage assigned to it
+    """
+    return await upload_csv_chunks(iter_csv_chunks(df), filename, storage_endpoint, client)
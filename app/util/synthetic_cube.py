@@ -0,0 +1,101 @@
+import numpy as np
+from numpy import ndarray
+from app.schemas.data_models import SyntheticCubeSpec, ENVI_DATA_TYPES
+from app.util.envi_reader import INTERLEAVE_TRANSPOSE
+
+# Reflectance in [0, 1] is stored scaled to this value by integer cubes,
+# the way most cameras store it
+INTEGER_SCALE = {"uint8": 255, "int16": 10000, "uint16": 10000}
+ROW_BLOCK = 64
+NOISE_LEVEL = 0.01
+
+
+def synthetic_cube_nbytes(spec: SyntheticCubeSpec) -> int:
+    return spec.rows * spec.cols * spec.bands * np.dtype(spec.dtype.value).itemsize
+
+
+def background_spectrum(wavelengths: ndarray) -> ndarray:
+    """Dark, almost flat reflectance of a conveyor belt or tray"""
+    return (0.04 + 0.02 * (wavelengths - wavelengths[0]) / max(np.ptp(wavelengths), 1e-9)).astype(np.float32)
+
+
+def object_spectrum(wavelengths: ndarray, rng: np.random.Generator) -> ndarray:
+    """
+    Reflectance resembling fruit or leaves: a green peak around 550 nm,
+    chlorophyll absorption around 680 nm and the red edge rising to a
+    near infrared plateau. Every object gets slightly different features
+    """
+    green_peak = 0.12 * rng.uniform(0.7, 1.3) * np.exp(-((wavelengths - 550) / 40) ** 2)
+    red_edge = rng.uniform(0.4, 0.6) / (1 + np.exp(-(wavelengths - rng.uniform(705, 725)) / 15))
+    absorption = 0.05 * np.exp(-((wavelengths - 680) / 20) ** 2)
+    return (0.05 + green_peak + red_edge - absorption).astype(np.float32)
+
+
+def generate_cube(spec: SyntheticCubeSpec, wavelengths: ndarray) -> ndarray:
+    """
+    Generates a reflectance cube with shape (rows, cols, bands) in the
+    data type of the spec: elliptical objects with their own spectra and
+    some shading on a dark background, plus sensor noise. The cube is
+    filled a block of rows at a time, so the temporary float arrays stay
+    small no matter how large the cube is
+    """
+    rng = np.random.default_rng(spec.seed)
+    dtype = np.dtype(spec.dtype.value)
+    scale = INTEGER_SCALE.get(spec.dtype.value, 1.0)
+
+    # Label 0 is the background, label i the i-th object
+    spectra = np.stack(
+        [background_spectrum(wavelengths)] + [object_spectrum(wavelengths, rng) for _ in range(spec.objects)]
+    )
+    centers = rng.uniform((0, 0), (spec.rows, spec.cols), size=(spec.objects, 2))
+    radii = rng.uniform(0.05, 0.15, size=(spec.objects, 2)) * min(spec.rows, spec.cols) + 1
+    col_coords = np.arange(spec.cols, dtype=np.float32)
+
+    cube = np.empty((spec.rows, spec.cols, spec.bands), dtype=dtype)
+    for start in range(0, spec.rows, ROW_BLOCK):
+        row_coords = np.arange(start, min(start + ROW_BLOCK, spec.rows), dtype=np.float32)[:, None]
+        labels = np.zeros((len(row_coords), spec.cols), dtype=np.intp)
+        shading = np.ones(labels.shape, dtype=np.float32)
+        for i, ((center_row, center_col), (radius_row, radius_col)) in enumerate(zip(centers, radii)):
+            distance = ((row_coords - center_row) / radius_row) ** 2 + ((col_coords - center_col) / radius_col) ** 2
+            inside = distance < 1
+            labels[inside] = i + 1
+            # Objects get darker towards their edges, like real round fruit
+            shading[inside] = 1 - 0.3 * distance[inside]
+
+        block = spectra[labels] * shading[..., None]
+        block += rng.standard_normal(block.shape, dtype=np.float32) * NOISE_LEVEL
+        np.clip(block, 0, None, out=block)
+        if dtype.kind in "iu":
+            block = np.clip(np.rint(block * scale), np.iinfo(dtype).min, np.iinfo(dtype).max)
+        cube[start:start + len(row_coords)] = block
+
+    return cube
+
+
+def encode_envi_cube(cube: ndarray, wavelengths: ndarray, interleave: str, description: str = "Synthetic cube") -> tuple[bytes, bytes]:
+    """
+    Encodes a (rows, cols, bands) cube as the contents of an ENVI header
+    and data file with the given interleave, in the data type of the cube
+    """
+    (rows, cols, bands) = cube.shape
+    envi_data_type = next(code for data_type, code in ENVI_DATA_TYPES.items() if data_type.value == cube.dtype.name)
+    header = (
+        "ENVI\n"
+        f"description = {{{description}}}\n"
+        f"samples = {cols}\n"
+        f"lines = {rows}\n"
+        f"bands = {bands}\n"
+        "header offset = 0\n"
+        "file type = ENVI Standard\n"
+        f"data type = {envi_data_type}\n"
+        f"interleave = {interleave}\n"
+        "byte order = 0\n"
+        f"wavelength = {{{', '.join(f'{w:.2f}' for w in wavelengths)}}}\n"
+        "wavelength units = Nanometers\n"
+    )
+
+    # Inverse of the transpose the reader applies to get to (rows, cols, bands)
+    axes = np.argsort(INTERLEAVE_TRANSPOSE[interleave])
+    data = np.ascontiguousarray(cube.transpose(axes), dtype=cube.dtype.newbyteorder("<"))
+    return header.encode("utf-8"), data.tobytes()
@@ -1,6 +1,8 @@
+import os
 from fastapi import UploadFile, File
 from typing import Optional
-from app.schemas.exceptions import InvalidFileFormatError
+from app.schemas.exceptions import InvalidFileFormatError, DatasetPathError
+from app.util.decompression import strip_compression
 
 
 def basic_file_validation(
@@ -25,11 +27,12 @@ def basic_file_validation(
             if not hasattr(cube_file, "filename"):
                 raise InvalidFileFormatError(detail="The provided cube file is invalid - no attribute 'filename'")
             hdr_extension = "." + hdr_file.filename.split(".")[-1].lower()
-            cube_extension = "." + cube_file.filename.split(".")[-1].lower()
+            # Cubes may also be uploaded compressed, e.g. as .raw.zst
+            cube_extension = "." + strip_compression(cube_file.filename).split(".")[-1].lower()
             if hdr_extension != ".hdr":
                 raise InvalidFileFormatError(detail="Invalid header file extension. Only '.hdr' extensions are supported.")
             if cube_extension not in allowed_cube_extensions:
-                raise InvalidFileFormatError(detail="Invalid data cube file extension. Only '.raw' and '.bin' extensions are supported")
+                raise InvalidFileFormatError(detail="Invalid data cube file extension. Only '.raw' and '.bin' extensions are supported, optionally compressed as '.gz' or '.zst'")
             if not hasattr(hdr_file, "file"):
                 raise InvalidFileFormatError(detail="The provided hdr file is invalid - no attribute 'file'")
             if not hasattr(cube_file, "file"):
@@ -38,3 +41,58 @@ def basic_file_validation(
         raise InvalidFileFormatError(detail=f"Error occurred while validating uploaded files. Exception: {e}")
 
     return True
+
+
+
+def archive_file_validation(archive_file: Optional[UploadFile] = File(None)) -> bool:
+    """
+    Returns true if the provided archive of data cubes
+    is a zip or tar file, raises a corresponding exception
+    otherwise
+    """
+    allowed_archive_extensions = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+    if archive_file is None:
+        raise InvalidFileFormatError(detail="The archive file is missing from the request data.")
+    if not getattr(archive_file, "filename", None) or not hasattr(archive_file, "file"):
+        raise InvalidFileFormatError(detail="The provided archive file is invalid - no attribute 'filename' or 'file'")
+    if not archive_file.filename.lower().endswith(allowed_archive_extensions):
+        raise InvalidFileFormatError(detail="Invalid archive file extension. Only zip and tar archives are supported.")
+
+    return True
+
+
+def resolve_dataset_path(path: Optional[str], root: str) -> str:
+    """
+    Returns the real path of a file given relative to the dataset root,
+    raises a DatasetPathError if it is not a file below the root. Symbolic
+    links are resolved first, so neither they nor '..' can lead outside
+    """
+    if not root:
+        raise DatasetPathError(detail="Ingesting data cubes by path is not enabled on this service.")
+    if not path or "\0" in path:
+        raise DatasetPathError(detail="The data cube path is missing or invalid.", status_code=400)
+
+    real_root = os.path.realpath(root)
+    real_path = os.path.realpath(os.path.join(real_root, path))
+    if os.path.commonpath([real_root, real_path]) != real_root:
+        raise DatasetPathError(detail=f"The path '{path}' is outside of the dataset root.")
+    if not os.path.isfile(real_path):
+        raise DatasetPathError(detail=f"No file '{path}' in the dataset root.", status_code=404)
+    return real_path
+
+
+def dataset_file_validation(hdr_path: Optional[str], cube_path: Optional[str], root: str) -> tuple[str, str]:
+    """
+    Returns the resolved header and data cube paths if both name files
+    with supported extensions below the dataset root, raises a
+    corresponding exception otherwise
+    """
+    allowed_cube_extensions = (".raw", ".bin")
+    real_hdr_path = resolve_dataset_path(hdr_path, root)
+    real_cube_path = resolve_dataset_path(cube_path, root)
+    if not real_hdr_path.lower().endswith(".hdr"):
+        raise InvalidFileFormatError(detail="Invalid header file extension. Only '.hdr' extensions are supported.")
+    if not real_cube_path.lower().endswith(allowed_cube_extensions):
+        raise InvalidFileFormatError(detail="Invalid data cube file extension. Only '.raw' and '.bin' extensions are supported")
+
+    return real_hdr_path, real_cube_path
@@ -0,0 +1,353 @@
+"""
+End-to-end load test of the preprocessing service. Starts the service with
+uvicorn and a local stand-in for the storage service, fires concurrent
+multipart /preprocess requests with synthetic cubes and reports the
+throughput, latency percentiles, error rates and the RSS of the service
+over time
+
+Usage:
+    python -m benchmarks.loadtest --concurrency 8 --requests 200
+    python -m benchmarks.loadtest --duration 60 --sizes small,medium
+    python -m benchmarks.loadtest --params '[{}, {"remove_background": true}]'
+    python -m benchmarks.loadtest --storage-latency 2 --storage-failure-rate 0.1
+    python -m benchmarks.loadtest --url http://127.0.0.1:8001 --pid 1234   # an already running service
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+import httpx
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from app.core.config import settings
+from app.schemas.data_models import SyntheticCubeSpec, CubeDataType, CubeInterleave
+from app.util.synthetic_cube import generate_cube, encode_envi_cube
+from benchmarks.run import SIZES, SEED, SOURCE_BANDS
+
+RSS_SAMPLE_INTERVAL = 0.5
+STARTUP_TIMEOUT = 120.0
+REQUEST_TIMEOUT = 600.0
+
+
+@dataclass
+class Sample:
+    size: str
+    status: Optional[int]  # None when the request itself failed
+    seconds: float
+    finished_at: float
+    error: Optional[str] = None
+
+
+@dataclass
+class StorageStandIn:
+    """
+    Local replacement of the storage service, answers every upload with a
+    new uid after an optional delay and fails a share of the uploads
+    """
+    latency: float = 0.0
+    failure_rate: float = 0.0
+    uploads: int = 0
+    uploaded_bytes: int = 0
+    failures: int = 0
+    server: Optional[uvicorn.Server] = field(default=None, repr=False)
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/upload")
+        async def upload(request: Request):
+            body = await request.body()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if random.random() < self.failure_rate:
+                self.failures += 1
+                return JSONResponse(status_code=503, content={"detail": "Storage unavailable"})
+            self.uploads += 1
+            self.uploaded_bytes += len(body)
+            return {"uid": uuid.uuid4().hex}
+
+        return app
+
+    def start(self, port: int):
+        config = uvicorn.Config(self.create_app(), host="127.0.0.1", port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        threading.Thread(target=self.server.run, name="storage-stand-in", daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.05)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.should_exit = True
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree_rss(pid: int) -> int:
+    """Resident memory in bytes of a process and all its children, read from /proc"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+def start_service(port: int, workdir: str) -> subprocess.Popen:
+    # Keep the job and delivery spools of the run out of the working tree
+    env = {
+        **os.environ,
+        "JOB_DIR": os.path.join(workdir, "jobs"),
+        "SPOOL_DIR": os.path.join(workdir, "spool"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+
+
+def wait_until_healthy(url: str, service: Optional[subprocess.Popen]):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if service is not None and service.poll() is not None:
+            raise RuntimeError(f"The service exited with code {service.returncode} during startup")
+        try:
+            if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The service at {url} did not become healthy within {STARTUP_TIMEOUT} seconds")
+
+
+def make_payloads(sizes: list[str], dtype: CubeDataType, interleave: CubeInterleave) -> dict[str, tuple[bytes, bytes]]:
+    payloads = {}
+    wavelengths = np.linspace(470, 900, SOURCE_BANDS)
+    for size in sizes:
+        spec = SyntheticCubeSpec(
+            rows=SIZES[size]["rows"],
+            cols=SIZES[size]["cols"],
+            bands=SOURCE_BANDS,
+            objects=SIZES[size]["objects"],
+            dtype=dtype,
+            interleave=interleave,
+            seed=SEED
+        )
+        cube = generate_cube(spec, wavelengths)
+        payloads[size] = encode_envi_cube(cube, wavelengths, interleave.value, description=f"Load test cube {size}")
+    return payloads
+
+
+async def sample_rss(pid: int, started: float, timeline: list[tuple[float, int]], stop: asyncio.Event):
+    while not stop.is_set():
+        timeline.append((time.perf_counter() - started, process_tree_rss(pid)))
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(
+    url: str,
+    payloads: dict[str, tuple[bytes, bytes]],
+    param_mix: list[dict],
+    storage_endpoint: str,
+    concurrency: int,
+    requests: Optional[int],
+    duration: Optional[float],
+    pid: Optional[int]
+) -> tuple[list[Sample], list[tuple[float, int]], float]:
+    endpoint = f"{url}{settings.API_STR}/preprocess"
+    jobs = itertools.cycle(itertools.product(payloads, range(len(param_mix))))
+    remaining = itertools.count() if requests is None else iter(range(requests))
+    samples: list[Sample] = []
+    timeline: list[tuple[float, int]] = []
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+    lock = asyncio.Lock()
+
+    async def next_job():
+        async with lock:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            if next(remaining, None) is None:
+                return None
+            return next(jobs)
+
+    async def worker(client: httpx.AsyncClient):
+        while (job := await next_job()) is not None:
+            size, params_index = job
+            hdr_bytes, cube_bytes = payloads[size]
+            data = {"storage_endpoint": storage_endpoint, **param_mix[params_index]}
+            data = {key: json.dumps(value) if isinstance(value, (list, bool)) else str(value) for key, value in data.items()}
+            files = {
+                "hdr_file": (f"{size}.hdr", hdr_bytes, "application/octet-stream"),
+                "cube_file": (f"{size}.raw", cube_bytes, "application/octet-stream")
+            }
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, data=data, files=files)
+                error = None if response.status_code < 400 else response.text[:200]
+                sample = Sample(size, response.status_code, time.perf_counter() - start, time.perf_counter() - started, error)
+            except httpx.HTTPError as e:
+                sample = Sample(size, None, time.perf_counter() - start, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+            samples.append(sample)
+
+    stop = asyncio.Event()
+    rss_task = asyncio.create_task(sample_rss(pid, started, timeline, stop)) if pid else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    if rss_task is not None:
+        await rss_task
+    return samples, timeline, elapsed
+
+
+def summarize(samples: list[Sample], timeline: list[tuple[float, int]], elapsed: float) -> dict:
+    def latency_stats(group: list[Sample]) -> dict:
+        latencies = np.array([s.seconds for s in group]) if group else np.zeros(1)
+        return {
+            "requests": len(group),
+            "p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(latencies.max()),
+        }
+
+    statuses = Counter("error" if s.status is None else str(s.status) for s in samples)
+    failed = [s for s in samples if s.status is None or s.status >= 400]
+    rss = [value for _, value in timeline]
+    return {
+        "elapsed": elapsed,
+        "requests": len(samples),
+        "rps": len(samples) / elapsed if elapsed else 0.0,
+        "error_rate": len(failed) / len(samples) if samples else 0.0,
+        "statuses": dict(statuses),
+        "latency": latency_stats(samples),
+        "latency_by_size": {size: latency_stats([s for s in samples if s.size == size]) for size in sorted({s.size for s in samples})},
+        "errors": dict(Counter(s.error for s in failed).most_common(5)),
+        "rss": {
+            "start_mb": rss[0] / 1024 / 1024 if rss else None,
+            "peak_mb": max(rss) / 1024 / 1024 if rss else None,
+            "end_mb": rss[-1] / 1024 / 1024 if rss else None,
+            "timeline": [(round(t, 2), round(value / 1024 / 1024, 1)) for t, value in timeline],
+        }
+    }
+
+
+def print_report(report: dict, storage: Optional[StorageStandIn]):
+    print(f"\n{report['requests']} requests in {report['elapsed']:.1f} s, {report['rps']:.2f} requests/s")
+    print(f"Error rate {report['error_rate'] * 100:.1f}%, statuses {report['statuses']}")
+    print(f"\n{'latency (s)':<14} {'requests':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    rows = [("all", report["latency"])] + list(report["latency_by_size"].items())
+    for name, stats in rows:
+        print(f"{name:<14} {stats['requests']:>9} {stats['p50']:>9.3f} {stats['p90']:>9.3f} {stats['p99']:>9.3f} {stats['max']:>9.3f}")
+    for error, count in report["errors"].items():
+        print(f"  {count} x {error}")
+
+    rss = report["rss"]
+    if rss["peak_mb"] is not None:
+        print(f"\nService RSS: {rss['start_mb']:.0f} MB at start, {rss['peak_mb']:.0f} MB peak, {rss['end_mb']:.0f} MB at the end")
+        # About 20 points of the timeline are enough to see the trend
+        step = max(1, len(rss["timeline"]) // 20)
+        print("  " + ", ".join(f"{t:.1f}s: {mb:.0f} MB" for t, mb in rss["timeline"][::step]))
+    if storage is not None:
+        print(f"\nStorage stand-in: {storage.uploads} uploads, {storage.uploaded_bytes / 1024 / 1024:.1f} MB, {storage.failures} failed on purpose")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="End-to-end load test of the preprocessing service")
+    parser.add_argument("--url", default=None, help="URL of a running service, one is started otherwise")
+    parser.add_argument("--pid", type=int, default=None, help="Process id of the running service to track the RSS of")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at the same time")
+    parser.add_argument("--requests", type=int, default=None, help="Total requests to send, 100 if no duration is given")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to keep sending requests for")
+    parser.add_argument("--sizes", default="small", help=f"Comma separated cube sizes to cycle through, out of {list(SIZES)}")
+    parser.add_argument("--dtype", default=CubeDataType.UINT16.value, help="Data type of the uploaded cubes")
+    parser.add_argument("--interleave", default=CubeInterleave.BIL.value, help="Interleave of the uploaded cubes")
+    parser.add_argument("--params", default="[{}]", help="JSON list of parameter sets to cycle through")
+    parser.add_argument("--storage-endpoint", default=None, help="Storage endpoint to use instead of the local stand-in")
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="Seconds the stand-in waits before answering")
+    parser.add_argument("--storage-failure-rate", type=float, default=0.0, help="Share of uploads the stand-in fails")
+    parser.add_argument("--json", default=None, help="Also write the full report to this file")
+    args = parser.parse_args(argv)
+
+    sizes = [size for size in args.sizes.split(",") if size]
+    if any(size not in SIZES for size in sizes):
+        parser.error(f"Unknown sizes in {sizes}, expected some of {list(SIZES)}")
+    param_mix = json.loads(args.params)
+    if not isinstance(param_mix, list) or not param_mix or not all(isinstance(p, dict) for p in param_mix):
+        parser.error("--params must be a JSON list of objects")
+    requests = args.requests if args.requests is not None or args.duration is not None else 100
+
+    payloads = make_payloads(sizes, CubeDataType(args.dtype), CubeInterleave(args.interleave))
+    storage = None
+    storage_endpoint = args.storage_endpoint
+    if storage_endpoint is None:
+        storage = StorageStandIn(latency=args.storage_latency, failure_rate=args.storage_failure_rate)
+        storage_port = free_port()
+        storage.start(storage_port)
+        storage_endpoint = f"http://127.0.0.1:{storage_port}/upload"
+
+    service = None
+    pid = args.pid
+    url = args.url
+    with tempfile.TemporaryDirectory(prefix="preprocessor-loadtest-") as workdir:
+        try:
+            if url is None:
+                port = free_port()
+                service = start_service(port, workdir)
+                pid = service.pid
+                url = f"http://127.0.0.1:{port}"
+            wait_until_healthy(url, service)
+
+            samples, timeline, elapsed = asyncio.run(run_load(
+                url, payloads, param_mix, storage_endpoint, args.concurrency, requests, args.duration, pid
+            ))
+        finally:
+            if service is not None:
+                service.terminate()
+                service.wait(timeout=30)
+            if storage is not None:
+                storage.stop()
+
+    report = summarize(samples, timeline, elapsed)
+    print_report(report, storage)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+Benchmarks of the preprocessing pipeline stages on deterministic synthetic
+cubes. Every benchmark reports its best wall time out of a few repeats,
+its throughput and the peak memory traced in a separate run, and is
+compared against a stored baseline
+
+Usage:
+    python -m benchmarks.run                          # compare against benchmarks/baseline.json
+    python -m benchmarks.run --sizes small,medium     # only some sizes
+    python -m benchmarks.run --only resample_img_data # only some benchmarks
+    python -m benchmarks.run --save-baseline          # store the results as the new baseline
+"""
+import argparse
+import asyncio
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Optional
+import numpy as np
+from fastapi import UploadFile
+from app.schemas.data_models import PreprocessingParameters, SyntheticCubeSpec, CubeDataType, CubeInterleave
+from app.util.synthetic_cube import generate_cube, encode_envi_cube
+from app.util.background_removal import calculate_simple_background_mask
+from app.util.csv_utils import create_feature_row
+from app.core.extraction import calculate_average_spectrum, calculate_continuum_removal
+from app.core.resampling import resample_img_data, resize_wavelengths
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+SEED = 42
+SOURCE_BANDS = 204  # Band count of the VIS camera, resampled to the default target_bands
+MIN_REPEAT_SECONDS = 0.2  # Fast benchmarks are looped for at least this long per repeat
+
+# rows, cols, objects and the number of spectra or samples of each size
+SIZES = {
+    "small": {"rows": 64, "cols": 64, "objects": 2, "spectra": 16},
+    "medium": {"rows": 256, "cols": 256, "objects": 4, "spectra": 128},
+    "large": {"rows": 512, "cols": 512, "objects": 8, "spectra": 512},
+}
+
+
+@dataclass
+class Benchmark:
+    name: str
+    size: str
+    run: Callable[[], object]
+    items: int  # Pixels, spectra or rows handled per run
+    unit: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}[{self.size}]"
+
+
+@dataclass
+class Result:
+    seconds: float
+    throughput: float
+    unit: str
+    peak_mb: float
+
+
+def synthetic_cube(size: str) -> tuple[np.ndarray, np.ndarray]:
+    spec = SyntheticCubeSpec(
+        rows=SIZES[size]["rows"],
+        cols=SIZES[size]["cols"],
+        bands=SOURCE_BANDS,
+        objects=SIZES[size]["objects"],
+        dtype=CubeDataType.FLOAT32,
+        seed=SEED
+    )
+    params = PreprocessingParameters()
+    wavelengths = np.linspace(params.min_wavelength, params.max_wavelength, SOURCE_BANDS)
+    return generate_cube(spec, wavelengths), wavelengths
+
+
+def make_benchmarks(size: str) -> list[Benchmark]:
+    # Imported here so the other benchmarks run without loading the segmentation model
+    from app.util.cube_slicer import extract_shape
+    from app.core.preprocessor import preprocess
+
+    params = PreprocessingParameters()
+    cube, wavelengths = synthetic_cube(size)
+    (rows, cols, _) = cube.shape
+    pixels = rows * cols
+    target_wavelengths = resize_wavelengths(wavelengths, params.target_bands)
+    resampled = resample_img_data(cube, wavelengths, target_wavelengths)
+    mask = calculate_simple_background_mask(resampled)
+
+    rng = np.random.default_rng(SEED)
+    spectra_count = SIZES[size]["spectra"]
+    spectra = resampled.reshape(-1, params.target_bands)[rng.choice(pixels, spectra_count, replace=False)]
+    features = [{method: spectrum for method in params.extraction_methods} for spectrum in spectra]
+
+    # The bounding box of the centre quarter, with the background mask as segmentation mask
+    box = [cols // 4, rows // 4, cols * 3 // 4, rows * 3 // 4]
+    box_pixels = (box[2] - box[0]) * (box[3] - box[1])
+
+    hdr_bytes, cube_bytes = encode_envi_cube(cube, wavelengths, CubeInterleave.BIL.value)
+
+    def run_preprocess():
+        hdr_file = UploadFile(filename="benchmark.hdr", file=io.BytesIO(hdr_bytes))
+        cube_file = UploadFile(filename="benchmark.raw", file=io.BytesIO(cube_bytes))
+        return asyncio.run(preprocess(hdr_file=hdr_file, cube_file=cube_file, params=params))
+
+    return [
+        Benchmark("resample_img_data", size, lambda: resample_img_data(cube, wavelengths, target_wavelengths), pixels, "pixels/s"),
+        Benchmark("calculate_average_spectrum", size, lambda: calculate_average_spectrum(resampled, mask), pixels, "pixels/s"),
+        Benchmark("calculate_continuum_removal", size, lambda: [calculate_continuum_removal(s, target_wavelengths) for s in spectra], spectra_count, "spectra/s"),
+        Benchmark("calculate_simple_background_mask", size, lambda: calculate_simple_background_mask(resampled), pixels, "pixels/s"),
+        Benchmark("extract_shape", size, lambda: extract_shape(resampled, box, mask.astype(np.float32)), box_pixels, "pixels/s"),
+        Benchmark("create_feature_row", size, lambda: create_feature_row(features, params), spectra_count, "rows/s"),
+        Benchmark("preprocess", size, run_preprocess, pixels, "pixels/s"),
+    ]
+
+
+def measure(benchmark: Benchmark, repeats: int) -> Result:
+    # Timed runs without tracing, tracemalloc slows down Python heavy code.
+    # The first run is a warm up and sets how often fast benchmarks are looped
+    start = time.perf_counter()
+    benchmark.run()
+    loops = max(1, int(MIN_REPEAT_SECONDS / max(time.perf_counter() - start, 1e-9)))
+
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(loops):
+            benchmark.run()
+        timings.append((time.perf_counter() - start) / loops)
+
+    # One more run for the peak memory, numpy allocations are traced as well
+    gc.collect()
+    tracemalloc.start()
+    try:
+        benchmark.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    return Result(
+        seconds=seconds,
+        throughput=benchmark.items / seconds,
+        unit=benchmark.unit,
+        peak_mb=peak / 1024 / 1024
+    )
+
+
+def compare(results: dict[str, Result], baseline: dict, threshold: float, memory_threshold: float) -> list[str]:
+    """
+    Returns a description of every benchmark that got slower or uses more
+    memory than the baseline allows. Benchmarks missing from the baseline
+    are not compared
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if result.seconds > reference["seconds"] * (1 + threshold):
+            regressions.append(
+                f"{key}: {result.seconds * 1000:.3f} ms, baseline {reference['seconds'] * 1000:.3f} ms "
+                f"(+{(result.seconds / reference['seconds'] - 1) * 100:.0f}%)"
+            )
+        if result.peak_mb > reference["peak_mb"] * (1 + memory_threshold) and result.peak_mb - reference["peak_mb"] > 1:
+            regressions.append(f"{key}: peak memory {result.peak_mb:.1f} MB, baseline {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)["benchmarks"]
+
+
+def save_baseline(path: str, results: dict[str, Result]):
+    # Keep the stored results of the benchmarks that were not run
+    benchmarks = load_baseline(path)
+    benchmarks.update({key: vars(result) for key, result in results.items()})
+    with open(path, "w") as f:
+        json.dump({
+            "machine": {
+                "platform": platform.platform(),
+                "processor": platform.processor() or platform.machine(),
+                "cpus": os.cpu_count(),
+                "python": platform.python_version(),
+                "numpy": np.__version__
+            },
+            "benchmarks": dict(sorted(benchmarks.items()))
+        }, f, indent=2)
+        f.write("\n")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the preprocessing pipeline")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="Comma separated cube sizes to run")
+    parser.add_argument("--only", default="", help="Comma separated benchmark names to run, all by default")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per benchmark, the best one counts")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Path of the baseline file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown against the baseline, 0.25 = 25%%")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="Allowed peak memory increase against the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline instead of comparing")
+    args = parser.parse_args(argv)
+
+    sizes = [size for size in args.sizes.split(",") if size]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"Unknown sizes {unknown}, expected some of {list(SIZES)}")
+    only = {name for name in args.only.split(",") if name}
+
+    results: dict[str, Result] = {}
+    print(f"{'benchmark':<45} {'ms':>12} {'throughput':>22} {'peak MB':>10}")
+    for size in sizes:
+        for benchmark in make_benchmarks(size):
+            if only and benchmark.name not in only:
+                continue
+            result = measure(benchmark, args.repeats)
+            results[benchmark.key] = result
+            print(f"{benchmark.key:<45} {result.seconds * 1000:>12.3f} {result.throughput:>12.0f} {result.unit:<9} {result.peak_mb:>10.1f}")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if not baseline:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against the baseline (threshold {args.threshold * 100:.0f}%)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Startup report: imports the service in a fresh interpreter with
+`python -X importtime` and reports the total import time, the slowest
+modules and the packages the time is spent in. Fails when the import
+takes longer than the target, so cold starts stay fast
+
+Usage:
+    python -m benchmarks.startup                  # against the default target
+    python -m benchmarks.startup --target-ms 500  # a stricter target
+    python -m benchmarks.startup --top 30         # more modules in the report
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+MODULE = "app.main"
+TARGET_MS = 1000.0
+RUNS = 3  # The fastest run counts, the first one may still read from a cold disk cache
+
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+# Imported eagerly, these would dominate the startup of the service
+HEAVY_MODULES = ("ultralytics", "torch", "pandas", "scipy", "httpx")
+
+
+@dataclass
+class ImportTime:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    imports = []
+    for line in output.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match is not None:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append(ImportTime(module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+def measure_imports(module: str, env: Optional[dict] = None) -> list[ImportTime]:
+    """Imports the module in a new interpreter and returns the time of every import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env={**os.environ, **(env or {})},
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return parse_importtime(result.stderr)
+
+
+def total_ms(imports: list[ImportTime]) -> float:
+    # Top level imports do not overlap, their cumulative times add up
+    return sum(entry.cumulative_us for entry in imports if entry.depth == 0) / 1000
+
+
+def time_per_package(imports: list[ImportTime]) -> dict[str, float]:
+    packages = defaultdict(float)
+    for entry in imports:
+        packages[entry.module.split(".")[0]] += entry.self_us / 1000
+    return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import time report of the service")
+    parser.add_argument("--module", default=MODULE, help="Module to import")
+    parser.add_argument("--target-ms", type=float, default=TARGET_MS, help="Fails when the import takes longer")
+    parser.add_argument("--top", type=int, default=15, help="Number of modules and packages to list")
+    parser.add_argument("--runs", type=int, default=RUNS, help="Imports to measure, the fastest one counts")
+    args = parser.parse_args(argv)
+
+    imports = min((measure_imports(args.module) for _ in range(args.runs)), key=total_ms)
+    total = total_ms(imports)
+
+    print(f"{'module':<60} {'self ms':>10} {'cumulative ms':>14}")
+    for entry in sorted(imports, key=lambda entry: entry.cumulative_us, reverse=True)[:args.top]:
+        print(f"{entry.module:<60} {entry.self_us / 1000:>10.1f} {entry.cumulative_us / 1000:>14.1f}")
+
+    print(f"\n{'package':<60} {'ms':>10}")
+    for package, package_ms in list(time_per_package(imports).items())[:args.top]:
+        print(f"{package:<60} {package_ms:>10.1f}")
+
+    heavy = sorted({entry.module.split(".")[0] for entry in imports} & set(HEAVY_MODULES))
+    if heavy:
+        print(f"\nImported at startup, but only needed by some requests: {', '.join(heavy)}")
+
+    print(f"\nImporting {args.module} took {total:.0f} ms, target {args.target_ms:.0f} ms")
+    if total > args.target_ms:
+        print("SLOW STARTUP, over the target")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
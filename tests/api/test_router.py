@@ -1,8 +1,10 @@
 from app.schemas.data_models import PreprocessingParameters
+from app.core.config import settings
 from fastapi import UploadFile
 import numpy as np
 import pytest
 import io
+import zipfile
 
 # ====================
 # Creating Dummy Input
@@ -154,3 +156,122 @@ def test_upload_wrong_hdr_raw_failure(client, wrong_hdr_file, raw_file):
     response = client.post("/preprocessor/api/preprocess", files=_files)
     print(response)
     assert response.status_code == 400
+
+def test_batch_no_input_failure(client):
+    response = client.post("/preprocessor/api/preprocess/batch")
+    assert response.status_code == 400
+
+def test_batch_wrong_archive_extension_failure(client):
+    _files = {
+        "archive_file": ("batch.rar", io.BytesIO(b"content"), "application/octet-stream")
+    }
+    response = client.post("/preprocessor/api/preprocess/batch", files=_files)
+    assert response.status_code == 400
+
+def test_batch_zip_success(client, hdr_file, bin_file):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("dummy.hdr", hdr_file.file.read())
+        zf.writestr("dummy.bin", bin_file.file.read())
+        zf.writestr("orphan.hdr", b"ENVI\n")
+    archive.seek(0)
+
+    _files = {
+        "archive_file": ("batch.zip", archive, "application/zip")
+    }
+    response = client.post("/preprocessor/api/preprocess/batch", files=_files)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [cube["status"] for cube in body["cubes"]] == ["succeeded", "failed"]
+    assert body["csv"].startswith("cube_name,")
+
+def test_preprocess_storage_unavailable_is_queued(client, hdr_file, bin_file, monkeypatch):
+    monkeypatch.setattr(settings, "DELIVERY_WAIT", 0.0)
+    _files = {
+        "hdr_file": (hdr_file.filename, hdr_file.file, "application/octet-stream"),
+        "cube_file": (bin_file.filename, bin_file.file, "application/octet-stream")
+    }
+    _data = {"storage_endpoint": "http://127.0.0.1:9/upload"}
+
+    response = client.post("/preprocessor/api/preprocess", files=_files, data=_data)
+    assert response.status_code == 202
+    delivery_id = response.json()["delivery_id"]
+
+    status = client.get(f"/preprocessor/api/deliveries/{delivery_id}")
+    assert status.status_code == 200
+    assert status.json()["status"] in ("pending", "delivering")
+    assert client.get("/preprocessor/api/deliveries").status_code == 200
+
+def test_metrics_endpoint(client):
+    client.post("/preprocessor/api/preprocess")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'preprocessor_requests_total{endpoint="/preprocess",status="400"}' in response.text
+    assert 'preprocessor_queue_depth{queue="delivery"}' in response.text
+
+def test_preprocess_profiling(client, hdr_file, bin_file, monkeypatch, tmp_path):
+    from app.api import router as router_module
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "DELIVERY_WAIT", 0.0)
+    monkeypatch.setattr(router_module.profile_store, "profile_dir", str(tmp_path))
+    _files = {
+        "hdr_file": (hdr_file.filename, hdr_file.file, "application/octet-stream"),
+        "cube_file": (bin_file.filename, bin_file.file, "application/octet-stream")
+    }
+    _data = {"storage_endpoint": "http://127.0.0.1:9/upload"}
+
+    response = client.post("/preprocessor/api/preprocess", files=_files, data=_data, headers={"X-Profile": "true"})
+    assert response.status_code == 202
+    assert "loading;dur=" in response.headers["Server-Timing"]
+    assert "total;dur=" in response.headers["Server-Timing"]
+    profile_id = response.headers["X-Profile-Id"]
+
+    profile = client.get(f"/preprocessor/api/profiles/{profile_id}")
+    assert profile.status_code == 200
+    assert profile.json()["profiles"][0]["type"] == "sampled"
+    assert client.get(f"/preprocessor/api/profiles/{profile_id}?format=collapsed").status_code == 200
+    assert client.get(f"/preprocessor/api/profiles/{profile_id}?format=svg").status_code == 400
+    assert client.get("/preprocessor/api/profiles/not-a-profile").status_code == 404
+
+def test_preprocess_profiling_disabled(client, hdr_file, bin_file, monkeypatch):
+    monkeypatch.setattr(settings, "DELIVERY_WAIT", 0.0)
+    _files = {
+        "hdr_file": (hdr_file.filename, hdr_file.file, "application/octet-stream"),
+        "cube_file": (bin_file.filename, bin_file.file, "application/octet-stream")
+    }
+    _data = {"storage_endpoint": "http://127.0.0.1:9/upload"}
+
+    response = client.post("/preprocessor/api/preprocess?profile=true", files=_files, data=_data)
+    assert "X-Profile-Id" not in response.headers
+
+def test_scheduler_state(client):
+    response = client.get("/preprocessor/api/scheduler")
+    assert response.status_code == 200
+    state = response.json()
+    assert state["concurrency"] >= 1
+    assert set(state["classes"]) == {"small", "large", "multi_sample"}
+    assert state["waiting"] == []
+
+def test_preprocess_path(client, hdr_file, bin_file, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "DELIVERY_WAIT", 0.0)
+    monkeypatch.setattr(settings, "DATASET_ROOT", str(tmp_path))
+    (tmp_path / "kiwi.hdr").write_bytes(hdr_file.file.read())
+    (tmp_path / "kiwi.bin").write_bytes(bin_file.file.read())
+    _data = {"hdr_path": "kiwi.hdr", "cube_path": "kiwi.bin", "storage_endpoint": "http://127.0.0.1:9/upload"}
+
+    response = client.post("/preprocessor/api/preprocess/path", data=_data)
+    assert response.status_code == 202
+
+    response = client.post("/preprocessor/api/preprocess/path", data={**_data, "cube_path": "../kiwi.bin"})
+    assert response.status_code == 403
+    response = client.post("/preprocessor/api/preprocess/path", data={**_data, "cube_path": "apple.bin"})
+    assert response.status_code == 404
+
+def test_preprocess_path_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "DATASET_ROOT", "")
+    _data = {"hdr_path": "kiwi.hdr", "cube_path": "kiwi.bin", "storage_endpoint": "http://127.0.0.1:9/upload"}
+    response = client.post("/preprocessor/api/preprocess/path", data=_data)
+    assert response.status_code == 403
@@ -0,0 +1,51 @@
+import io
+import time
+import numpy as np
+import pytest
+
+HDR_CONTENT = (
+    b"ENVI\n"
+    b"description = {Dummy ENVI Header}\n"
+    b"samples = 10\n"
+    b"lines = 10\n"
+    b"bands = 4\n"
+    b"header offset = 0\n"
+    b"data type = 4\n"
+    b"interleave = bsq\n"
+    b"byte order = 0\n"
+    b"wavelength = {470.0, 600.0, 750.0, 900.0}\n"
+    b"wavelength units = Nanometers\n"
+)
+
+@pytest.fixture
+def files():
+    content = np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+    return {
+        "hdr_file": ("dummy.hdr", io.BytesIO(HDR_CONTENT), "application/octet-stream"),
+        "cube_file": ("dummy.bin", io.BytesIO(content), "application/octet-stream")
+    }
+
+
+def test_submit_job_no_input_failure(client):
+    response = client.post("/preprocessor/api/jobs")
+    assert response.status_code == 400
+
+def test_unknown_job_not_found(client):
+    assert client.get("/preprocessor/api/jobs/unknown").status_code == 404
+    assert client.get("/preprocessor/api/jobs/unknown/result").status_code == 404
+
+def test_submit_poll_and_fetch_result(client, files):
+    response = client.post("/preprocessor/api/jobs", files=files)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    deadline = time.time() + 30
+    status = response.json()["status"]
+    while status not in ("succeeded", "failed") and time.time() < deadline:
+        time.sleep(0.05)
+        status = client.get(f"/preprocessor/api/jobs/{job_id}").json()["status"]
+    assert status == "succeeded"
+
+    result = client.get(f"/preprocessor/api/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert "text/csv" in result.headers["content-type"]
@@ -0,0 +1,38 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api import router_mock
+import pytest
+
+
+@pytest.fixture(scope="module")
+def mock_client():
+    app = FastAPI()
+    app.include_router(router_mock.router, prefix="/preprocessor/api")
+    with TestClient(app) as c:
+        yield c
+
+
+def test_mock_preprocess_returns_csv(mock_client):
+    _data = {"rows": 24, "cols": 24, "bands": 32, "objects": 2, "dtype": "uint16", "interleave": "bil", "seed": 1}
+    response = mock_client.post("/preprocessor/api/preprocess", data=_data)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "synthetic_generation;dur=" in response.headers["Server-Timing"]
+    assert len(response.text.strip().split("\n")) == 2
+
+def test_mock_preprocess_is_deterministic(mock_client):
+    _data = {"rows": 16, "cols": 16, "bands": 32, "dtype": "float32", "interleave": "bsq", "seed": 2}
+    first = mock_client.post("/preprocessor/api/preprocess", data=_data)
+    second = mock_client.post("/preprocessor/api/preprocess", data=_data)
+    assert first.text == second.text
+
+def test_mock_preprocess_invalid_spec(mock_client):
+    assert mock_client.post("/preprocessor/api/preprocess", data={"interleave": "xyz"}).status_code == 400
+    assert mock_client.post("/preprocessor/api/preprocess", data={"dtype": "complex64"}).status_code == 400
+    assert mock_client.post("/preprocessor/api/preprocess", data={"rows": 0}).status_code == 400
+
+def test_mock_preprocess_size_limit(mock_client, monkeypatch):
+    monkeypatch.setattr(router_mock.settings, "MOCK_MAX_CUBE_MB", 1)
+    response = mock_client.post("/preprocessor/api/preprocess", data={"rows": 1024, "cols": 1024, "bands": 32})
+    assert response.status_code == 400
@@ -0,0 +1,78 @@
+import hashlib
+import io
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.core.uploads import upload_manager
+
+HDR_CONTENT = (
+    b"ENVI\n"
+    b"description = {Dummy ENVI Header}\n"
+    b"samples = 10\n"
+    b"lines = 10\n"
+    b"bands = 4\n"
+    b"header offset = 0\n"
+    b"data type = 4\n"
+    b"interleave = bsq\n"
+    b"byte order = 0\n"
+    b"wavelength = {470.0, 600.0, 750.0, 900.0}\n"
+    b"wavelength units = Nanometers\n"
+)
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_manager, "upload_dir", str(tmp_path / "uploads"))
+
+@pytest.fixture
+def cube():
+    return np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+
+def create_upload(client, cube: bytes, checksum: str):
+    return client.post(
+        "/preprocessor/api/uploads",
+        files={"hdr_file": ("dummy.hdr", io.BytesIO(HDR_CONTENT), "application/octet-stream")},
+        data={
+            "cube_filename": "dummy.bin",
+            "cube_size": str(len(cube)),
+            "checksum": checksum,
+            "storage_endpoint": "http://127.0.0.1:9/upload"
+        }
+    )
+
+
+def test_unknown_upload_not_found(client):
+    assert client.get("/preprocessor/api/uploads/unknown").status_code == 404
+    assert client.post("/preprocessor/api/uploads/unknown/finalize").status_code == 404
+
+def test_chunked_upload_and_finalize(client, cube, monkeypatch):
+    monkeypatch.setattr(settings, "DELIVERY_WAIT", 0.0)
+    response = create_upload(client, cube, hashlib.sha256(cube).hexdigest())
+    assert response.status_code == 201
+    upload_id = response.json()["upload_id"]
+    url = f"/preprocessor/api/uploads/{upload_id}"
+
+    half = len(cube) // 2
+    response = client.put(url, content=cube[half:], headers={"Content-Range": f"bytes {half}-{len(cube) - 1}/{len(cube)}"})
+    assert response.json()["received_ranges"] == [[half, len(cube)]]
+    assert client.post(f"{url}/finalize").status_code == 409
+
+    response = client.put(url, content=cube[:half], headers={"Content-Range": f"bytes 0-{half - 1}/{len(cube)}"})
+    assert response.status_code == 200
+    assert client.get(url).json()["received_bytes"] == len(cube)
+
+    response = client.post(f"{url}/finalize")
+    assert response.status_code == 202
+    assert client.get(url).status_code == 404
+
+def test_chunk_without_content_range(client, cube):
+    upload_id = create_upload(client, cube, hashlib.sha256(cube).hexdigest()).json()["upload_id"]
+    response = client.put(f"/preprocessor/api/uploads/{upload_id}", content=cube)
+    assert response.status_code == 400
+
+def test_finalize_checksum_mismatch(client, cube):
+    upload_id = create_upload(client, cube, "0" * 64).json()["upload_id"]
+    url = f"/preprocessor/api/uploads/{upload_id}"
+    client.put(url, content=cube, headers={"Content-Range": f"bytes 0-{len(cube) - 1}/{len(cube)}"})
+    assert client.post(f"{url}/finalize").status_code == 400
+    assert client.delete(url).status_code == 204
+    assert client.get(url).status_code == 404
@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+from app.core.admission import MemoryBudget, ExecutionMode, Reservation, estimate_peak_memory, REQUEST_OVERHEAD_BYTES
+from app.schemas.exceptions import CubeTooLargeError, ServiceOverloadedError
+
+MB = 1024 * 1024
+
+
+def make_header(rows: int, cols: int, bands: int, data_type: int = 4) -> dict:
+    return {
+        "lines": str(rows),
+        "samples": str(cols),
+        "bands": str(bands),
+        "data type": str(data_type),
+        "interleave": "bil",
+        "byte order": "0",
+        "header offset": "0",
+    }
+
+
+def test_estimate_grows_with_the_cube():
+    small = estimate_peak_memory(make_header(10, 10, 100), 224, ExecutionMode.IN_MEMORY)
+    large = estimate_peak_memory(make_header(100, 100, 100), 224, ExecutionMode.IN_MEMORY)
+    assert REQUEST_OVERHEAD_BYTES < small < large
+
+def test_estimate_tiled_is_smaller():
+    header = make_header(1000, 1000, 200, data_type=12)
+    in_memory = estimate_peak_memory(header, 224, ExecutionMode.IN_MEMORY)
+    tiled = estimate_peak_memory(header, 224, ExecutionMode.TILED, tile_rows=64)
+    segmented = estimate_peak_memory(header, 224, ExecutionMode.IN_MEMORY, multiple_samples=True)
+    assert tiled < in_memory < segmented
+
+@pytest.mark.asyncio
+async def test_disabled_budget_admits_everything():
+    budget = MemoryBudget(total=None, queue_timeout=1.0)
+    reservation = await budget.admit(make_header(5000, 5000, 300), 224, multiple_samples=False)
+    assert reservation.mode == ExecutionMode.IN_MEMORY
+    budget.release(reservation)
+
+@pytest.mark.asyncio
+async def test_admit_and_release():
+    budget = MemoryBudget(total=1024 * MB, queue_timeout=1.0)
+    reservation = await budget.admit(make_header(100, 100, 100), 224, multiple_samples=False)
+    assert reservation.mode == ExecutionMode.IN_MEMORY
+    assert budget.reserved == reservation.estimate
+
+    budget.release(reservation)
+    assert budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_downgrade_when_in_memory_does_not_fit():
+    header = make_header(1000, 1000, 200)
+    tiled = estimate_peak_memory(header, 224, ExecutionMode.TILED, tile_rows=64)
+    budget = MemoryBudget(total=tiled + MB, queue_timeout=1.0)
+
+    reservation = await budget.admit(header, 224, multiple_samples=False)
+    assert reservation.mode == ExecutionMode.TILED
+    budget.release(reservation)
+
+@pytest.mark.asyncio
+async def test_multiple_samples_are_never_tiled():
+    header = make_header(1000, 1000, 200)
+    budget = MemoryBudget(total=estimate_peak_memory(header, 224, ExecutionMode.TILED) + MB, queue_timeout=1.0)
+    with pytest.raises(CubeTooLargeError):
+        await budget.admit(header, 224, multiple_samples=True)
+
+@pytest.mark.asyncio
+async def test_queue_until_memory_is_released():
+    header = make_header(100, 100, 100)
+    estimate = estimate_peak_memory(header, 224, ExecutionMode.IN_MEMORY)
+    budget = MemoryBudget(total=estimate, queue_timeout=5.0)
+
+    first = await budget.admit(header, 224, multiple_samples=False, tiled_allowed=False)
+    second = asyncio.create_task(budget.admit(header, 224, multiple_samples=False, tiled_allowed=False))
+    await asyncio.sleep(0.05)
+    assert not second.done()
+    assert budget.waiting() == 1
+
+    budget.release(first)
+    reservation = await asyncio.wait_for(second, 1.0)
+    assert reservation.granted
+    assert budget.waiting() == 0
+    budget.release(reservation)
+    assert budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_queue_timeout():
+    header = make_header(100, 100, 100)
+    budget = MemoryBudget(total=estimate_peak_memory(header, 224, ExecutionMode.IN_MEMORY), queue_timeout=0.05)
+
+    first = await budget.admit(header, 224, multiple_samples=False, tiled_allowed=False)
+    with pytest.raises(ServiceOverloadedError):
+        await budget.admit(header, 224, multiple_samples=False, tiled_allowed=False)
+    assert budget.waiting() == 0
+    budget.release(first)
+    assert budget.reserved == 0
+
+def test_calibration_from_observed_peaks():
+    budget = MemoryBudget(total=1024 * MB, queue_timeout=1.0)
+    for _ in range(10):
+        reservation = Reservation(estimate=100 * MB, raw_estimate=100 * MB, mode=ExecutionMode.IN_MEMORY)
+        reservation.start_rss = 200 * MB
+        reservation.peak_rss = 400 * MB
+        budget._observe(reservation)
+
+    assert budget.calibration == pytest.approx(2.0)
+    assert budget.calibrated(100 * MB) == 200 * MB
+
+def test_shared_requests_do_not_calibrate():
+    budget = MemoryBudget(total=1024 * MB, queue_timeout=1.0)
+    reservation = Reservation(estimate=100 * MB, raw_estimate=100 * MB, mode=ExecutionMode.IN_MEMORY, shared=True)
+    reservation.start_rss = 0
+    reservation.peak_rss = 400 * MB
+    budget._observe(reservation)
+    assert budget.observations == 0
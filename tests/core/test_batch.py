@@ -0,0 +1,116 @@
+import io
+import tarfile
+import zipfile
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from app.core.batch import iter_archive_entries, iter_cube_pairs, parse_manifest, preprocess_archive, CUBE_NAME_COLUMN
+from app.schemas.data_models import PreprocessingParameters
+from app.schemas.exceptions import InvalidFileFormatError, PreprocessingError
+
+# ====================
+# Creating Dummy Input
+# ====================
+HDR_CONTENT = (
+    b"ENVI\n"
+    b"description = {Dummy ENVI Header}\n"
+    b"samples = 10\n"
+    b"lines = 10\n"
+    b"bands = 4\n"
+    b"header offset = 0\n"
+    b"data type = 4\n"
+    b"interleave = bsq\n"
+    b"byte order = 0\n"
+    b"wavelength = {470.0, 600.0, 750.0, 900.0}\n"
+    b"wavelength units = Nanometers\n"
+)
+
+def cube_bytes() -> bytes:
+    return np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+
+@pytest.fixture
+def entries():
+    return {
+        "scans/a.hdr": HDR_CONTENT,
+        "scans/a.raw": cube_bytes(),
+        "scans/b.bin": cube_bytes(),
+        "scans/b.hdr": HDR_CONTENT,
+        "scans/c.hdr": b"Some random content",
+        "scans/c.raw": cube_bytes(),
+        "scans/d.hdr": HDR_CONTENT,
+        "readme.txt": b"not a cube",
+    }
+
+def make_zip(entries: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+def make_tar(entries: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, content in entries.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    buffer.seek(0)
+    return buffer
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+# ================
+# Test Definitions
+# ================
+@pytest.mark.parametrize("make_archive,filename", [(make_zip, "batch.zip"), (make_tar, "batch.tar.gz")])
+def test_iter_archive_entries(entries, make_archive, filename):
+    assert dict(iter_archive_entries(make_archive(entries), filename)) == entries
+
+def test_iter_archive_entries_unsupported():
+    with pytest.raises(InvalidFileFormatError):
+        list(iter_archive_entries(io.BytesIO(b""), "batch.rar"))
+
+def test_iter_cube_pairs_by_name(entries):
+    pairs = list(iter_cube_pairs(entries.items()))
+    assert [name for name, _, _ in pairs] == ["scans/a", "scans/b", "scans/c", "scans/d"]
+    assert pairs[1][1] == entries["scans/b.hdr"] and pairs[1][2] == entries["scans/b.bin"]
+    # Incomplete pairs come last
+    assert pairs[-1][2] is None
+
+def test_iter_cube_pairs_with_manifest():
+    entries = [("headers/x.hdr", b"hdr"), ("cubes/y.raw", b"cube"), ("other.raw", b"ignored")]
+    manifest = [{"hdr": "headers/x.hdr", "cube": "cubes/y.raw", "name": "sample"}]
+    assert list(iter_cube_pairs(entries, manifest)) == [("sample", b"hdr", b"cube")]
+
+def test_parse_manifest():
+    assert parse_manifest(None) is None
+    assert parse_manifest('[{"hdr": "a.hdr", "cube": "a.raw"}]') == [{"hdr": "a.hdr", "cube": "a.raw"}]
+    with pytest.raises(PreprocessingError):
+        parse_manifest("not json")
+    with pytest.raises(PreprocessingError):
+        parse_manifest('[{"hdr": "a.hdr"}]')
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("make_archive,filename", [(make_zip, "batch.zip"), (make_tar, "batch.tar.gz")])
+async def test_preprocess_archive(entries, make_archive, filename, executor):
+    params = PreprocessingParameters(target_bands=20)
+    features, cubes = await preprocess_archive(make_archive(entries), filename, params, executor=executor)
+
+    assert [cube.name for cube in cubes] == ["scans/a", "scans/b", "scans/c", "scans/d"]
+    assert [cube.status for cube in cubes] == ["succeeded", "succeeded", "failed", "failed"]
+    assert "header" in cubes[2].error
+    assert "data cube" in cubes[3].error
+
+    assert list(features[CUBE_NAME_COLUMN]) == ["scans/a", "scans/b"]
+    assert features.shape[1] == 1 + 5 * params.target_bands
+
+@pytest.mark.asyncio
+async def test_preprocess_archive_without_cubes(executor):
+    with pytest.raises(InvalidFileFormatError):
+        await preprocess_archive(make_zip({"readme.txt": b"text"}), "batch.zip", PreprocessingParameters(), executor=executor)
@@ -0,0 +1,66 @@
+import json
+import numpy as np
+import pytest
+from app.core.cameras import CameraRegistry, CameraProfile
+from app.core.resampling import resample_img_data
+from app.schemas.exceptions import CameraProfileError
+
+# ====================
+# Creating Dummy Input
+# ====================
+@pytest.fixture
+def registry(tmp_path):
+    profiles = {
+        "vis": {"min_wavelength": 470.0, "max_wavelength": 900.0, "bands": 4, "rgb_bands": [3, 2, 1]},
+        "custom": {"wavelengths": [500.0, 510.0, 530.0], "rgb_bands": [2, 1, 0], "background_threshold": 0.3}
+    }
+    path = tmp_path / "cameras.json"
+    path.write_text(json.dumps(profiles))
+    return CameraRegistry(str(path))
+
+
+# ================
+# Test Definitions
+# ================
+def test_bundled_profiles():
+    registry = CameraRegistry()
+    assert {"VIS", "NIR"} <= set(registry.names())
+    assert registry.get("vis").profile.bands == 224
+
+def test_profile_from_range():
+    profile = CameraProfile(min_wavelength=470, max_wavelength=900, bands=4, rgb_bands=(3, 2, 1))
+    assert profile.wavelengths == [470.0, 613.3333333333334, 756.6666666666667, 900.0]
+    with pytest.raises(ValueError):
+        CameraProfile(min_wavelength=470, max_wavelength=900)
+    with pytest.raises(ValueError, match="rgb_bands"):
+        CameraProfile(wavelengths=[500.0, 510.0])
+
+def test_unknown_camera(registry):
+    assert registry.names() == ["VIS", "CUSTOM"]
+    with pytest.raises(CameraProfileError, match="Unknown camera"):
+        registry.get("SWIR")
+
+def test_broken_profiles_file(tmp_path):
+    path = tmp_path / "cameras.json"
+    path.write_text('{"vis": {"bands": 4}}')
+    with pytest.raises(RuntimeError, match="camera profiles"):
+        CameraRegistry(str(path)).names()
+
+def test_validate_header(registry):
+    camera = registry.get("custom")
+    camera.validate({"bands": "3", "wavelength": ["500.2", "510", "529.6"]})
+    camera.validate({"bands": "3"})
+    with pytest.raises(CameraProfileError, match="bands"):
+        camera.validate({"bands": "4"})
+    with pytest.raises(CameraProfileError, match="do not match"):
+        camera.validate({"bands": "3", "wavelength": ["500", "520", "530"]})
+
+def test_resampling_compiled_once(registry):
+    camera = registry.get("custom")
+    target_wavelengths, operator = camera.resampling(5, "linear")
+    assert camera.resampling(5, "linear")[1] is operator
+    assert not operator.flags.writeable
+
+    img_data = np.random.rand(3, 2, 3).astype(np.float32)
+    expected = resample_img_data(img_data, camera.wavelengths, target_wavelengths)
+    assert np.allclose(img_data.reshape(-1, 3) @ operator, expected.reshape(-1, 5), atol=1e-5)
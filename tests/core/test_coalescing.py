@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from app.core.coalescing import RequestCoalescer, request_key
+from app.schemas.data_models import PreprocessingParameters
+
+
+def test_request_key():
+    params = PreprocessingParameters()
+    key = request_key("hdr", "cube", params)
+    assert key == request_key("hdr", "cube", PreprocessingParameters(storage_endpoint="http://storage/upload"))
+    assert key != request_key("hdr", "other cube", params)
+    assert key != request_key("hdr", "cube", PreprocessingParameters(target_bands=100))
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_the_computation():
+    coalescer = RequestCoalescer()
+    calls = []
+    attached = []
+
+    async def compute():
+        calls.append(True)
+        await asyncio.sleep(0.05)
+        return {"features": [1, 2, 3]}
+
+    results = await asyncio.gather(*[
+        coalescer.run("key", compute, on_attach=lambda: attached.append(True)) for _ in range(3)
+    ])
+    assert len(calls) == 1
+    assert len(attached) == 2
+    assert all(result == {"features": [1, 2, 3]} for result in results)
+    # Every request gets its own copy
+    assert results[0] is not results[1]
+    assert coalescer.in_flight() == 0
+
+@pytest.mark.asyncio
+async def test_different_keys_compute_separately():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    async def compute():
+        calls.append(True)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    await asyncio.gather(coalescer.run("a", compute), coalescer.run("b", compute))
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_errors_are_shared():
+    coalescer = RequestCoalescer()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("broken cube")
+
+    results = await asyncio.gather(coalescer.run("key", compute), coalescer.run("key", compute), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+@pytest.mark.asyncio
+async def test_cancelled_first_request_leaves_the_computation_to_the_next():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    async def compute():
+        calls.append(True)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    first = asyncio.create_task(coalescer.run("key", compute))
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(coalescer.run("key", compute))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == 2
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_cancelled_follower_does_not_cancel_the_computation():
+    coalescer = RequestCoalescer()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    first = asyncio.create_task(coalescer.run("key", compute))
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(coalescer.run("key", compute))
+    await asyncio.sleep(0.01)
+    second.cancel()
+
+    assert await first == "result"
+    with pytest.raises(asyncio.CancelledError):
+        await second
@@ -0,0 +1,128 @@
+import os
+import httpx
+import pytest
+import numpy as np
+import pandas as pd
+from app.core.delivery import DeliveryQueue
+from app.schemas.data_models import DeliveryStatus
+
+# ====================
+# Creating Dummy Input
+# ====================
+@pytest.fixture
+def features_df():
+    data = np.random.rand(3, 4).astype(np.float32)
+    return pd.DataFrame(data, columns=[f"avg_spectrum_b{i}" for i in range(4)])
+
+def storage_client(failures: int = 0) -> httpx.AsyncClient:
+    # Fails the first `failures` uploads, then accepts every upload
+    calls = {"count": 0}
+    async def handler(request: httpx.Request):
+        await request.aread()
+        calls["count"] += 1
+        if calls["count"] <= failures:
+            return httpx.Response(503, json={"detail": "unavailable"})
+        return httpx.Response(200, json={"uid": f"uid{calls['count']}"})
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+def make_queue(tmp_path, workers: int = 2, max_attempts: int = 3) -> DeliveryQueue:
+    return DeliveryQueue(spool_dir=str(tmp_path / "spool"), workers=workers, max_attempts=max_attempts, retry_backoff=0.01)
+
+
+# ================
+# Test Definitions
+# ================
+@pytest.mark.asyncio
+async def test_delivery_succeeds(tmp_path, features_df):
+    queue = make_queue(tmp_path)
+    await queue.start(client=storage_client())
+    try:
+        delivery = queue.enqueue(features_df, "dummy", "http://storage/upload")
+        delivery = await queue.wait(delivery.delivery_id, timeout=5)
+    finally:
+        await queue.stop()
+
+    assert delivery.status == DeliveryStatus.DELIVERED
+    assert delivery.uid == "uid1"
+    assert delivery.attempts == 1
+    # Only the status file is left in the spool
+    assert os.listdir(queue.spool_dir) == [f"{delivery.delivery_id}.json"]
+
+@pytest.mark.asyncio
+async def test_delivery_retries(tmp_path, features_df):
+    queue = make_queue(tmp_path)
+    await queue.start(client=storage_client(failures=2))
+    try:
+        delivery = queue.enqueue(features_df, "dummy", "http://storage/upload")
+        delivery = await queue.wait(delivery.delivery_id, timeout=5)
+    finally:
+        await queue.stop()
+
+    assert delivery.status == DeliveryStatus.DELIVERED
+    assert delivery.attempts == 3
+
+@pytest.mark.asyncio
+async def test_delivery_fails_after_max_attempts(tmp_path, features_df):
+    queue = make_queue(tmp_path, max_attempts=2)
+    await queue.start(client=storage_client(failures=10))
+    try:
+        delivery = queue.enqueue(features_df, "dummy", "http://storage/upload")
+        delivery = await queue.wait(delivery.delivery_id, timeout=5)
+    finally:
+        await queue.stop()
+
+    assert delivery.status == DeliveryStatus.FAILED
+    assert "503" in delivery.error
+    # The features are kept around for a manual retry
+    assert os.path.exists(os.path.join(queue.spool_dir, f"{delivery.delivery_id}.csv"))
+    assert queue.counts()["failed"] == 1
+
+@pytest.mark.asyncio
+async def test_pending_deliveries_survive_restart(tmp_path, features_df):
+    # No workers, so the delivery stays pending until the queue is stopped
+    queue = make_queue(tmp_path, workers=0)
+    await queue.start(client=storage_client())
+    delivery = queue.enqueue(features_df, "dummy", "http://storage/upload")
+    assert queue.queue_depth() == 1
+    await queue.stop()
+
+    restarted = make_queue(tmp_path)
+    await restarted.start(client=storage_client())
+    try:
+        delivery = await restarted.wait(delivery.delivery_id, timeout=5)
+    finally:
+        await restarted.stop()
+    assert delivery.status == DeliveryStatus.DELIVERED
+
+@pytest.mark.asyncio
+async def test_wait_times_out_while_pending(tmp_path, features_df):
+    queue = make_queue(tmp_path, workers=0)
+    await queue.start(client=storage_client())
+    try:
+        delivery = queue.enqueue(features_df, "dummy", "http://storage/upload")
+        delivery = await queue.wait(delivery.delivery_id, timeout=0.05)
+    finally:
+        await queue.stop()
+    assert delivery.status == DeliveryStatus.PENDING
+
+def test_get_rejects_invalid_ids(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.get("../../etc/passwd") is None
+    assert queue.get("0" * 32) is None
+
+@pytest.mark.asyncio
+async def test_other_worker_sees_delivery_and_drain(tmp_path, features_df):
+    queue = make_queue(tmp_path)
+    other = make_queue(tmp_path)
+    await queue.start(client=storage_client(failures=1))
+    await other.start(client=storage_client(), resume=False)
+    try:
+        delivery = queue.enqueue(features_df, "dummy", "http://storage/upload")
+        assert other.get(delivery.delivery_id) is not None
+    finally:
+        await queue.stop(drain=True)
+        await other.stop()
+
+    # Draining waited for the retry
+    assert queue.get(delivery.delivery_id).status == DeliveryStatus.DELIVERED
+    assert other.get(delivery.delivery_id).status == DeliveryStatus.DELIVERED
@@ -0,0 +1,130 @@
+import io
+import os
+import time
+import pytest
+import numpy as np
+import pandas as pd
+from fastapi import UploadFile
+from app.core.jobs import JobStore, JobManager, RESULT_FILENAME
+from app.schemas.data_models import PreprocessingParameters, JobStatus
+
+# ====================
+# Creating Dummy Input
+# ====================
+HDR_CONTENT = (
+    b"ENVI\n"
+    b"description = {Dummy ENVI Header}\n"
+    b"samples = 10\n"
+    b"lines = 10\n"
+    b"bands = 4\n"
+    b"header offset = 0\n"
+    b"data type = 4\n"
+    b"interleave = bsq\n"
+    b"byte order = 0\n"
+    b"wavelength = {470.0, 600.0, 750.0, 900.0}\n"
+    b"wavelength units = Nanometers\n"
+)
+
+@pytest.fixture
+def hdr_file() -> UploadFile:
+    return UploadFile(filename="dummy.hdr", file=io.BytesIO(HDR_CONTENT))
+
+@pytest.fixture
+def bin_file() -> UploadFile:
+    content = np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+    return UploadFile(filename="dummy.bin", file=io.BytesIO(content))
+
+@pytest.fixture
+def store(tmp_path) -> JobStore:
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(job_dir=str(tmp_path / "jobs"), workers=1)
+    manager.start()
+    yield manager
+    manager.stop()
+
+def wait_for_job(manager: JobManager, job_id: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout} seconds")
+
+
+# ================
+# Test Definitions
+# ================
+def test_job_store_create_and_get(store):
+    params = PreprocessingParameters(target_bands=10)
+    job = store.create("job1", params, "dummy.hdr", "dummy.bin")
+
+    assert job.job_id == "job1"
+    assert job.status == JobStatus.QUEUED
+    assert store.get("missing") is None
+
+    stored_params, hdr_filename, cube_filename = store.get_inputs("job1")
+    assert stored_params == params
+    assert (hdr_filename, cube_filename) == ("dummy.hdr", "dummy.bin")
+
+def test_job_store_update(store):
+    store.create("job1", PreprocessingParameters(), "dummy.hdr", "dummy.bin")
+    store.update("job1", status=JobStatus.RUNNING, stage="resampling", completed_samples=1, total_samples=3)
+
+    job = store.get("job1")
+    assert job.status == JobStatus.RUNNING
+    assert job.stage == "resampling"
+    assert (job.completed_samples, job.total_samples) == (1, 3)
+
+def test_job_store_update_unknown_field(store):
+    store.create("job1", PreprocessingParameters(), "dummy.hdr", "dummy.bin")
+    with pytest.raises(ValueError):
+        store.update("job1", params="{}")
+
+def test_job_store_list_unfinished(store):
+    for job_id in ("job1", "job2", "job3"):
+        store.create(job_id, PreprocessingParameters(), "dummy.hdr", "dummy.bin")
+    store.update("job1", status=JobStatus.SUCCEEDED)
+    store.update("job2", status=JobStatus.RUNNING)
+
+    assert store.list_unfinished() == ["job2", "job3"]
+
+def test_job_manager_runs_job(manager, hdr_file, bin_file):
+    job = manager.submit(hdr_file, bin_file, PreprocessingParameters())
+    job = wait_for_job(manager, job.job_id)
+
+    assert job.status == JobStatus.SUCCEEDED
+    assert job.uid is None
+    result = pd.read_csv(manager.result_path(job.job_id))
+    assert len(result) == 1
+
+    # Inputs are removed once the job is done
+    assert os.listdir(os.path.join(manager.job_dir, job.job_id)) == [RESULT_FILENAME]
+
+def test_job_manager_failed_job(manager, bin_file):
+    wrong_hdr_file = UploadFile(filename="wrong.hdr", file=io.BytesIO(b"Some random content"))
+    job = manager.submit(wrong_hdr_file, bin_file, PreprocessingParameters())
+    job = wait_for_job(manager, job.job_id)
+
+    assert job.status == JobStatus.FAILED
+    assert job.error
+
+def test_job_manager_resumes_unfinished_jobs(tmp_path):
+    # Simulate a job that was stored right before a shutdown
+    job_dir = tmp_path / "jobs"
+    os.makedirs(job_dir / "job1")
+    (job_dir / "job1" / "input.hdr").write_bytes(HDR_CONTENT)
+    (job_dir / "job1" / "input.bin").write_bytes(np.random.rand(10, 10, 4).astype(np.float32).tobytes())
+    store = JobStore(str(job_dir / "jobs.sqlite3"))
+    store.create("job1", PreprocessingParameters(), "dummy.hdr", "dummy.bin")
+    store.update("job1", status=JobStatus.RUNNING, stage="resampling")
+
+    manager = JobManager(job_dir=str(job_dir), workers=1)
+    manager.start()
+    try:
+        assert wait_for_job(manager, "job1").status == JobStatus.SUCCEEDED
+    finally:
+        manager.stop()
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import io
 import numpy as np
@@ -194,4 +195,152 @@ async def test_wrong_wavelength_values_hdr_exception(wrong_wavelength_values_hdr
 @pytest.mark.asyncio
 async def test_wrong_wavelength_amount_hdr_exception(wrong_wavelength_amount_hdr_file, bin_file, params):
     with pytest.raises(MissingMetadataError):
-        await preprocess(hdr_file=wrong_wavelength_amount_hdr_file, cube_file=bin_file, params=params)
\ No newline at end of file
+        await preprocess(hdr_file=wrong_wavelength_amount_hdr_file, cube_file=bin_file, params=params)
+
+def test_tiled_pipeline_matches_in_memory(params):
+    from app.core.preprocessor import preprocess_cube, preprocess_cube_tiled
+    rng = np.random.default_rng(0)
+    cube = rng.random((37, 11, 16)).astype(np.float32)
+    cube[:5] *= 0.01  # some background for the mask
+    metadata = {"wavelength": [str(w) for w in np.linspace(470, 900, 16)]}
+    params.target_bands = 32
+
+    in_memory = preprocess_cube(cube, metadata, params)
+    tiled = preprocess_cube_tiled(cube.astype(np.float64), metadata, params, tile_rows=8)
+    assert list(tiled.columns) == list(in_memory.columns)
+    # The in-memory path averages in float32, the tiled one in float64
+    assert np.allclose(tiled.to_numpy(dtype=float), in_memory.to_numpy(dtype=float), rtol=1e-4, atol=1e-4)
+
+@pytest.mark.asyncio
+async def test_downgrade_to_tiled_mode(hdr_file, bin_file, params, monkeypatch):
+    from app.core.admission import memory_budget, estimate_peak_memory, ExecutionMode
+    from app.core.config import settings
+    from app.util.metrics import ADMISSIONS
+    monkeypatch.setattr(settings, "TILE_ROWS", 2)
+    header = {"lines": "10", "samples": "10", "bands": "4", "data type": "4", "interleave": "bil", "byte order": "0"}
+    tiled = estimate_peak_memory(header, params.target_bands, ExecutionMode.TILED, tile_rows=2)
+    assert tiled < estimate_peak_memory(header, params.target_bands, ExecutionMode.IN_MEMORY)
+    monkeypatch.setattr(memory_budget, "total", tiled)
+    downgraded = ADMISSIONS.get(decision="downgraded")
+
+    result = await preprocess(hdr_file, bin_file, params)
+    assert isinstance(result, pd.DataFrame)
+    assert ADMISSIONS.get(decision="downgraded") == downgraded + 1
+    assert memory_budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_cube_too_large_for_budget(hdr_file, bin_file, params, monkeypatch):
+    from app.core.admission import memory_budget
+    from app.schemas.exceptions import CubeTooLargeError
+    monkeypatch.setattr(memory_budget, "total", 1024)
+    with pytest.raises(CubeTooLargeError):
+        await preprocess(hdr_file, bin_file, params)
+
+@pytest.mark.asyncio
+async def test_identical_requests_are_coalesced(hdr_file, params, monkeypatch):
+    import app.core.preprocessor as preprocessor
+    from app.core.preprocessor import STAGE_COALESCED
+    hdr_content = hdr_file.file.read()
+    cube_content = np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+
+    computations = []
+    run_pipeline = preprocessor._load_and_run
+    def counting_load_and_run(*args):
+        computations.append(True)
+        return run_pipeline(*args)
+    monkeypatch.setattr(preprocessor, "_load_and_run", counting_load_and_run)
+
+    stages = []
+    def request():
+        return preprocess(
+            UploadFile(filename="dummy.hdr", file=io.BytesIO(hdr_content)),
+            UploadFile(filename="dummy.bin", file=io.BytesIO(cube_content)),
+            params,
+            stage_callback=lambda stage, completed, total: stages.append(stage)
+        )
+
+    first, second = await asyncio.gather(request(), request())
+    assert len(computations) == 1
+    assert STAGE_COALESCED in stages
+    pd.testing.assert_frame_equal(first, second)
+
+@pytest.mark.asyncio
+async def test_preprocess_path_matches_upload(hdr_file, params, monkeypatch, tmp_path):
+    from app.core.config import settings
+    from app.core.preprocessor import preprocess_path
+    from app.schemas.exceptions import DatasetPathError
+    monkeypatch.setattr(settings, "DATASET_ROOT", str(tmp_path))
+    hdr_content = hdr_file.file.read()
+    cube_content = np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+    (tmp_path / "kiwi.hdr").write_bytes(hdr_content)
+    (tmp_path / "kiwi.bin").write_bytes(cube_content)
+
+    from_path = await preprocess_path("kiwi.hdr", "kiwi.bin", params)
+    uploaded = await preprocess(
+        UploadFile(filename="kiwi.hdr", file=io.BytesIO(hdr_content)),
+        UploadFile(filename="kiwi.bin", file=io.BytesIO(cube_content)),
+        params
+    )
+    pd.testing.assert_frame_equal(from_path, uploaded)
+    assert (tmp_path / "kiwi.bin").exists()  # Processed in place, not moved or deleted
+
+    with pytest.raises(DatasetPathError):
+        await preprocess_path("kiwi.hdr", "../kiwi.bin", params)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tile_rows", [None, 3])
+async def test_compressed_upload_matches_uncompressed(hdr_file, params, monkeypatch, tile_rows):
+    import gzip
+    from app.core.admission import memory_budget, estimate_peak_memory, ExecutionMode
+    from app.core.config import settings
+    hdr_content = hdr_file.file.read().replace(b"interleave = bsq", b"interleave = bil")
+    cube_content = np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+    if tile_rows is not None:
+        # Leave only enough memory for the tiled mode
+        header = {"lines": "10", "samples": "10", "bands": "4", "data type": "4", "interleave": "bil", "byte order": "0"}
+        monkeypatch.setattr(settings, "TILE_ROWS", tile_rows)
+        monkeypatch.setattr(memory_budget, "total", estimate_peak_memory(header, params.target_bands, ExecutionMode.TILED, tile_rows=tile_rows))
+
+    compressed = await preprocess(
+        UploadFile(filename="dummy.hdr", file=io.BytesIO(hdr_content)),
+        UploadFile(filename="dummy.bin.gz", file=io.BytesIO(gzip.compress(cube_content))),
+        params
+    )
+    uncompressed = await preprocess(
+        UploadFile(filename="dummy.hdr", file=io.BytesIO(hdr_content)),
+        UploadFile(filename="dummy.bin", file=io.BytesIO(cube_content)),
+        params
+    )
+    assert np.allclose(compressed.to_numpy(dtype=float), uncompressed.to_numpy(dtype=float), rtol=1e-4, atol=1e-4)
+
+@pytest.mark.asyncio
+async def test_corrupt_compressed_upload(hdr_file, params):
+    from app.schemas.exceptions import InvalidFileFormatError
+    with pytest.raises(InvalidFileFormatError, match="decompressed"):
+        await preprocess(hdr_file, UploadFile(filename="dummy.bin.gz", file=io.BytesIO(b"not gzip" * 100)), params)
+
+@pytest.mark.asyncio
+async def test_camera_request_matches_header_wavelengths(hdr_file, params, monkeypatch, tmp_path):
+    import json
+    from app.core import cameras
+    from app.schemas.exceptions import CameraProfileError
+    profiles = tmp_path / "cameras.json"
+    profiles.write_text(json.dumps({"test": {"wavelengths": [470.0, 600.0, 750.0, 900.0], "rgb_bands": [3, 2, 1]}}))
+    monkeypatch.setattr(cameras.camera_registry, "profiles_file", str(profiles))
+    monkeypatch.setattr(cameras.camera_registry, "_plans", None)
+    hdr_content = hdr_file.file.read()
+    cube_content = np.random.rand(10, 10, 4).astype(np.float32).tobytes()
+
+    def request(params):
+        return preprocess(
+            UploadFile(filename="dummy.hdr", file=io.BytesIO(hdr_content)),
+            UploadFile(filename="dummy.bin", file=io.BytesIO(cube_content)),
+            params
+        )
+
+    from_header = await request(params)
+    from_camera = await request(params.model_copy(update={"camera": "test"}))
+    assert np.allclose(from_camera.to_numpy(dtype=float), from_header.to_numpy(dtype=float), rtol=1e-4, atol=1e-4)
+
+    with pytest.raises(CameraProfileError):
+        await request(params.model_copy(update={"camera": "unknown"}))
@@ -1,6 +1,6 @@
 import pytest
 import numpy as np
-from app.core.resampling import resample_img_data
+from app.core.resampling import resample_img_data, resampling_operator, apply_resampling_operator
 
 @pytest.fixture
 def mismatched_resampling_data():
@@ -60,4 +60,22 @@ def test_resampling_interpolate_and_extrapolate(resampling_test_data):
     )
     expected_shape = img_data.shape[:-1] + (len(target_wavelengths),)
     assert resampled.shape == expected_shape
-    assert np.all(resampled < 10) and np.all(resampled > -10) # pretty generous reflectance value check
\ No newline at end of file
+    assert np.all(resampled < 10) and np.all(resampled > -10) # pretty generous reflectance value check
+
+@pytest.mark.parametrize("kind", ["linear", "nearest", "quadratic", "cubic"])
+def test_resampling_operator_matches_resample_img_data(kind):
+    img_data = np.random.rand(6, 5, 20).astype(np.float32)
+    original_wavelengths = np.sort(np.random.uniform(470, 900, 20))
+    target_wavelengths = np.linspace(450, 920, 33)  # Extrapolates on both ends
+
+    expected = resample_img_data(img_data, original_wavelengths, target_wavelengths, kind)
+    operator = resampling_operator(original_wavelengths, target_wavelengths, kind)
+    resampled = apply_resampling_operator(img_data, operator)
+    assert operator.shape == (20, 33)
+    assert resampled.shape == expected.shape
+    assert np.allclose(resampled, expected, rtol=1e-4, atol=1e-4)
+
+def test_resampling_operator_band_mismatch():
+    operator = resampling_operator(np.linspace(470, 900, 10), np.linspace(470, 900, 5))
+    with pytest.raises(ValueError):
+        apply_resampling_operator(np.zeros((2, 2, 8), dtype=np.float32), operator)
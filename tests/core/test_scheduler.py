@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import pytest
+from app.core.scheduler import RequestScheduler, CostClass, estimate_cost, cost_class
+
+
+def make_header(rows: int, cols: int, bands: int) -> dict:
+    return {"lines": str(rows), "samples": str(cols), "bands": str(bands), "data type": "4", "interleave": "bil", "byte order": "0"}
+
+def make_scheduler(concurrency: int = 1, class_limits: dict = None, aging_rate: float = 0.0) -> RequestScheduler:
+    return RequestScheduler(concurrency=concurrency, class_limits=class_limits or {}, aging_rate=aging_rate, large_cost=1.0)
+
+SMALL = make_header(10, 10, 100)
+LARGE = make_header(1000, 1000, 100)
+
+
+def test_estimate_cost():
+    assert estimate_cost(SMALL, 224, False) < estimate_cost(LARGE, 224, False)
+    assert estimate_cost(SMALL, 224, True) > estimate_cost(SMALL, 224, False)
+
+def test_cost_class():
+    assert cost_class(0.5, False, large_cost=1.0) == CostClass.SMALL
+    assert cost_class(2.0, False, large_cost=1.0) == CostClass.LARGE
+    assert cost_class(0.5, True, large_cost=1.0) == CostClass.MULTI_SAMPLE
+
+@pytest.mark.asyncio
+async def test_shortest_job_first():
+    scheduler = make_scheduler()
+    first = await scheduler.acquire(SMALL, 224, False)
+
+    order = []
+    async def request(header, name):
+        ticket = await scheduler.acquire(header, 224, False)
+        order.append(name)
+        scheduler.release(ticket)
+
+    large = asyncio.create_task(request(LARGE, "large"))
+    await asyncio.sleep(0.01)
+    small = asyncio.create_task(request(SMALL, "small"))
+    await asyncio.sleep(0.01)
+    assert scheduler.waiting() == 2
+
+    scheduler.release(first)
+    await asyncio.gather(large, small)
+    assert order == ["small", "large"]
+
+@pytest.mark.asyncio
+async def test_aging_lets_large_requests_run():
+    scheduler = make_scheduler(aging_rate=1e6)
+    first = await scheduler.acquire(SMALL, 224, False)
+
+    order = []
+    async def request(header, name):
+        ticket = await scheduler.acquire(header, 224, False)
+        order.append(name)
+        scheduler.release(ticket)
+
+    large = asyncio.create_task(request(LARGE, "large"))
+    await asyncio.sleep(0.05)
+    small = asyncio.create_task(request(SMALL, "small"))
+    await asyncio.sleep(0)
+
+    scheduler.release(first)
+    await asyncio.gather(large, small)
+    assert order == ["large", "small"]
+
+@pytest.mark.asyncio
+async def test_class_limits():
+    scheduler = make_scheduler(concurrency=3, class_limits={"large": 1})
+    large = await scheduler.acquire(LARGE, 224, False)
+    second_large = asyncio.create_task(scheduler.acquire(LARGE, 224, False))
+    small = await asyncio.wait_for(scheduler.acquire(SMALL, 224, False), 1.0)
+
+    await asyncio.sleep(0.01)
+    assert not second_large.done()
+    state = scheduler.state()
+    assert state["classes"]["large"] == {"running": 1, "limit": 1}
+    assert state["classes"]["small"]["running"] == 1
+    assert [waiting["cost_class"] for waiting in state["waiting"]] == ["large"]
+
+    scheduler.release(large)
+    second = await asyncio.wait_for(second_large, 1.0)
+    for ticket in (second, small):
+        scheduler.release(ticket)
+    assert scheduler.running() == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_request_leaves_the_queue():
+    scheduler = make_scheduler()
+    first = await scheduler.acquire(SMALL, 224, False)
+    waiting = asyncio.create_task(scheduler.acquire(SMALL, 224, False))
+    await asyncio.sleep(0.01)
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert scheduler.waiting() == 0
+    scheduler.release(first)
+    assert scheduler.running() == 0
+
+@pytest.mark.asyncio
+async def test_run_on_compute_threads():
+    scheduler = make_scheduler()
+    ticket = await scheduler.acquire(SMALL, 224, False)
+    try:
+        thread_name = await scheduler.run(ticket, lambda: threading.current_thread().name)
+    finally:
+        scheduler.release(ticket)
+        scheduler.shutdown()
+    assert thread_name.startswith("compute")
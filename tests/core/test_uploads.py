@@ -0,0 +1,94 @@
+import hashlib
+import time
+import pytest
+from app.core.uploads import UploadManager, parse_content_range, merge_range
+from app.schemas.data_models import PreprocessingParameters
+from app.schemas.exceptions import ChunkedUploadError, InvalidFileFormatError
+
+CUBE = bytes(range(256)) * 40
+
+# ====================
+# Creating Dummy Input
+# ====================
+@pytest.fixture
+def manager(tmp_path):
+    return UploadManager(upload_dir=str(tmp_path / "uploads"), max_bytes=1024 * 1024, expiry=60.0)
+
+def create(manager: UploadManager, checksum=None):
+    return manager.create("dummy.hdr", b"ENVI\n", "dummy.bin", len(CUBE), PreprocessingParameters(), checksum)
+
+async def body(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+# ================
+# Test Definitions
+# ================
+def test_parse_content_range():
+    assert parse_content_range("bytes 0-99/1000", 1000) == (0, 100)
+    assert parse_content_range("bytes 900-999/*", 1000) == (900, 1000)
+    with pytest.raises(ChunkedUploadError):
+        parse_content_range(None, 1000)
+    for header in ("bytes 900-1000/1000", "bytes 10-5/1000", "bytes 0-99/2000"):
+        with pytest.raises(ChunkedUploadError) as e:
+            parse_content_range(header, 1000)
+        assert e.value.status_code == 416
+
+def test_merge_range():
+    assert merge_range([], 10, 20) == [[10, 20]]
+    assert merge_range([[0, 10], [20, 30]], 10, 20) == [[0, 30]]
+    assert merge_range([[0, 10]], 5, 8) == [[0, 10]]
+    assert merge_range([[20, 30]], 0, 10) == [[0, 10], [20, 30]]
+
+def test_create_preallocates_cube(manager):
+    upload = create(manager)
+    assert manager.get(upload.upload_id) == upload
+    with open(manager.cube_path(upload), "rb") as f:
+        assert len(f.read()) == len(CUBE)
+    with pytest.raises(InvalidFileFormatError):
+        manager.create("dummy.hdr", b"ENVI\n", "dummy.tif", 10, PreprocessingParameters())
+    with pytest.raises(ChunkedUploadError) as e:
+        manager.create("dummy.hdr", b"ENVI\n", "dummy.bin", 2 * 1024 * 1024, PreprocessingParameters())
+    assert e.value.status_code == 413
+
+@pytest.mark.asyncio
+async def test_chunks_in_any_order(manager):
+    upload = create(manager, checksum=hashlib.sha256(CUBE).hexdigest())
+    middle = len(CUBE) // 2
+
+    upload = await manager.write(upload, middle, len(CUBE), body(CUBE[middle:middle + 100], CUBE[middle + 100:]))
+    assert upload.received_ranges == [[middle, len(CUBE)]]
+    with pytest.raises(ChunkedUploadError) as e:
+        manager.verify(upload.upload_id)
+    assert e.value.status_code == 409
+
+    upload = await manager.write(upload, 0, middle, body(CUBE[:middle]))
+    assert upload.received_ranges == [[0, len(CUBE)]]
+    assert upload.received_bytes == len(CUBE)
+    assert manager.verify(upload.upload_id) == hashlib.sha256(CUBE).hexdigest()
+    with open(manager.cube_path(upload), "rb") as f:
+        assert f.read() == CUBE
+
+@pytest.mark.asyncio
+async def test_interrupted_chunk_is_not_received(manager):
+    upload = create(manager)
+    with pytest.raises(ChunkedUploadError):
+        await manager.write(upload, 0, 100, body(CUBE[:60]))
+    with pytest.raises(ChunkedUploadError):
+        await manager.write(upload, 0, 100, body(CUBE[:120]))
+    assert manager.get(upload.upload_id).received_ranges == []
+
+@pytest.mark.asyncio
+async def test_checksum_mismatch(manager):
+    upload = create(manager, checksum="sha256:" + "0" * 64)
+    await manager.write(upload, 0, len(CUBE), body(CUBE))
+    with pytest.raises(ChunkedUploadError, match="checksum") as e:
+        manager.verify(upload.upload_id)
+    assert e.value.status_code == 400
+
+def test_expired_uploads_are_removed(manager, monkeypatch):
+    upload = create(manager)
+    monkeypatch.setattr(time, "time", lambda: upload.updated_at + 120)
+    manager.remove_expired()
+    assert manager.get(upload.upload_id) is None
@@ -0,0 +1,64 @@
+import os
+import time
+from app.core.workers import WorkerTable, WorkerState, read_memory
+
+
+def test_worker_table_is_shared_with_forked_children():
+    table = WorkerTable(2)
+    pid = os.fork()
+    if pid == 0:
+        state = WorkerState()
+        state.attach(table, slot=1, max_requests=0, resumes_work=False, on_recycle=lambda: None)
+        state.request_started()
+        state.request_finished()
+        state.heartbeat()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert table.rows[1]["requests"] == 1
+    assert table.rows[1]["in_flight"] == 0
+    assert table.rows[1]["heartbeat"] > 0
+    assert table.rows[0]["requests"] == 0
+
+def test_reset_counts_restarts():
+    table = WorkerTable(1)
+    table.reset(0, pid=100)
+    assert table.rows[0]["restarts"] == 0
+    table.rows[0]["requests"] = 5
+    table.reset(0, pid=101)
+    assert table.rows[0]["restarts"] == 1
+    assert table.rows[0]["requests"] == 0
+    assert table.rows[0]["pid"] == 101
+
+def test_recycle_after_max_requests():
+    recycled = []
+    state = WorkerState()
+    state.attach(WorkerTable(1), slot=0, max_requests=3, resumes_work=False, on_recycle=lambda: recycled.append(True))
+    for _ in range(5):
+        state.request_started()
+        state.request_finished()
+    assert state.recycling
+    assert recycled == [True]
+
+def test_health_reports_stale_heartbeats():
+    table = WorkerTable(2)
+    table.reset(0, pid=os.getpid())
+    table.reset(1, pid=os.getpid())
+    table.rows[1]["heartbeat"] = time.time() - 120
+    state = WorkerState()
+    state.attach(table, slot=0, max_requests=0, resumes_work=True, on_recycle=lambda: None)
+
+    health = state.health(heartbeat_timeout=60)
+    assert [worker["healthy"] for worker in health] == [True, False]
+    assert health[0]["pid"] == os.getpid()
+
+def test_single_process_health():
+    health = WorkerState().health(heartbeat_timeout=60)
+    assert len(health) == 1
+    assert health[0]["healthy"]
+    assert health[0]["pid"] == os.getpid()
+
+def test_read_memory():
+    memory = read_memory(os.getpid())
+    if memory["rss_mb"] is not None:
+        assert memory["private_mb"] <= memory["rss_mb"]
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+
+def test_startup_does_not_import_heavy_dependencies():
+    # A fresh interpreter, the test session has imported everything already
+    code = "import sys, app.main; print('heavy:' + ','.join(m for m in ('ultralytics', 'torch', 'pandas', 'scipy', 'httpx') if m in sys.modules), file=sys.stderr)"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True
+    )
+    assert result.returncode == 0, result.stderr
+    # Written to stderr, the service logs to stdout
+    heavy = next(line for line in result.stderr.splitlines() if line.startswith("heavy:"))
+    assert heavy == "heavy:"
+
+def test_startup_duration_metric(client):
+    response = client.get("/metrics")
+    assert 'preprocessor_startup_duration_seconds{phase="import"}' in response.text
+    assert 'preprocessor_startup_duration_seconds{phase="lifespan"}' in response.text
+
+def test_worker_health(client):
+    response = client.get("/health/workers")
+    assert response.status_code == 200
+    workers = response.json()["workers"]
+    assert len(workers) == 1
+    assert workers[0]["healthy"]
@@ -0,0 +1,26 @@
+import gzip
+import io
+import pytest
+from app.util.decompression import compression_of, strip_compression, open_decompressed
+
+CONTENT = b"\x00\x01\x02\x03" * 1000
+
+
+def test_compression_of():
+    assert compression_of("cube.raw") is None
+    assert compression_of("cube.raw.gz") == "gzip"
+    assert compression_of("CUBE.BIN.ZST") == "zstd"
+    assert strip_compression("cube.raw.zst") == "cube.raw"
+    assert strip_compression("cube.bin") == "cube.bin"
+
+def test_gzip_stream():
+    compressed = io.BytesIO(gzip.compress(CONTENT))
+    with open_decompressed(compressed, "gzip") as stream:
+        assert stream.read() == CONTENT
+    assert not compressed.closed
+
+def test_zstd_stream():
+    zstandard = pytest.importorskip("zstandard")
+    compressed = io.BytesIO(zstandard.ZstdCompressor().compress(CONTENT))
+    with open_decompressed(compressed, "zstd") as stream:
+        assert stream.read() == CONTENT
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+import spectral.io.envi as envi
+from app.schemas.exceptions import InvalidFileFormatError
+from app.util.envi_reader import parse_envi_header, read_envi_cube, EnviStreamReader
+import io
+
+HDR_CONTENT = (
+    b"ENVI\n"
+    b"description = {Dummy ENVI\n"
+    b"  Header}\n"
+    b"samples = 3\n"
+    b"lines = 2\n"
+    b"bands = 4\n"
+    b"header offset = 0\n"
+    b"data type = 4\n"
+    b"interleave = bsq\n"
+    b"byte order = 0\n"
+    b"wavelength = {470.0, 600.0,\n"
+    b"  750.0, 900.0}\n"
+    b"Wavelength Units = Nanometers\n"
+)
+
+
+def test_parse_envi_header():
+    header = parse_envi_header(HDR_CONTENT)
+    assert header["samples"] == "3"
+    assert header["description"] == "Dummy ENVI\nHeader"
+    assert header["wavelength"] == ["470.0", "600.0", "750.0", "900.0"]
+    assert header["wavelength units"] == "Nanometers"
+
+def test_parse_envi_header_not_envi():
+    with pytest.raises(InvalidFileFormatError):
+        parse_envi_header(b"DIMENSIONS=10,10,1\nDATATYPE=uint8\n")
+
+def test_parse_envi_header_binary():
+    with pytest.raises(InvalidFileFormatError):
+        parse_envi_header(b"\xff\xfe\x00\x01")
+
+def test_parse_envi_header_unterminated_value():
+    with pytest.raises(InvalidFileFormatError):
+        parse_envi_header(b"ENVI\nwavelength = {470.0, 600.0\n")
+
+@pytest.mark.parametrize("interleave", ["bsq", "bil", "bip"])
+@pytest.mark.parametrize("dtype", [np.float32, np.uint16, np.float64])
+def test_read_envi_cube_matches_spectral(tmp_path, interleave, dtype):
+    data = (np.random.rand(5, 7, 6) * 1000).astype(dtype)
+    hdr_path = str(tmp_path / "cube.hdr")
+    envi.save_image(hdr_path, data, interleave=interleave, ext=".raw")
+
+    with open(hdr_path, "rb") as f:
+        header = parse_envi_header(f.read())
+    with open(tmp_path / "cube.raw", "rb") as f:
+        cube = read_envi_cube(header, f.read())
+
+    expected = envi.open(hdr_path, str(tmp_path / "cube.raw")).load().astype(np.float32)
+    assert cube.dtype == np.float32
+    np.testing.assert_array_equal(cube, expected)
+
+def test_read_envi_cube_too_small():
+    header = parse_envi_header(HDR_CONTENT)
+    with pytest.raises(InvalidFileFormatError, match="too small"):
+        read_envi_cube(header, b"\x00" * 10)
+
+def test_read_envi_cube_missing_field():
+    header = parse_envi_header(HDR_CONTENT)
+    del header["bands"]
+    with pytest.raises(InvalidFileFormatError, match="bands"):
+        read_envi_cube(header, b"\x00" * 96)
+
+@pytest.mark.parametrize("interleave", ["bsq", "bil", "bip"])
+@pytest.mark.parametrize("byteorder", [0, 1])
+def test_stream_reader_matches_read_envi_cube(tmp_path, interleave, byteorder):
+    data = (np.random.rand(5, 7, 6) * 1000).astype(np.uint16)
+    hdr_path = str(tmp_path / "cube.hdr")
+    envi.save_image(hdr_path, data, interleave=interleave, ext=".raw", byteorder=byteorder)
+    with open(hdr_path, "rb") as f:
+        header = parse_envi_header(f.read())
+    with open(tmp_path / "cube.raw", "rb") as f:
+        cube_bytes = f.read()
+
+    reader = EnviStreamReader(header, io.BytesIO(cube_bytes))
+    assert reader.shape == (5, 7, 6)
+    np.testing.assert_array_equal(reader.read(), read_envi_cube(header, cube_bytes))
+
+def test_stream_reader_rows_in_order(tmp_path):
+    data = np.random.rand(5, 7, 6).astype(np.float32)
+    hdr_path = str(tmp_path / "cube.hdr")
+    envi.save_image(hdr_path, data, interleave="bil", ext=".raw")
+    with open(hdr_path, "rb") as f:
+        header = parse_envi_header(f.read())
+    with open(tmp_path / "cube.raw", "rb") as f:
+        reader = EnviStreamReader(header, io.BytesIO(f.read()))
+
+    np.testing.assert_array_equal(reader[0:2], data[0:2])
+    with pytest.raises(ValueError):
+        reader[0:2]
+    np.testing.assert_array_equal(reader[2:10], data[2:])
+
+def test_stream_reader_too_small():
+    header = parse_envi_header(HDR_CONTENT)
+    with pytest.raises(InvalidFileFormatError, match="too small"):
+        EnviStreamReader(header, io.BytesIO(b"\x00" * 10)).read()
@@ -0,0 +1,65 @@
+from app.util.log import JsonFormatter, TextFormatter, NonBlockingQueueHandler, REQUEST_ID, configure_logging
+from app.util.metrics import LOG_RECORDS_DROPPED
+import json
+import logging
+import queue
+import pytest
+
+
+def make_record(message: str = "Preprocessed data cube", level: int = logging.INFO, **fields) -> logging.LogRecord:
+    logger = logging.getLogger("app.test")
+    return logger.makeRecord(logger.name, level, __file__, 1, message, None, None, extra=fields)
+
+
+def test_json_formatter_includes_fields():
+    record = make_record(cube_shape=[10, 10, 4], stage_durations={"loading": 0.1})
+    record.request_id = "abc"
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "Preprocessed data cube"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "app.test"
+    assert entry["request_id"] == "abc"
+    assert entry["cube_shape"] == [10, 10, 4]
+    assert entry["stage_durations"] == {"loading": 0.1}
+
+def test_text_formatter_includes_fields():
+    line = TextFormatter().format(make_record(samples=3))
+    assert "INFO" in line
+    assert "Preprocessed data cube" in line
+    assert "samples=3" in line
+
+def test_queue_handler_captures_request_id():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    token = REQUEST_ID.set("request-1")
+    try:
+        handler.emit(make_record())
+    finally:
+        REQUEST_ID.reset(token)
+
+    assert handler.queue.get_nowait().request_id == "request-1"
+
+def test_queue_handler_drops_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    dropped = LOG_RECORDS_DROPPED.get()
+
+    handler.emit(make_record())
+    handler.emit(make_record())
+
+    assert handler.queue.qsize() == 1
+    assert LOG_RECORDS_DROPPED.get() == dropped + 1
+
+def test_level_filtering(capsys):
+    configure_logging("WARNING", "json")
+    logger = logging.getLogger("app.test")
+    logger.info("Filtered out")
+    logger.warning("Kept", extra={"samples": 2})
+    with capsys.disabled():
+        configure_logging("INFO", "json")  # flushes the queue of the previous configuration
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line]
+    assert [line["message"] for line in lines if line["logger"] == "app.test"] == ["Kept"]
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        configure_logging("INFO", "xml")
@@ -0,0 +1,60 @@
+import math
+import pytest
+from app.util.metrics import Counter, Gauge, Histogram, MetricsRegistry, StageTimer, STAGE_DURATION
+
+
+def test_counter():
+    counter = Counter("test_total", "A test counter", labelnames=("kind",))
+    counter.inc(kind="a")
+    counter.inc(2, kind="a")
+    assert counter.get(kind="a") == 3
+    assert 'test_total{kind="a"} 3.0' in counter.render()
+
+    with pytest.raises(ValueError):
+        counter.inc(-1, kind="a")
+    with pytest.raises(ValueError):
+        counter.inc(other="a")
+
+def test_gauge_function():
+    gauge = Gauge("test_depth", "A test gauge", labelnames=("queue",))
+    gauge.set(5, queue="a")
+    gauge.set_function(lambda: 7, queue="b")
+    rendered = gauge.render()
+    assert 'test_depth{queue="a"} 5.0' in rendered
+    assert 'test_depth{queue="b"} 7.0' in rendered
+    assert "# TYPE test_depth gauge" in rendered
+
+def test_histogram():
+    histogram = Histogram("test_seconds", "A test histogram", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value)
+
+    rendered = histogram.render()
+    assert 'test_seconds_bucket{le="0.1"} 1' in rendered
+    assert 'test_seconds_bucket{le="1.0"} 2' in rendered
+    assert 'test_seconds_bucket{le="+Inf"} 3' in rendered
+    assert histogram.get_count() == 3
+    assert math.isclose(histogram.get_sum(), 5.55)
+
+def test_label_values_are_escaped():
+    counter = Counter("test_escape_total", "A test counter", labelnames=("name",))
+    counter.inc(name='a "quoted"\nvalue')
+    assert 'name="a \\"quoted\\"\\nvalue"' in counter.render()
+
+def test_registry_rejects_duplicates():
+    registry = MetricsRegistry()
+    registry.register(Counter("test_total", "A test counter"))
+    with pytest.raises(ValueError):
+        registry.register(Counter("test_total", "A test counter"))
+
+def test_stage_timer():
+    before = STAGE_DURATION.get_count(stage="test_stage")
+    timer = StageTimer()
+    timer.enter("test_stage")
+    timer.enter("test_other_stage")
+    timer.enter("test_stage")
+    timer.stop()
+    timer.stop()
+
+    assert set(timer.durations) == {"test_stage", "test_other_stage"}
+    assert STAGE_DURATION.get_count(stage="test_stage") == before + 2
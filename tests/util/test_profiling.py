@@ -0,0 +1,74 @@
+from app.util.profiling import SamplingProfiler, ProfileStore, server_timing_header
+import json
+import threading
+import time
+
+
+def busy_function(seconds: float):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+def test_sampling_profiler_captures_busy_function():
+    with SamplingProfiler(interval=0.001) as profiler:
+        busy_function(0.1)
+
+    assert profiler.sample_count > 0
+    assert profiler.duration >= 0.1
+    assert any(frame[0] == "busy_function" for stack in profiler.samples for frame in stack)
+
+def test_collapsed_format():
+    with SamplingProfiler(interval=0.001) as profiler:
+        busy_function(0.05)
+
+    lines = profiler.to_collapsed().strip().split("\n")
+    assert any("busy_function (" in line for line in lines)
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+def test_speedscope_format():
+    with SamplingProfiler(interval=0.001) as profiler:
+        busy_function(0.05)
+
+    document = profiler.to_speedscope("test")
+    frames = document["shared"]["frames"]
+    profile = document["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert len(profile["samples"]) == len(profile["weights"])
+    assert all(index < len(frames) for sample in profile["samples"] for index in sample)
+    json.dumps(document)
+
+def test_server_timing_header():
+    header = server_timing_header({"loading": 0.0125, "resampling": 1.5})
+    assert header == "loading;dur=12.5, resampling;dur=1500.0"
+
+def test_profile_store(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    with SamplingProfiler(interval=0.001) as profiler:
+        busy_function(0.01)
+
+    profile_id = store.save(profiler, name="test")
+    assert store.find(profile_id, "speedscope") is not None
+    assert store.find(profile_id, "collapsed") is not None
+    assert store.find(profile_id, "svg") is None
+    assert store.find("../../etc/passwd", "collapsed") is None
+    assert store.find("0" * 32, "collapsed") is None
+
+def test_sampling_profiler_follows_other_thread():
+    def worker():
+        profiler.follow()
+        try:
+            busy_function(0.1)
+        finally:
+            profiler.unfollow()
+
+    with SamplingProfiler(interval=0.001) as profiler:
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+    assert any(frame[0] == "worker" for stack in profiler.samples for frame in stack)
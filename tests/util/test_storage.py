@@ -0,0 +1,64 @@
+import io
+import httpx
+import pytest
+import numpy as np
+import pandas as pd
+from app.schemas.exceptions import StorageUploadError
+from app.util.storage import iter_csv_chunks, upload_features
+
+
+@pytest.fixture
+def features_df():
+    data = np.random.rand(130, 6).astype(np.float32)
+    return pd.DataFrame(data, columns=[f"avg_spectrum_b{i}" for i in range(6)])
+
+def storage_client(status_code: int, json_body: dict, captured: dict) -> httpx.AsyncClient:
+    async def handler(request: httpx.Request):
+        captured["content_type"] = request.headers["content-type"]
+        captured["body"] = await request.aread()
+        return httpx.Response(status_code, json=json_body)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_iter_csv_chunks_matches_to_csv(features_df):
+    chunks = list(iter_csv_chunks(features_df, chunk_rows=50))
+    # header + 3 blocks of rows
+    assert len(chunks) == 4
+    assert b"".join(chunks).decode("utf-8") == features_df.to_csv(index=False)
+
+def test_iter_csv_chunks_empty_dataframe():
+    df = pd.DataFrame(columns=["a", "b"])
+    assert b"".join(iter_csv_chunks(df)) == b"a,b\n"
+
+def test_iter_csv_chunks_invalid_chunk_size(features_df):
+    with pytest.raises(ValueError):
+        list(iter_csv_chunks(features_df, chunk_rows=0))
+
+@pytest.mark.asyncio
+async def test_upload_features_success(features_df):
+    captured = {}
+    async with storage_client(200, {"uid": "abc123"}, captured) as client:
+        uid = await upload_features(features_df, "dummy", "http://storage/upload", client=client)
+
+    assert uid == "abc123"
+    assert captured["content_type"].startswith("multipart/form-data; boundary=")
+    assert b'name="csv"; filename="dummy.csv"' in captured["body"]
+
+    # The uploaded part should be exactly the csv representation
+    csv_part = captured["body"].split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+    pd.testing.assert_frame_equal(
+        pd.read_csv(io.BytesIO(csv_part), dtype=np.float32),
+        features_df
+    )
+
+@pytest.mark.asyncio
+async def test_upload_features_storage_failure(features_df):
+    async with storage_client(503, {"detail": "unavailable"}, {}) as client:
+        with pytest.raises(StorageUploadError):
+            await upload_features(features_df, "dummy", "http://storage/upload", client=client)
+
+@pytest.mark.asyncio
+async def test_upload_features_missing_uid(features_df):
+    async with storage_client(200, {"message": "ok"}, {}) as client:
+        with pytest.raises(StorageUploadError, match="uid"):
+            await upload_features(features_df, "dummy", "http://storage/upload", client=client)
@@ -0,0 +1,45 @@
+from app.schemas.data_models import SyntheticCubeSpec, CubeDataType, CubeInterleave
+from app.util.synthetic_cube import generate_cube, encode_envi_cube, synthetic_cube_nbytes
+from app.util.envi_reader import parse_envi_header, read_envi_cube
+from app.util.background_removal import calculate_simple_background_mask
+import numpy as np
+import pytest
+
+WAVELENGTHS = np.linspace(470, 900, 32)
+
+
+def test_generate_cube_shape_and_dtype():
+    spec = SyntheticCubeSpec(rows=70, cols=40, bands=32, objects=2, dtype=CubeDataType.UINT16, seed=1)
+    cube = generate_cube(spec, WAVELENGTHS)
+
+    assert cube.shape == (70, 40, 32)
+    assert cube.dtype == np.uint16
+    assert cube.nbytes == synthetic_cube_nbytes(spec)
+
+def test_generate_cube_is_deterministic():
+    spec = SyntheticCubeSpec(rows=20, cols=20, bands=32, objects=3, dtype=CubeDataType.FLOAT32, seed=7)
+    assert np.array_equal(generate_cube(spec, WAVELENGTHS), generate_cube(spec, WAVELENGTHS))
+
+def test_generate_cube_objects_stand_out():
+    spec = SyntheticCubeSpec(rows=64, cols=64, bands=32, objects=3, dtype=CubeDataType.FLOAT32, seed=3)
+    cube = generate_cube(spec, WAVELENGTHS)
+    mask = calculate_simple_background_mask(cube)
+
+    assert 0 < mask.sum() < mask.size
+
+def test_generate_cube_without_objects():
+    spec = SyntheticCubeSpec(rows=8, cols=8, bands=32, objects=0, dtype=CubeDataType.FLOAT32, seed=3)
+    cube = generate_cube(spec, WAVELENGTHS)
+    assert cube.max() < 0.2
+
+@pytest.mark.parametrize("interleave", list(CubeInterleave))
+@pytest.mark.parametrize("dtype", list(CubeDataType))
+def test_encode_roundtrip(interleave, dtype):
+    spec = SyntheticCubeSpec(rows=9, cols=7, bands=32, objects=1, dtype=dtype, interleave=interleave, seed=5)
+    cube = generate_cube(spec, WAVELENGTHS)
+    hdr_bytes, cube_bytes = encode_envi_cube(cube, WAVELENGTHS, interleave.value)
+
+    header = parse_envi_header(hdr_bytes)
+    assert header["interleave"] == interleave.value
+    assert len(header["wavelength"]) == 32
+    assert np.array_equal(read_envi_cube(header, cube_bytes), cube.astype(np.float32))
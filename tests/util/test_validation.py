@@ -1,6 +1,7 @@
 from fastapi import UploadFile
-from app.schemas.exceptions import InvalidFileFormatError
-from app.util.validation import basic_file_validation
+from app.schemas.exceptions import InvalidFileFormatError, DatasetPathError
+from app.util.validation import basic_file_validation, dataset_file_validation, resolve_dataset_path
+import os
 import pytest
 import numpy as np
 import io
@@ -88,4 +89,46 @@ def test_invalid_cube_file_bin(hdr_file, wrong_bin_file):
 
 def test_invalid_cube_file_raw(hdr_file, wrong_raw_file):
     with pytest.raises(InvalidFileFormatError, match="The provided cube file is invalid - no attribute 'filename'"):
-        result = basic_file_validation(hdr_file=hdr_file, cube_file=wrong_raw_file)
\ No newline at end of file
+        result = basic_file_validation(hdr_file=hdr_file, cube_file=wrong_raw_file)
+
+@pytest.fixture
+def dataset_root(tmp_path):
+    root = tmp_path / "datasets"
+    (root / "scans").mkdir(parents=True)
+    (root / "scans" / "kiwi.hdr").write_bytes(b"ENVI\n")
+    (root / "scans" / "kiwi.bin").write_bytes(b"\x00" * 16)
+    (tmp_path / "secret.bin").write_bytes(b"\x00" * 16)
+    return root
+
+def test_resolve_dataset_path(dataset_root):
+    assert resolve_dataset_path("scans/kiwi.bin", str(dataset_root)) == os.path.realpath(dataset_root / "scans" / "kiwi.bin")
+    assert dataset_file_validation("scans/kiwi.hdr", "./scans/../scans/kiwi.bin", str(dataset_root))[1].endswith("kiwi.bin")
+
+@pytest.mark.parametrize("path", ["../secret.bin", "scans/../../secret.bin", "/etc/passwd", "..", ""])
+def test_dataset_path_traversal_rejected(dataset_root, path):
+    with pytest.raises(DatasetPathError) as e:
+        resolve_dataset_path(path, str(dataset_root))
+    assert e.value.status_code in (400, 403)
+
+def test_dataset_symlink_outside_root_rejected(dataset_root):
+    os.symlink(dataset_root.parent / "secret.bin", dataset_root / "scans" / "link.bin")
+    with pytest.raises(DatasetPathError, match="outside of the dataset root"):
+        resolve_dataset_path("scans/link.bin", str(dataset_root))
+
+def test_dataset_path_missing_or_disabled(dataset_root):
+    with pytest.raises(DatasetPathError) as e:
+        resolve_dataset_path("scans/apple.bin", str(dataset_root))
+    assert e.value.status_code == 404
+    with pytest.raises(DatasetPathError, match="not enabled"):
+        resolve_dataset_path("scans/kiwi.bin", "")
+
+def test_dataset_file_wrong_extension(dataset_root):
+    with pytest.raises(InvalidFileFormatError):
+        dataset_file_validation("scans/kiwi.bin", "scans/kiwi.bin", str(dataset_root))
+
+def test_compressed_cube_file_extension(hdr_file):
+    cube_file = UploadFile(filename="dummy.raw.zst", file=io.BytesIO(b""))
+    assert basic_file_validation(hdr_file=hdr_file, cube_file=cube_file)
+    cube_file = UploadFile(filename="dummy.tif.gz", file=io.BytesIO(b""))
+    with pytest.raises(InvalidFileFormatError, match="Invalid data cube file extension"):
+        basic_file_validation(hdr_file=hdr_file, cube_file=cube_file)